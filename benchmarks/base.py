@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+from aioworker.worker import Worker
+
+from pluggable.socket.app import SocketApp, default_config
+from pluggable.socket.bus import SocketBus
+from pluggable.socket.codec import codecs
+from pluggable.socket.logger import INFO, SocketLogger
+from pluggable.socket.metrics import Metrics
+from pluggable.socket.registry import ConnectionRegistry
+from pluggable.socket.socket import SocketWrapper
+
+
+class _BenchWorker(Worker):
+    pass
+
+
+class BenchApp(SocketApp):
+
+    def __init__(self, worker, config=None):
+        self.config = dict(default_config)
+        self.config.update(config or {})
+        self.loop = asyncio.get_event_loop()
+        # buffered and never flushed, so the timings exclude log output
+        self.logger = SocketLogger(self, self.config["log_level"])
+        self.bus = SocketBus(self, "bench")
+        self.registry = ConnectionRegistry("bench")
+        self.metrics = Metrics(self, self.config["metrics"])
+
+
+def create_app(**config):
+    return BenchApp(_BenchWorker("BROKER"), config)
+
+
+class BenchSocketWrapper(SocketWrapper):
+
+    def __init__(self, app):
+        # no signals, service or sessions backend
+        self.concurrency = app.config["send_concurrency"]
+        self.codec = codecs[app.config["codec"]]
+
+    def _log(self, connection, connection_type):
+        pass
+
+    def log(self, msgs, level=INFO):
+        pass
+
+
+class FakeWebsocket(object):
+    """Simulated client that takes ``latency`` seconds to accept a frame
+    """
+
+    def __init__(self, port, latency=0.0):
+        self.remote_address = ("127.0.0.1", port)
+        self.latency = latency
+        self.received = 0
+
+    async def send(self, msg):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += 1
+
+
+def timed(loop, coro):
+    start = time.perf_counter()
+    loop.run_until_complete(coro)
+    return time.perf_counter() - start
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare per-recipient serialization and sequential writes against
+the encode-once concurrent fan-out in ``SocketWrapper.send``
+
+    python -m benchmarks.broadcast [connections] [latency]
+"""
+
+import asyncio
+import sys
+
+import rapidjson as json
+
+from pluggable.socket.connection import SocketConnection
+
+from .base import (
+    BenchSocketWrapper, FakeWebsocket, create_app, timed)
+
+
+MSG = dict(
+    msg="update",
+    items=[dict(id=i, name="item %s" % i, value=i * 1.5) for i in range(50)])
+
+
+async def sequential(socket, msg):
+    # the pre-fan-out behaviour: encode and await each peer in turn
+    for connection in socket.connections.values():
+        await connection.connection.send(json.dumps(msg))
+
+
+def main(connections=5000, latency=0.001):
+    loop = asyncio.get_event_loop()
+    app = create_app()
+    socket = BenchSocketWrapper(app)
+    socket.connections = {
+        i: SocketConnection(socket, FakeWebsocket(i, latency), "/")
+        for i in range(connections)}
+    baseline = timed(loop, sequential(socket, MSG))
+    for concurrency in (10, 100, 1000):
+        socket.concurrency = concurrency
+        elapsed = timed(loop, socket.send(MSG))
+        print(
+            "connections=%s concurrency=%s sequential=%.3fs "
+            "fanout=%.3fs speedup=%.1fx"
+            % (connections, concurrency, baseline, elapsed,
+               baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main(*[t(a) for t, a in zip((int, float), sys.argv[1:])])
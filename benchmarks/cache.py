@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Requests per second for a slow idempotent command, uncached and with
+its responses ``cached``, when ``clients`` ask for the same few params at
+once
+
+    python -m benchmarks.cache [requests] [clients] [params]
+"""
+
+import asyncio
+import sys
+import time
+from unittest.mock import MagicMock
+
+from pluggable.socket.cache import cached
+from pluggable.socket.runner import SocketRunner
+
+from .base import BenchSocketWrapper, create_app
+
+
+class Counter(object):
+    calls = 0
+
+
+async def lookup(connection, uuid, key=None):
+    Counter.calls += 1
+    await asyncio.sleep(0.005)
+    return dict(response=dict(key=key, value=[key] * 10))
+
+
+async def run(runner, connections, command, requests, params):
+    start = time.perf_counter()
+    for i in range(0, requests, len(connections)):
+        await asyncio.gather(*[
+            runner.execute(
+                connection,
+                "UUID%s" % (i + n),
+                command,
+                dict(key=(i + n) % params))
+            for n, connection in enumerate(connections)])
+    return time.perf_counter() - start
+
+
+def main(requests=20000, clients=100, params=10):
+    loop = asyncio.get_event_loop()
+    app = create_app()
+    app.worker = MagicMock()
+    app.worker.tasks = {}
+    app.commands = dict(
+        lookup=lookup,
+        cached_lookup=cached(ttl=60, size=params)(
+            lambda connection, uuid, key=None: lookup(
+                connection, uuid, key)))
+    app.local = app._local_runner()
+    app.socket = BenchSocketWrapper(app)
+    runner = SocketRunner(app)
+    runner.dispatch.refresh()
+    connections = [
+        app.socket.connect(MagicMock(), "/") for _ in range(clients)]
+    for command in ["lookup", "cached_lookup"]:
+        Counter.calls = 0
+        elapsed = loop.run_until_complete(
+            run(runner, connections, command, requests, params))
+        print(
+            "%s: %.0f requests/s, %s executions, %s coalesced"
+            % (command,
+               requests / elapsed,
+               Counter.calls,
+               runner.cache.coalesced))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Payload size and encode/decode time for each wire codec
+
+    python -m benchmarks.codec [iterations]
+"""
+
+import sys
+import time
+
+from pluggable.socket.codec import codecs
+
+
+FEED = dict(
+    uuid="7d0f4c1e-6b1f-4c9b-8a55-3c3a4f1f2a9e",
+    response=dict(
+        items=[
+            dict(id=i,
+                 created=1546300800 + i,
+                 score=i * 0.25,
+                 tags=["a", "b", "c"],
+                 seen=bool(i % 2),
+                 user=dict(id=i % 17, name="user%s" % (i % 17)))
+            for i in range(200)]))
+
+
+def bench(codec, iterations):
+    frame = codec.encode(FEED)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(FEED)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(frame)
+    decode = time.perf_counter() - start
+    size = len(frame if codec.binary else frame.encode("utf8"))
+    return size, encode, decode
+
+
+def main(iterations=1000):
+    for name, codec in codecs.items():
+        size, encode, decode = bench(codec, iterations)
+        print(
+            "%-8s size=%6sB encode=%.1fus decode=%.1fus"
+            % (name, size,
+               encode / iterations * 1e6,
+               decode / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
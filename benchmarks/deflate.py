@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""CPU time and bytes on the wire of a broadcast to ``peers``
+connections, for JSON messages of a few sizes
+
+Compares sending uncompressed, compressing for each connection with
+its own context as permessage-deflate does by default, and compressing
+once with ``Deflate`` for connections that do not take over the context.
+
+    python -m benchmarks.deflate [peers] [rounds]
+"""
+
+import sys
+import time
+import zlib
+
+import rapidjson as json
+
+from pluggable.socket.deflate import Deflate
+
+
+def message(size):
+    items = []
+    while len(json.dumps(items)) < size:
+        items.append(dict(id=len(items), name="item%s" % len(items), ok=True))
+    return json.dumps(dict(broadcast=items))
+
+
+def uncompressed(msg, peers, rounds):
+    start = time.process_time()
+    sent = 0
+    for _ in range(rounds):
+        data = msg.encode("utf8")
+        sent += len(data) * peers
+    return time.process_time() - start, sent
+
+
+def per_connection(msg, peers, rounds):
+    compressors = [
+        zlib.compressobj(6, zlib.DEFLATED, -15) for _ in range(peers)]
+    start = time.process_time()
+    sent = 0
+    for _ in range(rounds):
+        data = msg.encode("utf8")
+        for compressor in compressors:
+            sent += len(
+                compressor.compress(data)
+                + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return time.process_time() - start, sent
+
+
+def shared(msg, peers, rounds):
+    deflate = Deflate(threshold=0)
+    start = time.process_time()
+    sent = 0
+    for _ in range(rounds):
+        sent += len(deflate.compress(msg)) * peers
+    return time.process_time() - start, sent
+
+
+def main(peers=1000, rounds=10):
+    for size in [256, 4096, 65536]:
+        msg = message(size)
+        baseline = None
+        for name, run in [
+                ("uncompressed", uncompressed),
+                ("per_connection", per_connection),
+                ("shared", shared)]:
+            cpu, sent = run(msg, peers, rounds)
+            baseline = baseline or sent
+            print(
+                "%6s bytes %-14s cpu=%.3fms/broadcast wire=%.1f%%"
+                % (len(msg),
+                   name,
+                   cpu / rounds * 1e3,
+                   sent / baseline * 100))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-message overhead of routing a request through ``SocketRunner.run``
+to a local command that does nothing
+
+    python -m benchmarks.dispatch [iterations] [commands]
+"""
+
+import asyncio
+import sys
+import time
+from unittest.mock import MagicMock
+
+from pluggable.socket.runner import SocketRunner
+
+from .base import BenchSocketWrapper, create_app
+
+
+async def noop(connection, uuid, **kwargs):
+    pass
+
+
+async def run(runner, connection, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await runner.run(connection, uuid="UUID", command="noop")
+    return time.perf_counter() - start
+
+
+def main(iterations=100000, commands=500):
+    loop = asyncio.get_event_loop()
+    app = create_app()
+    app.worker = MagicMock()
+    app.worker.tasks = {"task%s" % i: MagicMock() for i in range(commands)}
+    app.commands = {"local%s" % i: noop for i in range(commands)}
+    app.commands["noop"] = noop
+    app.local = app._local_runner()
+    app.socket = BenchSocketWrapper(app)
+    runner = SocketRunner(app)
+    runner.dispatch.refresh()
+    connection = app.socket.connect(MagicMock(), "/")
+    elapsed = loop.run_until_complete(run(runner, connection, iterations))
+    print(
+        "commands=%s dispatch=%.2fus/message"
+        % (len(runner.dispatch), elapsed / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
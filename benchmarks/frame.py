@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cost of wrapping a pre-encoded JSON payload in a response envelope,
+as a formatted ``str`` (which the websocket then encodes again) and as
+a ``Frame``
+
+    python -m benchmarks.frame [size_kb] [iterations]
+"""
+
+import sys
+import time
+
+import rapidjson as json
+
+from pluggable.socket.codec import codecs
+
+
+def formatted(uuid, payload):
+    return (
+        '{"uuid": "%s", "response": %s}'
+        % (uuid, payload.decode("utf8"))).encode("utf8")
+
+
+def framed(uuid, payload):
+    return codecs["json"].envelope(uuid, payload).parts()
+
+
+def main(size_kb=1024, iterations=200):
+    payload = json.dumps(
+        ["x" * 1000 for _ in range(size_kb)]).encode("utf8")
+    for wrap in (formatted, framed):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            wrap("UUID", payload)
+        elapsed = time.perf_counter() - start
+        print(
+            "%s payload=%sKB envelope=%.1fus"
+            % (wrap.__name__, size_kb, elapsed / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
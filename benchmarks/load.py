@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load test of a real ``SocketApp`` serving stub local commands and an
+in-process fake worker, driven over websockets by ``clients`` concurrent
+clients
+
+The app runs in a child process so its memory can be measured on its
+own. The scenarios are a connect storm, request/response to a local
+command and to a worker task, broadcast fan-out and large payloads.
+Results are printed as JSON, for comparison between releases.
+
+    python -m benchmarks.load [clients] [requests] [payload_kb] > load.json
+"""
+
+import asyncio
+import platform
+import resource
+import socket
+import sys
+import time
+
+import rapidjson as json
+import websockets
+
+from pluggable.socket.runner import SocketRunner
+
+from .base import BenchApp, _BenchWorker
+
+
+class BenchRunner(SocketRunner):
+    # clients send as fast as they are answered
+    max_request_rate = 1e9
+
+
+class LoadApp(BenchApp):
+
+    def _runner(self):
+        return BenchRunner(self)
+
+
+class Signals(object):
+
+    def listen(self, signal, handler):
+        pass
+
+    def emit(self, signal, *args):
+        pass
+
+
+class Sessions(object):
+
+    def get(self, key):
+        return None
+
+
+class FakeTask(object):
+
+    async def call(self, request=None, **kwargs):
+        await asyncio.sleep(0)
+        return request.params if request is not None else None
+
+
+class FakeWorker(object):
+
+    def __init__(self):
+        self.tasks = dict(work=FakeTask(), log=FakeTask())
+
+
+def create_server(port):
+    app = LoadApp(
+        _BenchWorker("BROKER"),
+        dict(ip="127.0.0.1",
+             port=port,
+             log_level="warning",
+             request_burst=1e9,
+             max_in_flight=64))
+    app.worker = FakeWorker()
+    app.signals = Signals()
+    app.sessions = Sessions()
+    payloads = {}
+
+    async def echo(connection, uuid, **params):
+        return dict(response=params)
+
+    async def payload(connection, uuid, size=1024):
+        # pre-encoded, as a worker sending large results would
+        if size not in payloads:
+            payloads[size] = b'"%s"' % (b"x" * size)
+        return payloads[size]
+
+    async def broadcast(connection, uuid, seq=0):
+        await app.socket.send(dict(broadcast=seq), None)
+        return dict(response=dict(sent=seq))
+
+    app.commands = dict(echo=echo, payload=payload, broadcast=broadcast)
+    app.local = app._local_runner()
+    return app
+
+
+def serve(port):
+    raise_fd_limit()
+    app = create_server(port)
+    app.serve()
+    app.loop.run_forever()
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss(pid):
+    with open("/proc/%s/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+
+def latencies(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return dict(
+        p50=values[int(len(values) * 0.5)],
+        p90=values[int(len(values) * 0.9)],
+        p99=values[int(len(values) * 0.99)],
+        max=values[-1])
+
+
+class Client(object):
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.uuid = 0
+
+    async def request(self, command, **params):
+        self.uuid += 1
+        uuid = "%s:%s" % (id(self), self.uuid)
+        await self.websocket.send(
+            json.dumps(dict(uuid=uuid, command=command, params=params)))
+        while True:
+            msg = json.loads(await self.websocket.recv())
+            if msg.get("uuid") == uuid:
+                return msg
+
+    async def receive(self, key, value):
+        while True:
+            msg = json.loads(await self.websocket.recv())
+            if msg.get(key) == value:
+                return msg
+
+
+async def timed_connect(url):
+    start = time.perf_counter()
+    try:
+        websocket = await websockets.connect(url, max_size=None)
+    except (OSError, websockets.exceptions.WebSocketException):
+        return None, time.perf_counter() - start
+    return Client(websocket), time.perf_counter() - start
+
+
+async def wait_for_server(url, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        client, _ = await timed_connect(url)
+        if client is not None:
+            return client
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start at %s" % url)
+
+
+async def connect_storm(url, pid, count):
+    before = rss(pid)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[timed_connect(url) for _ in range(count)])
+    elapsed = time.perf_counter() - start
+    clients = [client for client, _ in results if client is not None]
+    # let the server settle its per-connection state
+    await asyncio.sleep(0.5)
+    after = rss(pid)
+    return clients, dict(
+        clients=count,
+        connected=len(clients),
+        failed=count - len(clients),
+        seconds=elapsed,
+        connects_per_second=len(clients) / elapsed,
+        latency=latencies([latency for _, latency in results]),
+        server_rss_before=before,
+        server_rss_after=after,
+        bytes_per_connection=(after - before) / max(len(clients), 1))
+
+
+async def request_response(clients, command, requests, **params):
+    times, errors = [], []
+
+    async def run(client):
+        for _ in range(requests):
+            start = time.perf_counter()
+            msg = await client.request(command, **params)
+            times.append(time.perf_counter() - start)
+            if "error" in msg:
+                errors.append(msg["error"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run(client) for client in clients])
+    elapsed = time.perf_counter() - start
+    return dict(
+        clients=len(clients),
+        requests=len(times),
+        errors=len(errors),
+        seconds=elapsed,
+        messages_per_second=len(times) / elapsed,
+        latency=latencies(times))
+
+
+async def broadcast(clients, rounds):
+    sender, times = clients[0], []
+    start = time.perf_counter()
+    for seq in range(rounds):
+        sent = time.perf_counter()
+
+        async def deliver(client):
+            await client.receive("broadcast", seq)
+            times.append(time.perf_counter() - sent)
+
+        # the sender's own copy arrives before the command's response
+        await asyncio.gather(
+            sender.request("broadcast", seq=seq),
+            *[deliver(client) for client in clients[1:]])
+    elapsed = time.perf_counter() - start
+    return dict(
+        clients=len(clients),
+        rounds=rounds,
+        seconds=elapsed,
+        deliveries_per_second=len(times) / elapsed,
+        latency=latencies(times))
+
+
+async def large_payload(clients, requests, size):
+    result = await request_response(clients, "payload", requests, size=size)
+    result["payload_bytes"] = size
+    result["megabytes_per_second"] = (
+        result["requests"] * size / result["seconds"] / 1e6)
+    return result
+
+
+async def run(clients, requests, payload_kb):
+    port = free_port()
+    url = "ws://127.0.0.1:%s/" % port
+    server = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.load", "--serve", str(port))
+    try:
+        control = await wait_for_server(url)
+        connected, storm = await connect_storm(url, server.pid, clients)
+        results = dict(connect_storm=storm)
+        results["request_response_local"] = await request_response(
+            connected, "echo", requests, value=7)
+        results["request_response_worker"] = await request_response(
+            connected, "work", requests, value=7)
+        results["broadcast"] = await broadcast(
+            [control] + connected, max(requests // 10, 1))
+        results["large_payload"] = await large_payload(
+            connected[:max(len(connected) // 10, 1)],
+            max(requests // 10, 1),
+            payload_kb * 1024)
+        stats = await control.request("stats")
+        results["server"] = dict(
+            stats.get("stats", {}),
+            rss=rss(server.pid))
+        await asyncio.gather(*[
+            client.websocket.close() for client in [control] + connected])
+        return results
+    finally:
+        server.terminate()
+        await server.wait()
+
+
+def main(clients=1000, requests=100, payload_kb=256):
+    fd_limit = raise_fd_limit()
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run(clients, requests, payload_kb))
+    print(json.dumps(
+        dict(benchmark="load",
+             timestamp=time.time(),
+             python=platform.python_version(),
+             platform=platform.platform(),
+             parameters=dict(
+                 clients=clients,
+                 requests=requests,
+                 payload_kb=payload_kb,
+                 fd_limit=fd_limit),
+             results=results),
+        indent=2))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]))
+    else:
+        main(*[int(a) for a in sys.argv[1:]])
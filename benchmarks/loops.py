@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Connect rate and message round trip of a ``SocketApp`` on the asyncio
+and uvloop event loops, with the server and clients sharing the loop
+
+    python -m benchmarks.loops [clients] [requests]
+"""
+
+import os
+import sys
+
+from pluggable.socket.app import event_loop
+
+from .load import (
+    connect_storm, create_server, free_port, raise_fd_limit,
+    request_response, wait_for_server)
+
+
+async def run(clients, requests):
+    port = free_port()
+    url = "ws://127.0.0.1:%s/" % port
+    app = create_server(port)
+    app.serve()
+    control = await wait_for_server(url)
+    connected, storm = await connect_storm(url, os.getpid(), clients)
+    rtt = await request_response(connected, "echo", requests, value=7)
+    for client in [control] + connected:
+        await client.websocket.close()
+    return storm, rtt
+
+
+def main(clients=500, requests=100):
+    raise_fd_limit()
+    for name in ["asyncio", "uvloop"]:
+        loop = event_loop(name)
+        storm, rtt = loop.run_until_complete(run(clients, requests))
+        print(
+            "%s: connects=%.0f/s round_trips=%.0f/s "
+            "p50=%.3fms p99=%.3fms"
+            % (name,
+               storm["connects_per_second"],
+               rtt["messages_per_second"],
+               rtt["latency"]["p50"] * 1e3,
+               rtt["latency"]["p99"] * 1e3))
+        loop.close()
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
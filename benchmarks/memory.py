@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Memory held per idle connection by ``SocketWrapper.connections``
+
+Compares the state as kept on the typed ``SocketConnection`` against
+the former ``dict(socket=..., connection=..., session=...)`` entry kept
+for each connection alongside it.
+
+    python -m benchmarks.memory [connections]
+"""
+
+import sys
+import tracemalloc
+
+from pluggable.socket.connection import SocketConnection
+
+from .base import BenchSocketWrapper, FakeWebsocket, create_app
+
+
+def measure(socket, connections, entry):
+    websockets = [FakeWebsocket(i) for i in range(connections)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    socket.connections = {}
+    for i, websocket in enumerate(websockets):
+        connection = SocketConnection(socket, websocket, "/")
+        connection.session = "session%s" % i
+        socket.connections[i] = entry(connection)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    socket.connections = {}
+    return (after - before) / connections
+
+
+def main(connections=100000):
+    socket = BenchSocketWrapper(create_app())
+    typed = measure(socket, connections, lambda c: c)
+    nested = measure(
+        socket,
+        connections,
+        lambda c: dict(socket=c.connection, connection=c, session=c.session))
+    print(
+        "connections=%s dict=%.0fB typed=%.0fB saved=%.0fB (%.0f%%)"
+        % (connections, nested, typed, nested - typed,
+           100 * (nested - typed) / nested))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cost of recording a latency, and the overhead of metrics on the
+per-message dispatch path, with ``metrics`` enabled and disabled
+
+    python -m benchmarks.metrics [iterations]
+"""
+
+import asyncio
+import sys
+import time
+from unittest.mock import MagicMock
+
+from pluggable.socket.metrics import Histogram
+from pluggable.socket.runner import SocketRunner
+
+from .base import BenchSocketWrapper, create_app
+from .dispatch import noop, run
+
+
+def record(iterations):
+    histogram = Histogram()
+    start = time.perf_counter()
+    for i in range(iterations):
+        histogram.record(i * 1e-7)
+    return (time.perf_counter() - start) / iterations
+
+
+def dispatch(loop, iterations, enabled):
+    app = create_app(metrics=enabled)
+    app.worker = MagicMock()
+    app.worker.tasks = {}
+    app.commands = dict(noop=noop)
+    app.local = app._local_runner()
+    app.socket = BenchSocketWrapper(app)
+    runner = SocketRunner(app)
+    runner.dispatch.refresh()
+    connection = app.socket.connect(MagicMock(), "/")
+    return loop.run_until_complete(
+        run(runner, connection, iterations)) / iterations
+
+
+def main(iterations=100000):
+    loop = asyncio.get_event_loop()
+    print("record=%.3fus" % (record(iterations) * 1e6))
+    # best of a few runs, as the difference is small
+    disabled = min(dispatch(loop, iterations, False) for _ in range(3))
+    enabled = min(dispatch(loop, iterations, True) for _ in range(3))
+    print(
+        "dispatch disabled=%.2fus enabled=%.2fus overhead=%.1f%%"
+        % (disabled * 1e6,
+           enabled * 1e6,
+           (enabled - disabled) / disabled * 100))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
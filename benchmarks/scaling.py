@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Request/response throughput against 1..``processes`` server processes
+sharing one port with ``SO_REUSEPORT``
+
+Each server decodes and answers requests with the app codec, as a local
+command would. Clients run in their own processes so that they do not
+compete with the servers for a single core.
+
+    python -m benchmarks.scaling [processes] [clients] [seconds]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import websockets
+
+from pluggable.socket.codec import codecs
+
+
+PORT = 7787
+CONNECTIONS = 10
+
+
+def serve(port):
+    codec = codecs["json"]
+
+    async def handler(websocket, path):
+        async for msg in websocket:
+            request = codec.decode(msg)
+            await websocket.send(
+                codec.encode(dict(uuid=request["uuid"], response="ok")))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(
+        websockets.serve(handler, "127.0.0.1", port, reuse_port=True))
+    loop.run_forever()
+
+
+async def _client(port, deadline, counts):
+    async with websockets.connect("ws://127.0.0.1:%s" % port) as websocket:
+        uuid = 0
+        while time.monotonic() < deadline:
+            uuid += 1
+            await websocket.send(
+                '{"uuid":%s,"command":"echo","params":{}}' % uuid)
+            await websocket.recv()
+            counts[0] += 1
+
+
+def client(port, seconds, results):
+    counts = [0]
+    deadline = time.monotonic() + seconds
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(
+        asyncio.gather(
+            *[_client(port, deadline, counts)
+              for _ in range(CONNECTIONS)]))
+    results.put(counts[0])
+
+
+def run(processes, clients, seconds):
+    servers = [
+        multiprocessing.Process(target=serve, args=(PORT, ), daemon=True)
+        for _ in range(processes)]
+    for server in servers:
+        server.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=client, args=(PORT, seconds, results))
+        for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    total = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    for server in servers:
+        server.terminate()
+        server.join()
+    return total / seconds
+
+
+def main(processes=os.cpu_count(), clients=None, seconds=5.0):
+    clients = clients or processes
+    baseline = None
+    for count in range(1, processes + 1):
+        rate = run(count, clients, seconds)
+        baseline = baseline or rate
+        print(
+            "processes=%s clients=%s requests/s=%.0f scaling=%.2fx"
+            % (count, clients, rate, rate / baseline))
+
+
+if __name__ == "__main__":
+    main(*[t(a) for t, a in zip((int, int, float), sys.argv[1:])])
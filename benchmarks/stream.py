@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Time to first frame and peak memory for a large result, sent whole
+or streamed in chunks with ``ResponseStream``
+
+    python -m benchmarks.stream [rows] [chunk]
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from pluggable.socket.connection import SocketConnection
+from pluggable.socket.stream import ResponseStream
+
+from .base import BenchSocketWrapper, FakeWebsocket, create_app
+
+
+def row(i):
+    return dict(id=i, name="row %s" % i, value=i * 1.5, tags=["a", "b"])
+
+
+class BenchConnection(SocketConnection):
+
+    def __init__(self, *args):
+        self.first = None
+        self.frames = 0
+
+    async def write(self, frame, key=None):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.frames += 1
+
+
+async def whole(connection, rows, chunk):
+    result = [row(i) for i in range(rows)]
+    await connection.write(
+        connection.codec.encode(dict(uuid="UUID", response=result)))
+
+
+async def streamed(connection, rows, chunk):
+
+    async def chunks():
+        for start in range(0, rows, chunk):
+            yield [row(i) for i in range(start, min(start + chunk, rows))]
+
+    await ResponseStream(connection, "UUID", chunks()).run()
+
+
+def measure(loop, socket, send, rows, chunk):
+    connection = BenchConnection(socket, FakeWebsocket(0), "/")
+    tracemalloc.start()
+    start = time.perf_counter()
+    loop.run_until_complete(send(connection, rows, chunk))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return connection.first - start, elapsed, peak, connection.frames
+
+
+def main(rows=100000, chunk=1000):
+    loop = asyncio.get_event_loop()
+    socket = BenchSocketWrapper(create_app())
+    for send in (whole, streamed):
+        first, elapsed, peak, frames = measure(
+            loop, socket, send, rows, chunk)
+        print(
+            "%s rows=%s frames=%s first=%.1fms total=%.1fms peak=%.1fMB"
+            % (send.__name__, rows, frames, first * 1e3, elapsed * 1e3,
+               peak / 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
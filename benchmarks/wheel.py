@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cost of idle timers for ``connections`` connections, on the shared
+``TimerWheel`` against a ``loop.call_later`` handle per connection
+
+Each connection is scheduled, then rescheduled as if it had activity,
+and the memory held by the timers is measured.
+
+    python -m benchmarks.wheel [connections]
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from pluggable.socket.wheel import TimerWheel
+
+
+def noop(key):
+    pass
+
+
+def wheel(loop, connections):
+    timers = TimerWheel(1.0, 512, noop)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for key in range(connections):
+        timers.schedule(key, 30)
+    scheduled = time.perf_counter()
+    for key in range(connections):
+        timers.schedule(key, 30)
+    rescheduled = time.perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for _ in range(512):
+        timers.advance()
+    advanced = time.perf_counter()
+    return (
+        (scheduled - start) / connections,
+        (rescheduled - scheduled) / connections,
+        (advanced - rescheduled) / 512,
+        memory / connections)
+
+
+def handles(loop, connections):
+    tracemalloc.start()
+    start = time.perf_counter()
+    timers = [loop.call_later(30, noop, key) for key in range(connections)]
+    scheduled = time.perf_counter()
+    for key in range(connections):
+        timers[key].cancel()
+        timers[key] = loop.call_later(30, noop, key)
+    rescheduled = time.perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for timer in timers:
+        timer.cancel()
+    # cancelled handles stay in the loop until they are due or purged
+    loop.run_until_complete(asyncio.sleep(0))
+    return (
+        (scheduled - start) / connections,
+        (rescheduled - scheduled) / connections,
+        None,
+        memory / connections)
+
+
+def main(connections=100000):
+    loop = asyncio.get_event_loop()
+    for name, run in [("wheel", wheel), ("call_later", handles)]:
+        schedule, reschedule, tick, memory = run(loop, connections)
+        print(
+            "%s: schedule=%.3fus reschedule=%.3fus%s bytes=%.0f"
+            % (name,
+               schedule * 1e6,
+               reschedule * 1e6,
+               " tick=%.3fus" % (tick * 1e6) if tick is not None else "",
+               memory))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
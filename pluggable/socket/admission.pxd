@@ -0,0 +1,23 @@
+
+from .connection cimport SocketConnection
+
+
+cdef class Admission:
+     cdef public runner
+     cdef public int limit
+     cdef public int global_limit
+     cdef public int max_pending
+     cdef public double timeout
+     cdef public int running
+     cdef public waiting
+     cdef public bint closed
+     cpdef bint available(self, SocketConnection connection) except -1
+     cpdef bint submit(
+         self, SocketConnection connection, dict msg) except -1
+     cpdef start(self, SocketConnection connection, dict msg, double wait=*)
+     cpdef int reserve(
+         self, SocketConnection connection, int count) except -1
+     cpdef release(self, SocketConnection connection)
+     cpdef done(self, SocketConnection connection, task)
+     cpdef freed(self, SocketConnection connection)
+     cpdef resume(self, SocketConnection connection)
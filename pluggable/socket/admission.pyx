@@ -0,0 +1,138 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+from collections import OrderedDict
+from functools import partial
+
+from .connection cimport SocketConnection
+from .limits cimport monotonic
+
+
+# the keys of a request, which are passed to ``SocketRunner.run``
+REQUEST_KEYS = frozenset([
+    "uuid",
+    "cmd",
+    "command",
+    "params",
+    "batch",
+    "ordered",
+    "combine",
+    "window",
+    "timeout"])
+
+
+cdef class Admission(object):
+    """Bounds the number of in-flight commands
+
+    At most ``limit`` commands run per connection, and ``global_limit``
+    across the app. Requests over either limit wait in the connection's
+    ``pending`` queue for up to ``timeout`` seconds, and are rejected as
+    ``overloaded`` if the queue is full, queueing is disabled or their
+    deadline has passed by the time a slot frees up. The time requests
+    waited is recorded as the ``queue`` stage of the app's metrics, and
+    taken off the ``timeout`` the client sent with them, if any.
+    Once ``closed``, while the app drains, new requests are rejected as
+    ``draining``, and requests with keys the runner does not take as
+    ``invalid_request``. A batch runs as one request, and ``reserve``s
+    any more slots for its commands to run concurrently in.
+    """
+
+    def __cinit__(
+            self,
+            runner,
+            int limit,
+            int global_limit,
+            int max_pending=0,
+            double timeout=0):
+        self.runner = runner
+        self.limit = limit
+        self.global_limit = global_limit
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.waiting = OrderedDict()
+
+    cpdef bint available(self, SocketConnection connection) except -1:
+        return (
+            len(connection.tasks) + connection.held < self.limit
+            and self.running < self.global_limit)
+
+    cpdef bint submit(self, SocketConnection connection, dict msg) except -1:
+        if not REQUEST_KEYS.issuperset(msg):
+            connection.reject(msg.get("uuid"), "invalid_request")
+            return False
+        if self.closed:
+            connection.reject(msg.get("uuid"), "draining")
+            return False
+        if not connection.pending and self.available(connection):
+            self.start(connection, msg)
+            return True
+        if self.timeout > 0 and len(connection.pending) < self.max_pending:
+            connection.pending.append((monotonic() + self.timeout, msg))
+            if self.running >= self.global_limit:
+                self.waiting[connection] = None
+            return True
+        connection.reject(msg.get("uuid"), "overloaded")
+        return False
+
+    cpdef start(self, SocketConnection connection, dict msg, double wait=0):
+        metrics = self.runner.app.metrics
+        metrics.observe("queue", metrics.label(msg), wait)
+        timeout = msg.get("timeout")
+        if wait > 0 and type(timeout) in [int, float] and timeout > 0:
+            if wait >= timeout:
+                connection.reject(msg.get("uuid"), "timeout")
+                return
+            msg = dict(msg, timeout=timeout - wait)
+        task = self.runner.app.loop.create_task(
+            self.runner.run(connection, **msg))
+        connection.tasks[task] = msg.get("uuid")
+        self.running += 1
+        task.add_done_callback(partial(self.done, connection))
+
+    cpdef int reserve(
+            self,
+            SocketConnection connection,
+            int count) except -1:
+        """Take up to ``count`` free slots for ``connection``, leaving
+        any for the requests already queued, and return how many were
+        taken
+        """
+        cdef int taken = 0
+        while (taken < count
+               and not connection.pending
+               and self.available(connection)):
+            connection.held += 1
+            self.running += 1
+            taken += 1
+        return taken
+
+    cpdef release(self, SocketConnection connection):
+        connection.held -= 1
+        self.freed(connection)
+
+    cpdef done(self, SocketConnection connection, task):
+        if connection.tasks.pop(task, False) is False:
+            return
+        self.freed(connection)
+
+    cpdef freed(self, SocketConnection connection):
+        self.running -= 1
+        self.resume(connection)
+        while self.waiting and self.running < self.global_limit:
+            self.resume(self.waiting.popitem(last=False)[0])
+
+    cpdef resume(self, SocketConnection connection):
+        cdef double now = monotonic()
+        while connection.pending and self.available(connection):
+            deadline, msg = connection.pending.popleft()
+            if deadline < now:
+                connection.reject(msg.get("uuid"), "overloaded")
+            else:
+                self.start(connection, msg, now - deadline + self.timeout)
+        if connection.pending and self.running >= self.global_limit:
+            self.waiting[connection] = None
+
+
+class Py__Admission(Admission):
+    pass
@@ -1,16 +1,35 @@
 
 from pluggable.core.app cimport App
 
+from .bus cimport SocketBus
+from .registry cimport ConnectionRegistry
 from .socket cimport SocketWrapper
+from .supervisor cimport SocketSupervisor
 from .runner cimport SocketRunner
 from .local cimport LocalRunner
+from .logger cimport SocketLogger
+from .metrics cimport Metrics
+from .drain cimport Drain
 
 
 cdef class SocketApp(App):
     cdef public local
     cdef public socket
     cdef public runner
+    cdef public logger
+    cdef public bus
+    cdef public registry
+    cdef public supervisor
+    cdef public metrics
+    cdef public drain
+    cdef public server
     cpdef serve(self)
+    cpdef SocketBus _bus(self)
+    cpdef ConnectionRegistry _registry(self)
+    cpdef SocketSupervisor _supervisor(self)
+    cpdef Metrics _metrics(self)
+    cpdef Drain _drain(self)
+    cpdef SocketLogger _logger(self)
     cpdef SocketWrapper _wrapper(self)
     cpdef SocketRunner _runner(self)
     cpdef LocalRunner _local_runner(self)
@@ -2,13 +2,27 @@
 # cython: linetrace=True
 # cython: binding=True
 
+from __future__ import absolute_import
+
+import asyncio
 from importlib import import_module
+from os import environ, getpid
+from socket import gethostname
 
+import uvloop
 import websockets
 
+from .bus cimport SocketBus, RedisBus
+from .registry cimport ConnectionRegistry, RedisRegistry
 from .socket cimport SocketWrapper
+from .supervisor cimport SocketSupervisor
+from .supervisor import WORKER_ENV, serving
 from .runner cimport SocketRunner
 from .local cimport LocalRunner
+from .logger cimport SocketLogger
+from .metrics cimport Metrics
+from .drain cimport Drain
+from .drain import ready
 
 from pluggable.core.app cimport App
 
@@ -17,14 +31,87 @@ default_config = (
     ('plugins', ()),
     ('ip', '0.0.0.0'),
     ('port', '7777'),
+    ('backlog', 1024),
+    ('tcp_nodelay', True),
+    ('max_size', 2 ** 20),
+    ('max_queue', 32),
+    ('read_limit', 2 ** 16),
+    ('write_limit', 2 ** 16),
+    ('write_low_water', None),
+    ('compression', 'deflate'),
+    ('compression_threshold', 1024),
+    ('compression_level', 6),
+    ('compression_shared', True),
+    ('ping_interval', 20),
+    ('heartbeat_interval', 0),
+    ('idle_timeout', 0),
+    ('timer_tick', 1.0),
+    ('timer_slots', 512),
     ('worker', 'redis://redis/3'),
+    ('loop', 'asyncio'),
+    ('processes', 1),
+    ('node', None),
+    ('node_id', None),
+    ('bus', None),
+    ('bus_channel', 'pluggable.socket'),
+    ('registry', None),
+    ('registry_prefix', 'pluggable.socket'),
+    ('codec', 'json'),
+    ('session_cache_size', 10000),
+    ('session_cache_ttl', 60.0),
+    ('response_cache', None),
+    ('log_level', 'info'),
+    ('log_buffer', 10000),
+    ('log_interval', 1.0),
+    ('log_sample', 1),
+    ('metrics', True),
+    ('metrics_port', 0),
+    ('send_concurrency', 100),
+    ('send_queue_size', 256),
+    ('send_queue_policy', 'disconnect'),
+    ('coalesce_window', 0),
+    ('max_subscriptions', 100),
+    ('request_burst', 120),
+    ('session_rate', 120),
+    ('session_burst', 240),
+    ('command_rates', {}),
+    ('max_in_flight', 16),
+    ('max_in_flight_global', 1024),
+    ('max_pending', 64),
+    ('pending_timeout', 5.0),
+    ('drain_grace', 30.0),
+    ('reconnect_min', 1.0),
+    ('reconnect_max', 10.0),
+    ('handoff', False),
+    ('command_timeout', 60.0),
     ('caches', dict(
         session="redis://redis/1",
         l10n="redis://redis/2")))
 
 
+def event_loop(str name="asyncio") -> asyncio.AbstractEventLoop:
+    """Install the event loop policy ``name``, returning a new loop set
+    as the current one
+    """
+    if name == "uvloop":
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif name == "asyncio":
+        asyncio.set_event_loop_policy(None)
+    else:
+        raise ValueError("Unknown event loop: %s" % name)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
 cdef class SocketApp(App):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the configured loop replaces the default before the app runs
+        if self.config.get("loop", "asyncio") != "asyncio":
+            self.loop = event_loop(self.config["loop"])
+
     @property
     def default_config(self):
         return default_config
@@ -37,10 +124,86 @@ cdef class SocketApp(App):
         self.hooks['worker'] = self.create_hook()
 
     cpdef serve(self):
+        self.logger = self._logger()
+        self.logger.start(self.loop)
+        if self.config["processes"] > 1 and WORKER_ENV not in environ:
+            if not self.config["bus"]:
+                # broadcasts would only reach the process that received
+                # them
+                raise ValueError("More than one process requires a bus")
+            self.supervisor = self._supervisor()
+            self.loop.create_task(self.supervisor.run())
+            return
+        self.bus = self._bus()
+        self.registry = self._registry()
+        self.metrics = self._metrics()
         self.socket = self._wrapper()
+        # built-in commands, unless a plugin provides its own
+        self.commands = dict(self.socket.builtins, **(self.commands or {}))
         self.runner = self._runner()
+        self.runner.dispatch.refresh()
+        self.signals.listen('plugins.change', self.on_plugins_change)
+        self.drain = self._drain()
+        self.drain.listen()
         self.loop.create_task(self.connect())
 
+    cpdef SocketBus _bus(self):
+        node = self.config["node"]
+        if not node:
+            node = "%s:%s" % (gethostname(), getpid())
+        elif WORKER_ENV in environ:
+            # worker processes share the configured name, and would drop
+            # each other's messages as their own
+            node = "%s:%s" % (node, environ[WORKER_ENV])
+        if self.config["bus"]:
+            return RedisBus(
+                self,
+                node,
+                self.config["bus"],
+                self.config["bus_channel"])
+        return SocketBus(self, node)
+
+    cpdef ConnectionRegistry _registry(self):
+        if self.config["registry"]:
+            return RedisRegistry(
+                self.bus.node,
+                None,
+                self.config["registry"],
+                self.config["registry_prefix"])
+        return ConnectionRegistry(self.bus.node)
+
+    cpdef SocketSupervisor _supervisor(self):
+        return SocketSupervisor(self, self.config["processes"])
+
+    cpdef Metrics _metrics(self):
+        port = self.config["metrics_port"]
+        if port and WORKER_ENV in environ:
+            # each worker process serves its own metrics
+            port = int(port) + int(environ[WORKER_ENV])
+        return Metrics(
+            self,
+            self.config["metrics"],
+            self.config["ip"],
+            int(port or 0))
+
+    cpdef Drain _drain(self):
+        # worker processes share the port, so are restarted one at a time
+        # by the supervisor rather than handed off
+        return Drain(
+            self,
+            self.config["drain_grace"],
+            self.config["reconnect_min"],
+            self.config["reconnect_max"],
+            self.config["handoff"] and WORKER_ENV not in environ)
+
+    cpdef SocketLogger _logger(self):
+        return SocketLogger(
+            self,
+            self.config["log_level"],
+            self.config["log_buffer"],
+            self.config["log_interval"],
+            self.config["log_sample"])
+
     cpdef SocketWrapper _wrapper(self):
         return SocketWrapper(self)
 
@@ -51,7 +214,13 @@ cdef class SocketApp(App):
         return LocalRunner(self)
 
     async def connect(self) -> websockets.WebSocketServerProtocol:
-        return await self.socket.serve()
+        await self.bus.start()
+        await self.registry.start()
+        await self.metrics.serve()
+        self.server = await self.socket.serve()
+        ready()
+        serving()
+        return self.server
 
     async def on_start(self) -> None:
         await self.hooks["caches"].gather(self.caches)
@@ -62,6 +231,27 @@ cdef class SocketApp(App):
         self.local = self._local_runner()
         self.serve()
 
+    async def on_plugins_change(self, signal: str, *args) -> None:
+        """Gather the local commands and worker tasks again, and update
+        the dispatch index for those that were added, changed or removed
+        """
+        for task in self.hooks['tasks.worker'].gather().values():
+            import_module(task)
+        self.commands = dict(
+            self.socket.builtins,
+            **self.hooks['tasks.local'].gather())
+        self.runner.dispatch.refresh()
+
+    async def invalidate(
+            self,
+            str command,
+            dict params=None,
+            session=None) -> None:
+        """Drop cached responses of ``command`` on all nodes, or only
+        those for ``params`` and/or ``session`` if given
+        """
+        await self.runner.cache.invalidate(command, params, session)
+
     def log(self, *msgs) -> None:
         print('app: ' + ' '.join(str(m) for m in msgs))
 
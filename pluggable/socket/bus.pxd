@@ -0,0 +1,15 @@
+
+cdef class SocketBus:
+     cdef public app
+     cdef public str node
+     cdef public dict handlers
+     cdef public bint remote
+     cpdef subscribe(self, str msg_type, handler)
+
+
+cdef class RedisBus(SocketBus):
+     cdef public str url
+     cdef public str channel
+     cdef public publisher
+     cdef public subscriber
+     cdef public list tasks
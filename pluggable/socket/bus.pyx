@@ -0,0 +1,113 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+from typing import Callable
+
+import aioredis
+
+from .codec import packb, unpackb
+from .logger import ERROR
+
+
+cdef class SocketBus(object):
+    """Message bus between the processes (``node``s) serving an app
+
+    Handlers are registered per message type with ``subscribe``, and are
+    called with messages published by any other node. The base bus has no
+    other nodes to talk to, so publishing is a no-op.
+    """
+
+    def __cinit__(self, app, str node, *args, **kwargs):
+        self.app = app
+        self.node = node
+        self.handlers = {}
+        self.remote = False
+
+    cpdef subscribe(self, str msg_type, handler: Callable):
+        self.handlers[msg_type] = handler
+
+    async def publish(
+            self,
+            str msg_type,
+            dict msg,
+            str node=None) -> None:
+        pass
+
+    async def receive(self, dict msg) -> None:
+        if msg.get("origin") == self.node:
+            return
+        handler = self.handlers.get(msg.get("type"))
+        if handler is not None:
+            await handler(msg)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+cdef class RedisBus(SocketBus):
+    """Bus over a Redis pub/sub ``channel``, with a ``channel:node``
+    channel for messages addressed to a single node
+    """
+
+    def __cinit__(
+            self,
+            app,
+            str node,
+            str url,
+            str channel="pluggable.socket"):
+        self.url = url
+        self.channel = channel
+        self.remote = True
+        self.tasks = []
+
+    async def start(self) -> None:
+        self.publisher = await aioredis.create_redis(self.url)
+        self.subscriber = await aioredis.create_redis(self.url)
+        channels = await self.subscriber.subscribe(
+            self.channel,
+            "%s:%s" % (self.channel, self.node))
+        self.tasks = [
+            self.app.loop.create_task(self.listen(channel))
+            for channel
+            in channels]
+
+    async def listen(self, channel) -> None:
+        while await channel.wait_message():
+            try:
+                await self.receive(unpackb(await channel.get()))
+            except Exception as e:
+                self.app.logger.log(ERROR, 'app.bus:', (repr(e), ))
+
+    async def publish(
+            self,
+            str msg_type,
+            dict msg,
+            str node=None) -> None:
+        msg["type"] = msg_type
+        msg["origin"] = self.node
+        await self.publisher.publish(
+            (self.channel
+             if node is None
+             else "%s:%s" % (self.channel, node)),
+            packb(msg))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        for redis in (self.subscriber, self.publisher):
+            if redis is not None:
+                redis.close()
+                await redis.wait_closed()
+
+
+class Py__SocketBus(SocketBus):
+    pass
+
+
+class Py__RedisBus(RedisBus):
+    pass
@@ -0,0 +1,39 @@
+
+from .dispatch cimport Command
+
+cdef class LRUCache:
+     cdef public int maxsize
+     cdef public double ttl
+     cdef public entries
+     cdef public long long hits
+     cdef public long long misses
+     cpdef get(self, key, default=*)
+     cpdef set(self, key, value)
+     cpdef delete(self, key)
+     cpdef clear(self)
+
+
+cdef class SessionCache:
+     cdef public backend
+     cdef public LRUCache cache
+     cpdef invalidate(self, key)
+
+
+cdef class ResponseCache:
+     cdef public runner
+     cdef public backend
+     cdef public dict caches
+     cdef public dict generations
+     cdef public dict inflight
+     cdef public long long coalesced
+     cdef public long long invalidations
+     cpdef listen(self)
+     cpdef LRUCache cache(self, Command command)
+     cpdef str scope(self, str command)
+     cpdef tuple key(self, Command command, connection, dict params)
+     cpdef body(self, Command command, returns)
+     cpdef response(self, Command command, connection, uuid, body)
+     cpdef bint drop(self, str command, dict params=*, session=*)
+     cpdef tuple _drop_key(self, str command, dict params, session)
+     cpdef str _key(self, str command, generation, tuple key)
+     cpdef str _generation_key(self, str command)
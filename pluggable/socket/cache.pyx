@@ -0,0 +1,368 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+from collections import OrderedDict
+from inspect import isawaitable
+from math import ceil
+from time import time
+from typing import Callable, Union
+
+import rapidjson as json
+
+from .dispatch cimport Command
+from .frame cimport Frame
+from .limits cimport monotonic
+from .logger import ERROR
+from .stream cimport streamable
+
+
+_missing = object()
+
+# marks a cached dict returned by a local handler, whose fields make up
+# the response, rather than its ``response``; JSON never starts with it
+FIELDS = b"="
+
+scopes = ("shared", "session")
+
+
+def cached(
+        ttl: float = 60.0,
+        size: int = 1000,
+        scope: str = "shared") -> Callable:
+    """Declare a command's responses cacheable for ``ttl`` seconds
+
+    At most ``size`` responses are kept per process, one for each set of
+    params shared by all callers, or with the ``session`` scope one for
+    each set of params and session.
+    """
+    if scope not in scopes:
+        raise ValueError("Unknown cache scope: %s" % scope)
+
+    def declare(handler: Callable) -> Callable:
+        handler.cache = dict(ttl=ttl, size=size, scope=scope)
+        return handler
+    return declare
+
+
+cdef class LRUCache(object):
+    """Least recently used cache holding at most ``maxsize`` entries,
+    each for no longer than ``ttl`` seconds (``0`` never expires)
+    """
+
+    def __cinit__(self, int maxsize, double ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _missing) is not _missing
+
+    cpdef get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if self.ttl and entry[0] < monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    cpdef set(self, key, value):
+        self.entries[key] = (monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    cpdef delete(self, key):
+        self.entries.pop(key, None)
+
+    cpdef clear(self):
+        self.entries.clear()
+
+
+cdef class SessionCache(object):
+    """Sessions backend fronted by an LRU cache
+
+    Unknown keys are cached too, so anonymous or stale session keys do
+    not hit the backend on every lookup either.
+    """
+
+    def __cinit__(self, backend, int maxsize, double ttl):
+        self.backend = backend
+        self.cache = LRUCache(maxsize, ttl)
+
+    async def get(self, key):
+        session = self.cache.get(key, _missing)
+        if session is _missing:
+            session = self.backend.get(key)
+            if isawaitable(session):
+                session = await session
+            self.cache.set(key, session)
+        return session
+
+    cpdef invalidate(self, key):
+        self.cache.delete(key)
+
+
+cdef class ResponseCache(object):
+    """Responses of the commands declared ``cached``, by command and params
+
+    The values returned by their handlers or worker tasks are held JSON
+    encoded in an LRU per command, and written through to the ``backend``
+    (one of the app's ``caches``) if there is one, to share them between
+    processes. Concurrent calls for the same
+    entry are coalesced into a single execution. Only complete responses
+    are cached, never errors or streams.
+
+    ``invalidate`` drops entries on all nodes. Dropping more than a single
+    entry moves the command to a new ``generation``, which is part of the
+    backend keys, so the superseded backend entries are left to expire.
+    """
+    prefix = "pluggable.socket.response"
+
+    def __cinit__(self, runner, backend=None):
+        self.runner = runner
+        self.backend = backend
+        self.caches = {}
+        self.generations = {}
+        self.inflight = {}
+
+    @property
+    def app(self):
+        return self.runner.app
+
+    cpdef listen(self):
+        self.app.bus.subscribe("invalidate", self.on_bus_invalidate)
+
+    cpdef LRUCache cache(self, Command command):
+        cache = self.caches.get(command.name)
+        if cache is None:
+            cache = self.caches[command.name] = LRUCache(
+                command.cache.get("size", 1000),
+                command.cache.get("ttl", 60.0))
+        return cache
+
+    cpdef str scope(self, str command):
+        cdef Command _command = self.runner.dispatch.get(command)
+        if _command is None or _command.cache is None:
+            return "shared"
+        return _command.cache.get("scope", "shared")
+
+    cpdef tuple key(self, Command command, connection, dict params):
+        session = None
+        if command.cache.get("scope") == "session":
+            # anonymous connections are their own session
+            session = (
+                str(connection.session)
+                if connection.session
+                else "#%s" % connection.id)
+        return session, json.dumps(params, sort_keys=True)
+
+    cpdef body(self, Command command, returns):
+        """The JSON encoded value ``command`` ``returns`` to cache, or
+        ``None`` if it can not be cached
+        """
+        if type(returns) == bytes:
+            # pre-encoded JSON
+            return returns or None
+        prefix = b""
+        if command.local:
+            # local handlers send nothing for a falsy value, and an
+            # ``error`` among the fields of a dict
+            if type(returns) != dict or not returns or "error" in returns:
+                return None
+            prefix = FIELDS
+        elif streamable(returns):
+            return None
+        try:
+            return prefix + json.dumps(returns).encode("utf8")
+        except (TypeError, ValueError):
+            return None
+
+    cpdef response(self, Command command, connection, uuid, body):
+        """The response to a call of ``command`` from its cached ``body``
+        """
+        returns = json.loads(body[1:]) if body[:1] == FIELDS else body
+        return self.runner._response(command, connection, uuid, returns)
+
+    async def call(
+            self,
+            Command command,
+            connection,
+            uuid: str,
+            dict params) -> Union[dict, Frame, bytes, None]:
+        try:
+            key = self.key(command, connection, params)
+        except (TypeError, ValueError):
+            return await self.runner._execute(
+                command, connection, uuid, params)
+        cdef LRUCache cache = self.cache(command)
+        body = cache.get(key)
+        if body is None and self.backend is not None:
+            body = await self._get(command.name, key)
+            if body is not None:
+                cache.set(key, body)
+        if body is not None:
+            return self.response(command, connection, uuid, body)
+        flight = (command.name, key)
+        future = self.inflight.get(flight)
+        if future is not None:
+            self.coalesced += 1
+            body = await asyncio.shield(future)
+            if body is not None:
+                return self.response(command, connection, uuid, body)
+            # the first call failed, so this one runs for itself
+            return await self.runner._execute(
+                command, connection, uuid, params)
+        future = self.app.loop.create_future()
+        self.inflight[flight] = future
+        invalidations = self.invalidations
+        body = None
+        try:
+            returns = await self.runner._returns(
+                command, connection, uuid, params)
+            body = self.body(command, returns)
+            if body is not None and invalidations == self.invalidations:
+                cache.set(key, body)
+                future.set_result(body)
+                if self.backend is not None:
+                    await self._set(command, key, body)
+            return self.runner._response(command, connection, uuid, returns)
+        finally:
+            if self.inflight.get(flight) is future:
+                del self.inflight[flight]
+            if not future.done():
+                future.set_result(body)
+
+    async def invalidate(
+            self,
+            str command,
+            dict params=None,
+            session=None) -> None:
+        """Drop the cached responses of ``command`` on all nodes, or only
+        those for ``params`` and/or ``session`` if given
+        """
+        exact = self.drop(command, params, session)
+        generation = 0
+        if not exact:
+            generation = int(time() * 1000)
+            self.generations[command] = generation
+        if self.backend is not None:
+            if exact:
+                await self._backend(
+                    "delete",
+                    self._key(
+                        command,
+                        await self._generation(command),
+                        self._drop_key(command, params, session)))
+            else:
+                await self._backend(
+                    "set", self._generation_key(command), generation)
+        await self.app.bus.publish(
+            "invalidate",
+            dict(command=command,
+                 params=params,
+                 session=session,
+                 generation=generation))
+
+    cpdef bint drop(self, str command, dict params=None, session=None):
+        """Drop cached responses in this process, returning whether a
+        single entry was dropped
+        """
+        self.invalidations += 1
+        # calls in flight now may respond with superseded results, so
+        # later calls do not join them
+        for flight in [f for f in self.inflight if f[0] == command]:
+            del self.inflight[flight]
+        cdef bint shared = self.scope(command) == "shared"
+        if shared:
+            session = None
+        elif session is not None:
+            session = str(session)
+        cache = self.caches.get(command)
+        if params is None and session is None:
+            if cache is not None:
+                cache.clear()
+            return False
+        encoded = (
+            json.dumps(params, sort_keys=True)
+            if params is not None
+            else None)
+        if cache is not None:
+            for key in [
+                    k for k in cache.entries
+                    if (session is None or k[0] == session)
+                    and (encoded is None or k[1] == encoded)]:
+                cache.delete(key)
+        return encoded is not None and (shared or session is not None)
+
+    cpdef tuple _drop_key(self, str command, dict params, session):
+        return (
+            (None if self.scope(command) == "shared" else str(session)),
+            json.dumps(params, sort_keys=True))
+
+    async def on_bus_invalidate(self, dict msg) -> None:
+        self.drop(msg["command"], msg.get("params"), msg.get("session"))
+        if msg.get("generation"):
+            self.generations[msg["command"]] = msg["generation"]
+
+    cpdef str _key(self, str command, generation, tuple key):
+        return "%s:%s:%s:%s:%s" % (
+            self.prefix, command, generation, key[0] or "", key[1])
+
+    cpdef str _generation_key(self, str command):
+        return "%s:%s:generation" % (self.prefix, command)
+
+    async def _generation(self, str command):
+        generation = self.generations.get(command)
+        if generation is None:
+            generation = int(
+                await self._backend(
+                    "get", self._generation_key(command)) or 0)
+            self.generations[command] = generation
+        return generation
+
+    async def _get(self, str command, tuple key):
+        return await self._backend(
+            "get",
+            self._key(command, await self._generation(command), key))
+
+    async def _set(self, Command command, tuple key, bytes body):
+        ttl = command.cache.get("ttl", 60.0)
+        await self._backend(
+            "set",
+            self._key(
+                command.name, await self._generation(command.name), key),
+            body,
+            **(dict(expire=int(ceil(ttl))) if ttl else {}))
+
+    async def _backend(self, str method, *args, **kwargs):
+        # the backend is only a cache too, so failures are logged and
+        # treated as misses
+        try:
+            result = getattr(self.backend, method)(*args, **kwargs)
+            if isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            self.app.logger.log(ERROR, 'app.cache:', (method, repr(e)))
+
+
+class Py__LRUCache(LRUCache):
+    pass
+
+
+class Py__SessionCache(SessionCache):
+    pass
+
+
+class Py__ResponseCache(ResponseCache):
+    pass
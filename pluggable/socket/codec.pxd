@@ -0,0 +1,20 @@
+
+cdef class JSONCodec:
+     cdef public str name
+     cdef public bint binary
+     cpdef encode(self, msg)
+     cpdef dict decode(self, msg)
+     cpdef envelope(self, uuid, response)
+     cpdef pack(self, list frames, uuid=*)
+
+
+cdef class MsgpackCodec:
+     cdef public str name
+     cdef public bint binary
+     cpdef encode(self, msg)
+     cpdef dict decode(self, msg)
+     cpdef envelope(self, uuid, response)
+     cpdef pack(self, list frames, uuid=*)
+
+
+cpdef negotiate(str path, default)
@@ -0,0 +1,130 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import struct
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import rapidjson as json
+
+from msgpack import packb as _packb, unpackb as _unpackb
+
+from .frame cimport Frame
+
+
+# ``bytes`` and ``str`` are kept apart, and any map key is accepted,
+# whichever the defaults of the installed msgpack
+packb = partial(_packb, use_bin_type=True)
+unpackb = partial(_unpackb, raw=False, strict_map_key=False)
+
+
+cdef class JSONCodec(object):
+    """Wire format for a connection, and the default
+
+    ``encode`` accepts either a message dict or a payload that is already
+    encoded as JSON (``str``, ``bytes`` or a ``Frame``), and returns the
+    frame to write. ``envelope`` wraps a JSON ``response`` as the response
+    to ``uuid``, and ``pack`` combines already encoded frames into one
+    ``batch`` frame.
+    """
+
+    def __cinit__(self):
+        self.name = "json"
+        self.binary = False
+
+    cpdef encode(self, msg):
+        return (
+            msg
+            if type(msg) in [str, bytes, Frame]
+            else json.dumps(msg))
+
+    cpdef dict decode(self, msg):
+        return json.loads(msg)
+
+    cpdef envelope(self, uuid, response):
+        # the response is already JSON, so it is wrapped as it is
+        return Frame(
+            b'{"uuid": %s, "response": ' % json.dumps(uuid).encode("utf8"),
+            response,
+            b'}')
+
+    cpdef pack(self, list frames, uuid=None):
+        batch = ','.join([
+            frame.decode("utf8")
+            if type(frame) == bytes
+            else (frame.tobytes().decode("utf8")
+                  if type(frame) == Frame
+                  else frame)
+            for frame in frames])
+        if uuid is None:
+            return '{"batch": [%s]}' % batch
+        return '{"uuid": %s, "batch": [%s]}' % (json.dumps(uuid), batch)
+
+
+cdef class MsgpackCodec(object):
+    """Smaller frames than JSON, for clients that opt in with
+    ``?codec=msgpack``
+
+    Encoding and decoding cost more CPU than JSON, which is why JSON
+    stays the default codec. It takes the same messages as ``JSONCodec``.
+    """
+
+    def __cinit__(self):
+        self.name = "msgpack"
+        self.binary = True
+
+    cpdef encode(self, msg):
+        if type(msg) == Frame:
+            msg = msg.tobytes()
+        return packb(
+            json.loads(msg)
+            if type(msg) in [str, bytes]
+            else msg)
+
+    cpdef dict decode(self, msg):
+        return (
+            unpackb(msg)
+            if type(msg) == bytes
+            else json.loads(msg))
+
+    cpdef envelope(self, uuid, response):
+        return self.encode(dict(uuid=uuid, response=json.loads(response)))
+
+    cpdef pack(self, list frames, uuid=None):
+        # a msgpack array is its header followed by the packed items, so
+        # the frames can be concatenated as they are
+        cdef int size = len(frames)
+        header = [b'\x81' if uuid is None else b'\x82']
+        if uuid is not None:
+            header.append(packb("uuid") + packb(uuid))
+        header.append(packb("batch"))
+        if size < 16:
+            header.append(bytes([0x90 | size]))
+        elif size < 0x10000:
+            header.append(b'\xdc' + struct.pack(">H", size))
+        else:
+            header.append(b'\xdd' + struct.pack(">I", size))
+        return b''.join(header + frames)
+
+
+codecs = dict(
+    json=JSONCodec(),
+    msgpack=MsgpackCodec())
+
+
+cpdef negotiate(str path, default):
+    """Pick the codec requested with ``?codec=`` on the connection path
+    """
+    requested = parse_qs(urlsplit(path or "").query).get("codec")
+    if not requested:
+        return default
+    return codecs.get(requested[0], default)
+
+
+class Py__JSONCodec(JSONCodec):
+    pass
+
+
+class Py__MsgpackCodec(MsgpackCodec):
+    pass
@@ -3,11 +3,29 @@ from .user cimport SocketUser
 
 
 cdef class SocketConnection:
+     cdef public long long id
      cdef public socket
      cdef public connection
      cdef public str path
+     cdef public codec
+     cdef public queue
+     cdef public dict buckets
+     cdef public dict tasks
+     cdef public int held
+     cdef public pending
+     cdef public dict streams
      cpdef public user
      cpdef public session
+     cdef public bint resolved
+     cdef public bint signalled
+     cdef public unsigned long received
+     cdef public unsigned long sent
+     cdef public double last_seen
+     cpdef bint allow(self, session, dict msg)
      cpdef handle_request(self, session, dict msg)
+     cpdef reject(self, uuid, str error)
+     cpdef cancel(self)
+     cpdef bint control(self, dict msg)
+     cpdef cancel_request(self, uuid)
      cpdef log_request(self, dict msg)
-     cpdef dict parse_request(self, str msg)
+     cpdef dict parse_request(self, msg)
@@ -2,13 +2,16 @@
 # cython: linetrace=True
 # cython: binding=True
 
+from collections import deque
 from typing import Union
 
 import websockets
 
-import rapidjson as json
-
 from .app cimport SocketApp
+from .codec import codecs
+from .frame cimport Frame, WireFrame
+from .limits cimport monotonic
+from .logger import DEBUG
 from .socket cimport SocketWrapper
 from .user cimport SocketUser
 
@@ -23,9 +26,13 @@ cdef class SocketConnection(object):
         self.socket = socket
         self.connection = connection
         self.path = path
+        self.codec = codecs["json"]
+        self.tasks = {}
+        self.pending = deque()
+        self.streams = {}
 
     def __hash__(self) -> int:
-        return hash(self.connection)
+        return self.id
 
     @property
     def app(self) -> SocketApp:
@@ -39,46 +46,156 @@ cdef class SocketConnection(object):
     def port(self) -> int:
         return self.connection.remote_address[1]
 
+    @property
+    def session_key(self) -> Union[str, None]:
+        return self.connection.request_headers.get('Sec-Websocket-Protocol')
+
+    cpdef bint allow(self, session, dict msg):
+        name = msg.get("command") or msg.get("cmd")
+        if not isinstance(name, str):
+            # clients can send anything, and only names can be looked up
+            self.reject(msg.get("uuid"), "unrecognized_command")
+            return False
+        command = self.app.runner.dispatch.get(name)
+        if self.app.runner.limiter.allow(
+                self,
+                session,
+                command.rate if command is not None else name):
+            return True
+        self.reject(msg.get("uuid"), "rate_limited")
+        return False
+
     cpdef handle_request(self, session, dict msg):
         self.session = session
+        if self.control(msg):
+            return
+        if "batch" in msg:
+            batch = msg["batch"]
+            if (type(batch) is not list
+                    or not all([type(item) is dict for item in batch])):
+                self.reject(msg.get("uuid"), "invalid_batch")
+                return
+            # batched commands are rate limited individually
+            msg["batch"] = [
+                item for item in msg["batch"]
+                if self.allow(session, item)]
+            if not msg["batch"]:
+                return
+        elif not self.allow(session, msg):
+            return
+        self.app.runner.admission.submit(self, msg)
+
+    cpdef reject(self, uuid, str error):
         self.app.loop.create_task(
-            self.app.runner.run(self, **msg))
+            self.respond(dict(uuid=uuid, error=error)))
+
+    cpdef cancel(self):
+        # drop queued requests and abort any still running
+        self.pending.clear()
+        for task in list(self.tasks):
+            task.cancel()
+
+    cpdef bint control(self, dict msg):
+        # stream acknowledgements and cancellations are handled here, and
+        # are not subject to rate limits or admission
+        if "ack" in msg:
+            stream = self.streams.get(msg["ack"])
+            if stream is not None and type(msg.get("seq")) is int:
+                stream.ack(msg["seq"])
+            return True
+        if "cancel" in msg:
+            self.cancel_request(msg["cancel"])
+            return True
+        if "heartbeat" in msg:
+            # replies to heartbeats only count as activity
+            return True
+        return False
+
+    cpdef cancel_request(self, uuid):
+        for task, _uuid in list(self.tasks.items()):
+            if _uuid == uuid:
+                task.cancel()
+        if self.pending:
+            for pending in list(self.pending):
+                if pending[1].get("uuid") == uuid:
+                    self.pending.remove(pending)
 
     cpdef log_request(self, dict msg):
-        print(
-            ' '.join([
-                str(m) for m
-                in ['app.socket.recv', self.ip, self.port, msg]]))
+        if self.app.logger.level <= DEBUG:
+            self.app.logger.log(
+                DEBUG,
+                'app.socket.recv',
+                (self.ip, self.port, msg))
 
-    cpdef dict parse_request(self, str msg):
-        return json.loads(msg)
+    cpdef dict parse_request(self, msg):
+        return self.codec.decode(msg)
+
+    async def write(
+            self,
+            frame: Union[str, bytes, Frame, WireFrame],
+            key=None) -> None:
+        self.sent += 1
+        if self.queue is not None:
+            self.queue.put(frame, key)
+        else:
+            await self.socket._send(self.connection, frame)
+
+    async def respond(
+            self,
+            msg: Union[dict, str, bytes, Frame],
+            bint compress=True) -> None:
+        # ``str``, ``bytes`` and ``Frame`` responses are already encoded
+        frame = (
+            msg
+            if type(msg) in [str, bytes, Frame]
+            else self.codec.encode(msg))
+        if not compress and self.socket.deflate is not None:
+            frame = self.socket.deflate.plain(frame)
+        await self.write(frame)
+
+    async def respond_batch(self, uuid: str, list responses) -> None:
+        await self.write(
+            self.codec.pack(
+                [r if type(r) in [str, bytes, Frame] else self.codec.encode(r)
+                 for r in responses],
+                uuid))
 
     async def connect(self) -> None:
         # print("got connection")
         await self.handle_connection()
         while True:
-            msg = self.parse_request(await self.connection.recv())
+            raw = await self.connection.recv()
+            self.last_seen = monotonic()
+            self.app.metrics.received(raw)
+            msg = self.parse_request(raw)
+            self.received += 1
             # print("got message")
             self.log_request(msg)
             self.handle_request(await self.handle_session(), msg)
 
     async def _get_session(self):
-        if "session" in self.app.socket.connections[hash(self)]:
-            return (
-                SocketUser(hash(self)),
-                self.app.socket.connections[hash(self)]["session"])
-        session_key = self.connection.request_headers.get(
-            'Sec-Websocket-Protocol')
+        if self.signalled:
+            return SocketUser(self.id), self.session
+        session_key = self.session_key
         return (
-            SocketUser(hash(self)),
+            SocketUser(self.id),
             (await self.socket.sessions.get(session_key)
              if session_key
              else None))
 
     async def handle_session(self) -> Union[str, None]:
+        # resolved once, and again only after an auth.session signal
+        # for this connection
+        if self.resolved:
+            return self.session
         user, session = await self._get_session()
+        self.user = user
+        self.session = session
+        self.resolved = True
         if not session:
             return
+        if self.app.registry.shared:
+            await self.app.registry.bind(self.id, session)
         await user.load(session)
         return session
 
@@ -89,7 +206,7 @@ cdef class SocketConnection(object):
             # notify user of success
             await self.socket.send(
                 {'msg': 'connected', 'user': session},
-                [hash(self)])
+                [self.id])
 
     async def validate_connection(self):
         # check nonce or somesuch ?
@@ -0,0 +1,20 @@
+from .frame cimport WireFrame
+
+
+cdef class Deflate:
+     cdef public int threshold
+     cdef public int level
+     cdef public bint shared
+     cdef public int window_bits
+     cdef public long long compressed
+     cdef public long long reused
+     cdef public long long bytes_in
+     cdef public long long bytes_out
+     cpdef factory(self)
+     cpdef extension(self, websocket)
+     cpdef bint accepts(self, extension)
+     cpdef WireFrame compress(self, message)
+     cpdef WireFrame plain(self, message)
+     cpdef prepare(self, websocket, message)
+     cpdef bytes _bytes(self, message)
+     cpdef bint _text(self, message)
@@ -0,0 +1,189 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import zlib
+from typing import Union
+
+import websockets
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate, ServerPerMessageDeflateFactory)
+from websockets.frames import CTRL_OPCODES, Opcode
+
+from .frame cimport Frame, WireFrame
+
+
+# the end of a sync flush, removed from each message as the RFC requires
+TRAILER = b"\x00\x00\xff\xff"
+
+
+class DeflateExtension(PerMessageDeflate):
+    """permessage-deflate, leaving messages shorter than ``threshold``
+    uncompressed, as are those sent while ``plain`` is set
+
+    Messages sent in fragments are compressed unless ``plain``, as their
+    size is not known from the first fragment.
+    """
+
+    def __init__(self, int threshold, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        self.plain = False
+        self.skipping = False
+
+    def encode(
+            self,
+            frame: websockets.frames.Frame) -> websockets.frames.Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not Opcode.CONT:
+            # continuation frames go as the first frame of their message
+            self.skipping = (
+                self.plain
+                or (frame.fin and len(frame.data) < self.threshold))
+        if self.skipping:
+            return frame
+        return super().encode(frame)
+
+
+class DeflateExtensionFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate as ``DeflateExtension``
+    """
+
+    def __init__(self, int threshold, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def process_request_params(self, params, accepted_extensions):
+        response, extension = super().process_request_params(
+            params, accepted_extensions)
+        return response, DeflateExtension(
+            self.threshold,
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings)
+
+
+cdef class Deflate(object):
+    """Compression policy for outgoing messages, on connections that
+    negotiated permessage-deflate
+
+    Messages shorter than ``threshold`` bytes are sent uncompressed.
+    Longer ones sent to many connections are compressed once with
+    ``compress``, and the result written as it is to each connection
+    where the server does not take over the compression context
+    (``shared`` negotiates this). Other messages and connections go
+    through ``websocket.send``, and the connection's ``DeflateExtension``
+    compresses them with its own context. Responses of commands that opt
+    out of compression are marked with ``plain``, and sent with the
+    extension's compression turned off by ``send_plain``.
+    """
+
+    def __cinit__(
+            self,
+            int threshold=1024,
+            int level=6,
+            bint shared=True,
+            int window_bits=15):
+        self.threshold = threshold
+        self.level = level
+        self.shared = shared
+        self.window_bits = window_bits
+
+    @property
+    def stats(self) -> dict:
+        return dict(
+            compressed=self.compressed,
+            reused=self.reused,
+            bytes_in=self.bytes_in,
+            bytes_out=self.bytes_out)
+
+    cpdef factory(self):
+        """The extension factory to pass to ``websockets.serve``
+        """
+        return DeflateExtensionFactory(
+            self.threshold,
+            server_no_context_takeover=self.shared,
+            compress_settings=dict(level=self.level))
+
+    cpdef extension(self, websocket: websockets.WebSocketServerProtocol):
+        for extension in getattr(websocket, "extensions", None) or ():
+            if extension.name == "permessage-deflate":
+                return extension
+        return None
+
+    cpdef bint accepts(self, extension):
+        # the peer decompresses each message on its own, in a window at
+        # least as large as the one used to compress it
+        return (
+            extension is not None
+            and extension.local_no_context_takeover
+            and self.window_bits <= (extension.local_max_window_bits or 15))
+
+    cpdef WireFrame compress(self, message: Union[str, bytes, Frame]):
+        cdef bytes data = self._bytes(message)
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, -self.window_bits)
+        output = (
+            compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+        if output.endswith(TRAILER):
+            output = output[:-4]
+        self.compressed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(output)
+        return WireFrame(message, output, self._text(message), True)
+
+    cpdef WireFrame plain(self, message: Union[str, bytes, Frame]):
+        return WireFrame(message, self._bytes(message), self._text(message))
+
+    async def send_plain(
+            self,
+            websocket: websockets.WebSocketServerProtocol,
+            message: Union[str, bytes, Frame]) -> None:
+        """Send ``message`` through ``websocket.send``, uncompressed
+        """
+        extension = self.extension(websocket)
+        if extension is not None:
+            extension.plain = True
+        try:
+            if type(message) == Frame:
+                await message.send(websocket)
+            else:
+                await websocket.send(message)
+        finally:
+            if extension is not None:
+                extension.plain = False
+
+    cpdef prepare(
+            self,
+            websocket: websockets.WebSocketServerProtocol,
+            message: Union[str, bytes, Frame, WireFrame]):
+        """The form of ``message`` to write to ``websocket``
+        """
+        if type(message) == WireFrame:
+            if not message.compressed:
+                return message
+            if self.accepts(self.extension(websocket)):
+                self.reused += 1
+                return message
+            message = message.message
+        return message
+
+    cpdef bytes _bytes(self, message):
+        if type(message) == str:
+            return message.encode("utf8")
+        if type(message) == Frame:
+            return message.tobytes()
+        return message
+
+    cpdef bint _text(self, message):
+        # as ``websocket.send`` does, ``bytes`` are sent as binary frames
+        if type(message) == Frame:
+            return message.text
+        return type(message) == str
+
+
+class Py__Deflate(Deflate):
+    pass
@@ -0,0 +1,20 @@
+
+cdef class Command:
+     cdef public str name
+     cdef public handler
+     cdef public bint local
+     cdef public double timeout
+     cdef public str rate
+     cdef public dict cache
+     cdef public bint compress
+     cdef public params
+     cpdef bint accepts(self, dict params)
+
+
+cdef class Dispatcher:
+     cdef public app
+     cdef public dict commands
+     cpdef Command get(self, name)
+     cpdef bint compresses(self, name)
+     cpdef Command _command(self, str name, handler, bint local)
+     cpdef refresh(self)
@@ -0,0 +1,107 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import inspect
+from typing import Callable, Union
+
+
+cdef class Command(object):
+    """A resolved command and its metadata
+
+    ``timeout`` and ``rate`` (the rate class used for ``command_rates``
+    lookups, defaulting to the command name) are read from attributes of
+    the same name on the handler, and ignored unless they are a number
+    and a string respectively, as is ``cache``, the response caching
+    declaration made with ``cache.cached``, and ``compress``, set ``False``
+    for responses that do not compress well, such as already compressed
+    data, to send them uncompressed. ``params`` is the set of keyword
+    arguments a local handler accepts, or ``None`` if it takes any.
+    """
+
+    def __cinit__(self, str name, handler, bint local):
+        self.name = name
+        self.handler = handler
+        self.local = local
+        timeout = getattr(handler, "timeout", None)
+        self.timeout = (
+            timeout
+            if type(timeout) in [int, float] and timeout > 0
+            else 0)
+        rate = getattr(handler, "rate", None)
+        self.rate = rate if type(rate) == str and rate else name
+        cache = getattr(handler, "cache", None)
+        self.cache = cache if isinstance(cache, dict) else None
+        self.compress = getattr(handler, "compress", True) is not False
+        self.params = self._params(handler) if local else None
+
+    @staticmethod
+    def _params(handler: Callable) -> Union[frozenset, None]:
+        try:
+            parameters = list(inspect.signature(handler).parameters.values())
+        except (TypeError, ValueError):
+            return None
+        if any(p.kind == p.VAR_KEYWORD for p in parameters):
+            return None
+        # handlers are called with the connection and uuid first
+        return frozenset(p.name for p in parameters[2:])
+
+    cpdef bint accepts(self, dict params):
+        if self.params is None:
+            return True
+        for k in params:
+            if k not in self.params:
+                return False
+        return True
+
+
+cdef class Dispatcher(object):
+    """Index of command name to ``Command``, for local commands and
+    worker tasks
+
+    ``refresh`` builds the index, and on later calls, made by the app on
+    the ``plugins.change`` signal, only replaces the entries whose
+    handlers were added, changed or removed. Local commands take
+    precedence over worker tasks of the same name.
+    """
+
+    def __cinit__(self, app):
+        self.app = app
+        self.commands = {}
+
+    def __contains__(self, name) -> bool:
+        return name in self.commands
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    cpdef Command get(self, name):
+        return self.commands.get(name)
+
+    cpdef bint compresses(self, name):
+        command = self.commands.get(name)
+        return command is None or command.compress
+
+    cpdef Command _command(self, str name, handler, bint local):
+        current = self.commands.get(name)
+        if (current is not None
+                and current.handler is handler
+                and current.local == local):
+            return current
+        return Command(name, handler, local)
+
+    cpdef refresh(self):
+        cdef dict commands = {}
+        for name, task in dict(self.app.worker.tasks).items():
+            commands[name] = self._command(name, task, False)
+        for name, handler in dict(self.app.commands).items():
+            commands[name] = self._command(name, handler, True)
+        self.commands = commands
+
+
+class Py__Command(Command):
+    pass
+
+
+class Py__Dispatcher(Dispatcher):
+    pass
@@ -0,0 +1,16 @@
+
+cdef class Drain:
+     cdef public app
+     cdef public double grace
+     cdef public double reconnect_min
+     cdef public double reconnect_max
+     cdef public bint handoff
+     cdef public double interval
+     cdef public bint draining
+     cdef public task
+     cpdef listen(self)
+     cpdef start(self)
+     cpdef start_handoff(self)
+     cpdef dict hint(self)
+     cpdef bint settled(self)
+     cpdef log(self, int level, list msgs)
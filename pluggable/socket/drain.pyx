@@ -0,0 +1,206 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+from __future__ import absolute_import
+
+import asyncio
+import os
+import random
+import signal
+import socket
+import sys
+from functools import partial
+from typing import Union
+
+from .logger import INFO, WARNING
+
+
+# the listening socket and readiness pipe passed to a new process
+HANDOFF_ENV = "PLUGGABLE_SOCKET_HANDOFF"
+
+# websocket close code for "service restart"
+SERVICE_RESTART = 1012
+
+
+def inherited() -> Union[socket.socket, None]:
+    """The listening socket handed off by the previous process, if any
+    """
+    if HANDOFF_ENV not in os.environ:
+        return None
+    fd = int(os.environ[HANDOFF_ENV].split(",")[0])
+    return socket.socket(fileno=fd)
+
+
+def ready() -> None:
+    """Tell the previous process this one is serving, so it can drain
+    """
+    handoff = os.environ.pop(HANDOFF_ENV, None)
+    if handoff is None:
+        return
+    fd = int(handoff.split(",")[1])
+    try:
+        os.write(fd, b"1")
+    finally:
+        os.close(fd)
+
+
+cdef class Drain(object):
+    """Graceful shutdown of the app, on ``SIGTERM`` or ``SIGINT``
+
+    ``run`` stops accepting connections and new commands, and tells each
+    client to reconnect after a random delay between ``reconnect_min``
+    and ``reconnect_max`` seconds, so that they do not all come back at
+    once. Commands in flight have ``grace`` seconds to finish, and their
+    responses to be written out of the send queues, then the connections
+    are closed and the loop is stopped.
+
+    With ``handoff``, ``SIGUSR2`` first starts a new copy of the process
+    serving the same listening socket, and drains once it is ready, so
+    that no connection is refused during a restart.
+    """
+
+    def __cinit__(
+            self,
+            app,
+            double grace=30.0,
+            double reconnect_min=1.0,
+            double reconnect_max=10.0,
+            bint handoff=False,
+            double interval=0.1):
+        self.app = app
+        self.grace = grace
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.handoff = handoff
+        self.interval = interval
+
+    cpdef listen(self):
+        loop = self.app.loop
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.start)
+        if self.handoff:
+            loop.add_signal_handler(signal.SIGUSR2, self.start_handoff)
+
+    cpdef start(self):
+        if self.task is None:
+            self.task = self.app.loop.create_task(self.run())
+
+    cpdef start_handoff(self):
+        if self.task is None:
+            self.task = self.app.loop.create_task(self.hand_off())
+
+    cpdef dict hint(self):
+        return dict(
+            reconnect=dict(
+                delay=round(
+                    random.uniform(self.reconnect_min, self.reconnect_max),
+                    3)))
+
+    cpdef bint settled(self):
+        admission = self.app.runner.admission
+        if admission.running:
+            return False
+        for connection in self.app.socket.connections.values():
+            if connection.pending:
+                return False
+            if connection.queue is not None and not connection.queue.empty():
+                return False
+        return True
+
+    async def wait(self) -> None:
+        while not self.settled():
+            await asyncio.sleep(self.interval)
+
+    async def run(self) -> None:
+        app = self.app
+        socket = app.socket
+        self.draining = True
+        app.runner.admission.closed = True
+        server = app.server
+        if server is not None:
+            # only the listening socket, the connections are closed below
+            server.server.close()
+        self.log(INFO, ['draining', len(socket.connections)])
+        # written directly, ahead of anything queued
+        await asyncio.gather(
+            *[socket._send(
+                connection.connection,
+                connection.codec.encode(self.hint()))
+              for connection in list(socket.connections.values())],
+            return_exceptions=True)
+        try:
+            await asyncio.wait_for(self.wait(), self.grace)
+        except asyncio.TimeoutError:
+            self.log(
+                WARNING,
+                ['grace period expired', app.runner.admission.running])
+        await self.close()
+        self.log(INFO, ['drained'])
+        # write out what is left in the log buffer before the loop stops
+        app.logger.stop()
+        app.loop.stop()
+
+    async def close(self) -> None:
+        app = self.app
+        connections = list(app.socket.connections.values())
+        # closing the websocket disconnects it, cancelling any commands
+        # still running
+        await asyncio.gather(
+            *[connection.connection.close(SERVICE_RESTART, "draining")
+              for connection in connections],
+            return_exceptions=True)
+        if app.server is not None:
+            app.server.close()
+            await app.server.wait_closed()
+        if app.socket.wheel is not None:
+            app.socket.wheel.stop()
+        if app.registry.shared:
+            await asyncio.gather(
+                *[app.registry.remove(connection.id)
+                  for connection in connections],
+                return_exceptions=True)
+        await app.registry.stop()
+        await app.bus.stop()
+        await app.metrics.stop()
+
+    async def hand_off(self) -> None:
+        loop = self.app.loop
+        sock = self.app.server.server.sockets[0]
+        read, write = os.pipe()
+        env = dict(os.environ)
+        env[HANDOFF_ENV] = "%s,%s" % (sock.fileno(), write)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                *sys.argv,
+                env=env,
+                pass_fds=(sock.fileno(), write))
+        finally:
+            os.close(write)
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            partial(asyncio.StreamReaderProtocol, reader),
+            os.fdopen(read, "rb"))
+        try:
+            # the pipe is closed without a write if the process fails
+            started = await asyncio.wait_for(reader.read(1), self.grace)
+        except asyncio.TimeoutError:
+            started = b""
+        finally:
+            transport.close()
+        if not started:
+            self.log(WARNING, ['handoff failed', process.pid])
+            if process.returncode is None:
+                process.terminate()
+            self.task = None
+            return
+        self.log(INFO, ['handed off', process.pid])
+        await self.run()
+
+    cpdef log(self, int level, list msgs):
+        self.app.logger.log(level, 'app.drain:', tuple(msgs))
+
+
+class Py__Drain(Drain):
+    pass
@@ -0,0 +1,16 @@
+
+cdef class Frame:
+     cdef public bytes prefix
+     cdef public payload
+     cdef public bytes suffix
+     cdef public bint text
+     cpdef list parts(self)
+     cpdef bytes tobytes(self)
+
+
+cdef class WireFrame:
+     cdef public message
+     cdef public bytes data
+     cdef public bytes header
+     cdef public bint text
+     cdef public bint compressed
@@ -0,0 +1,154 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+import struct
+from typing import List, Union
+
+import websockets
+from websockets.frames import Opcode
+
+
+OP_CONT = Opcode.CONT
+OP_TEXT = Opcode.TEXT
+
+
+cdef bint legacy(websocket):
+    # connections of websockets' legacy protocol can be written to frame
+    # by frame
+    return hasattr(websocket, "write_frame")
+
+
+cdef class Frame(object):
+    """An encoded message kept in parts, so a ``payload`` encoded
+    elsewhere, such as JSON returned by a handler or read from Redis, can
+    be wrapped in an envelope ``prefix`` and ``suffix`` without copying it
+
+    ``send`` writes the parts as the fragments of a single websocket
+    message, ``text`` unless the codec is binary, so the payload is never
+    copied into one buffer. Binary messages go through the public
+    ``websocket.send``. It only sends ``str`` fragments as text, so text
+    messages are written with the frame-level API of websockets' legacy
+    protocol (``write_frame``, and the private
+    ``_fragmented_message_waiter`` that ``send`` uses to keep other
+    messages from interleaving). Connections without it are sent the
+    message joined, with ``websocket.send``.
+    """
+
+    def __cinit__(
+            self,
+            bytes prefix,
+            payload,
+            bytes suffix,
+            bint text=True):
+        self.prefix = prefix
+        self.payload = payload
+        self.suffix = suffix
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.prefix) + len(self.payload) + len(self.suffix)
+
+    def __repr__(self) -> str:
+        return "<Frame %s bytes>" % len(self)
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+
+    cpdef list parts(self):
+        return [self.prefix, self.payload, self.suffix]
+
+    cpdef bytes tobytes(self):
+        return b"".join(self.parts())
+
+    async def send(
+            self,
+            websocket: websockets.WebSocketServerProtocol) -> None:
+        if not self.text:
+            await websocket.send(self.parts())
+            return
+        if not legacy(websocket):
+            await websocket.send(self.tobytes().decode("utf8"))
+            return
+        # as ``websocket.send`` does for fragmented messages, other sends
+        # wait until every fragment of this one is written
+        while websocket._fragmented_message_waiter is not None:
+            await asyncio.shield(websocket._fragmented_message_waiter)
+        waiter = websocket._fragmented_message_waiter = (
+            asyncio.get_event_loop().create_future())
+        try:
+            await websocket.write_frame(False, OP_TEXT, self.prefix)
+            await websocket.write_frame(False, OP_CONT, self.payload)
+            await websocket.write_frame(True, OP_CONT, self.suffix)
+        finally:
+            websocket._fragmented_message_waiter = None
+            waiter.set_result(None)
+
+
+cdef class WireFrame(object):
+    """A message as written on the wire, in a single frame that bypasses
+    the extensions negotiated by the connection
+
+    ``data`` is either compressed with permessage-deflate (``compressed``,
+    setting the RSV1 bit), so it can be compressed once and written to
+    many connections, or left uncompressed whatever was negotiated, in
+    which case the socket sends ``message`` with the connection's
+    compression turned off rather than write ``data`` itself.
+    ``message`` is the encoded message it was made from, for connections
+    it cannot be written to as it is, and for batches.
+    """
+
+    def __cinit__(
+            self,
+            message: Union[str, bytes, Frame],
+            bytes data,
+            bint text=True,
+            bint compressed=False):
+        cdef int first = (
+            0x80 | (0x40 if compressed else 0) | (0x1 if text else 0x2))
+        cdef Py_ssize_t size = len(data)
+        self.message = message
+        self.data = data
+        self.text = text
+        self.compressed = compressed
+        # server frames are not masked, so the header is the same for
+        # every connection
+        if size < 126:
+            self.header = struct.pack("!BB", first, size)
+        elif size < 0x10000:
+            self.header = struct.pack("!BBH", first, 126, size)
+        else:
+            self.header = struct.pack("!BBQ", first, 127, size)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return "<WireFrame %s bytes%s>" % (
+            len(self), " compressed" if self.compressed else "")
+
+    async def send(
+            self,
+            websocket: websockets.WebSocketServerProtocol) -> None:
+        if not legacy(websocket):
+            # the message is compressed as negotiated instead
+            if isinstance(self.message, Frame):
+                await self.message.send(websocket)
+            else:
+                await websocket.send(self.message)
+            return
+        while websocket._fragmented_message_waiter is not None:
+            await asyncio.shield(websocket._fragmented_message_waiter)
+        await websocket.ensure_open()
+        websocket.transport.write(self.header)
+        websocket.transport.write(self.data)
+        await websocket.drain()
+
+
+class Py__Frame(Frame):
+    pass
+
+
+class Py__WireFrame(WireFrame):
+    pass
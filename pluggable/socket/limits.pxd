@@ -0,0 +1,28 @@
+
+from .connection cimport SocketConnection
+
+
+cdef double monotonic()
+
+
+cdef class TokenBucket:
+     cdef public double rate
+     cdef public double burst
+     cdef public double tokens
+     cdef public double updated
+     cpdef bint consume(self, double now, double cost=*)
+     cpdef bint full(self, double now)
+
+
+cdef class RateLimiter:
+     cdef public double rate
+     cdef public double burst
+     cdef public double session_rate
+     cdef public double session_burst
+     cdef public dict commands
+     cdef public dict sessions
+     cdef public int max_sessions
+     cpdef TokenBucket _bucket(
+         self, dict buckets, key, double rate, double burst, double now)
+     cpdef bint allow(self, SocketConnection connection, session, command)
+     cpdef prune(self, double now)
@@ -0,0 +1,131 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+from .connection cimport SocketConnection
+
+
+cdef double monotonic():
+    # same clock as ``loop.time()``, without allocating a float
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+cdef class TokenBucket(object):
+    """Refills at ``rate`` tokens a second, holding at most ``burst``
+
+    ``now`` defaults to the current time. Times before the last update
+    refill nothing, so a bucket is never charged for a clock read taken
+    before it was created.
+    """
+
+    def __cinit__(self, double rate, double burst, double now=-1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic() if now < 0 else now
+
+    cpdef bint consume(self, double now, double cost=1):
+        if now > self.updated:
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    cpdef bint full(self, double now):
+        return (
+            self.tokens + max(now - self.updated, 0) * self.rate
+            >= self.burst)
+
+
+cdef class RateLimiter(object):
+    """Per-connection and per-session request rate limits
+
+    Buckets are created on first use and kept on the connection (or,
+    for sessions, on the limiter), so checking a request in the steady
+    state is a couple of dict lookups and no allocation. A command listed
+    in ``commands`` draws from its own per-connection bucket instead of
+    the connection-wide one. A rate of ``0`` disables the limit.
+    """
+
+    def __cinit__(
+            self,
+            double rate,
+            double burst,
+            double session_rate=0,
+            double session_burst=0,
+            dict commands=None,
+            int max_sessions=10000):
+        self.rate = rate
+        self.burst = burst
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.commands = commands or {}
+        self.sessions = {}
+        self.max_sessions = max_sessions
+
+    cpdef TokenBucket _bucket(
+            self,
+            dict buckets,
+            key,
+            double rate,
+            double burst,
+            double now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, max(burst, 1), now)
+        return bucket
+
+    cpdef bint allow(self, SocketConnection connection, session, command):
+        cdef double now = monotonic()
+        cdef double rate = self.rate
+        cdef double burst = self.burst
+        key = None
+        override = self.commands.get(command)
+        if override is not None:
+            key = command
+            rate, burst = override
+        if rate > 0:
+            if connection.buckets is None:
+                connection.buckets = {}
+            if not self._bucket(
+                    connection.buckets,
+                    key,
+                    rate,
+                    burst,
+                    now).consume(now):
+                return False
+        if self.session_rate <= 0 or not session:
+            return True
+        if session not in self.sessions:
+            self.prune(now)
+        return self._bucket(
+            self.sessions,
+            session,
+            self.session_rate,
+            self.session_burst,
+            now).consume(now)
+
+    cpdef prune(self, double now):
+        # idle sessions refill to ``burst``, so their buckets can go
+        cdef TokenBucket bucket
+        if len(self.sessions) < self.max_sessions:
+            return
+        for session, bucket in list(self.sessions.items()):
+            if bucket.full(now):
+                del self.sessions[session]
+
+
+class Py__TokenBucket(TokenBucket):
+    pass
+
+
+class Py__RateLimiter(RateLimiter):
+    pass
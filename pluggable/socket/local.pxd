@@ -1,4 +1,6 @@
+from .connection cimport SocketConnection
 
 
 cdef class LocalRunner:
      cdef app
+     cpdef response(self, SocketConnection connection, uuid, returns)
@@ -1,9 +1,11 @@
 # distutils: define_macros=CYTHON_TRACE_NOGIL=1
 # cython: linetrace=True
 
-from typing import List
+from typing import Callable, List, Union
 
 from .connection cimport SocketConnection
+from .frame cimport Frame
+from .stream cimport ResponseStream, streamable
 
 
 cdef class LocalRunner(object):
@@ -15,21 +17,42 @@ cdef class LocalRunner(object):
     def commands(self) -> List[str]:
         return self.app.commands.keys()
 
-    async def run(
+    async def call(
             self,
-            connection: int,
+            SocketConnection connection,
             uuid: str,
-            command: str,
-            **kwargs) -> None:
-        returns = await self.app.commands[command](
-            connection, uuid, **kwargs)
+            handler: Callable,
+            dict params) -> Union[dict, Frame, bytes, ResponseStream, None]:
+        return self.response(
+            connection,
+            uuid,
+            await self.invoke(connection, uuid, handler, params))
+
+    async def invoke(
+            self,
+            SocketConnection connection,
+            uuid: str,
+            handler: Callable,
+            dict params):
+        """The value returned by ``handler``, awaited unless it streams
+        """
+        returns = handler(connection.id, uuid, **params)
+        if not streamable(returns):
+            returns = await returns
+        return returns
+
+    cpdef response(self, SocketConnection connection, uuid, returns):
+        """The response to send for the value a handler ``returns``
+        """
+        if streamable(returns):
+            return ResponseStream(connection, uuid, returns)
         if not returns:
             return
-        await self.app.socket.send(
-            ('{"uuid": "%s", "response": %s}' % (uuid, returns.decode("utf8"))
-             if type(returns) == bytes
-             else dict(uuid=uuid, **returns)),
-            [connection])
+        if type(returns) != bytes:
+            return dict(uuid=uuid, **returns)
+        # pre-encoded JSON is wrapped for the connection's codec without
+        # a copy or a round trip through a dict where the codec allows
+        return connection.codec.envelope(uuid, returns)
 
 
 class Py__LocalRunner(LocalRunner):
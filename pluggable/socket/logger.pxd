@@ -0,0 +1,17 @@
+
+cdef class SocketLogger:
+     cdef public app
+     cdef public int level
+     cdef public buffer
+     cdef public list events
+     cdef public int sample
+     cdef public double interval
+     cdef public long long dropped
+     cdef public long long seen
+     cdef public task
+     cpdef bint enabled(self, int level)
+     cpdef log(self, int level, str prefix, tuple args)
+     cpdef event(self, str msg)
+     cpdef flush(self)
+     cpdef start(self, loop)
+     cpdef stop(self)
@@ -0,0 +1,97 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+import sys
+from collections import deque
+
+from .utils cimport truncate
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+levels = dict(
+    debug=DEBUG,
+    info=INFO,
+    warning=WARNING,
+    error=ERROR)
+
+
+cdef class SocketLogger(object):
+    """Buffered, level-gated logging
+
+    Entries below ``level`` are discarded before any formatting happens.
+    The rest are kept unformatted in a ring buffer of ``size`` entries,
+    and rendered and written out every ``interval`` seconds by a
+    background task. Server events destined for the worker ``log`` task
+    are sampled (one in ``sample``) and sent as a single batch per flush.
+    """
+
+    def __cinit__(
+            self,
+            app,
+            str level="info",
+            int size=10000,
+            double interval=1.0,
+            int sample=1):
+        self.app = app
+        self.level = levels[level]
+        self.buffer = deque(maxlen=size)
+        self.events = []
+        self.interval = interval
+        self.sample = max(sample, 1)
+
+    cpdef bint enabled(self, int level):
+        return level >= self.level
+
+    cpdef log(self, int level, str prefix, tuple args):
+        if level < self.level:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((prefix, args))
+
+    cpdef event(self, str msg):
+        self.seen += 1
+        if self.seen % self.sample == 0:
+            self.events.append(msg)
+
+    cpdef flush(self):
+        cdef list lines = []
+        while self.buffer:
+            prefix, args = self.buffer.popleft()
+            lines.append(
+                ' '.join([prefix] + [truncate(arg) for arg in args]))
+        if self.dropped:
+            lines.append('app.log: dropped %s entries' % self.dropped)
+            self.dropped = 0
+        if lines:
+            sys.stdout.write('\n'.join(lines) + '\n')
+        if self.events:
+            events, self.events = self.events, []
+            self.app.loop.create_task(
+                self.app.worker.tasks['log'].call(
+                    type="server",
+                    msg='\n'.join(events)))
+
+    cpdef start(self, loop):
+        self.task = loop.create_task(self.run())
+
+    cpdef stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.flush()
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+
+class Py__SocketLogger(SocketLogger):
+    pass
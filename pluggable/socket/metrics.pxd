@@ -0,0 +1,37 @@
+
+from cpython cimport array
+
+
+cdef class Histogram:
+     cdef public array.array counts
+     cdef public long long count
+     cdef public double total
+     cdef public double max
+     cpdef record(self, double seconds)
+     cpdef double upper(self, int index)
+     cpdef double quantile(self, double q)
+     cpdef dict summary(self)
+
+
+cdef class Metrics:
+     cdef public app
+     cdef public bint enabled
+     cdef public str ip
+     cdef public int port
+     cdef public dict histograms
+     cdef public Histogram writes
+     cdef public long long messages_in
+     cdef public long long messages_out
+     cdef public long long bytes_in
+     cdef public long long bytes_out
+     cdef public server
+     cpdef Histogram histogram(self, str stage, command)
+     cpdef str label(self, dict msg)
+     cpdef observe(self, str stage, command, double seconds)
+     cpdef received(self, msg)
+     cpdef sent(self, msg, double seconds)
+     cpdef dict counters(self)
+     cpdef dict gauges(self)
+     cpdef dict snapshot(self)
+     cpdef str prometheus(self)
+     cpdef list _summary(self, str name, str labels, Histogram histogram)
@@ -0,0 +1,248 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import array
+import asyncio
+from typing import Union
+
+from cpython cimport array
+
+from .logger import ERROR
+
+
+# each power of two of microseconds is split into ``SUB_BUCKETS`` linear
+# buckets, so values are recorded to within 1/16th, up to ~19 hours
+DEF SUB_BUCKETS = 16
+DEF MAX_SHIFT = 32
+DEF BUCKETS = (MAX_SHIFT + 2) * SUB_BUCKETS
+
+quantiles = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+
+cdef class Histogram(object):
+    """Latency histogram with log-linear buckets, in the style of HDR
+    histograms
+
+    Recording is constant time and does not allocate, so it can be done
+    for every message.
+    """
+
+    def __cinit__(self):
+        self.counts = array.clone(
+            array.array("q"), BUCKETS, zero=True)
+
+    cpdef record(self, double seconds):
+        cdef long long value = <long long>(seconds * 1e6)
+        cdef int shift = 0
+        if value < 0:
+            value = 0
+        while value >= 2 * SUB_BUCKETS and shift < MAX_SHIFT:
+            value >>= 1
+            shift += 1
+        if value >= 2 * SUB_BUCKETS:
+            value = 2 * SUB_BUCKETS - 1
+        self.counts.data.as_longlongs[shift * SUB_BUCKETS + value] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    cpdef double upper(self, int index):
+        """Upper bound of the bucket at ``index``, in seconds
+        """
+        if index < 2 * SUB_BUCKETS:
+            return (index + 1) * 1e-6
+        cdef int shift = index // SUB_BUCKETS - 1
+        return (
+            (<long long>(index % SUB_BUCKETS + SUB_BUCKETS + 1)) << shift
+        ) * 1e-6
+
+    cpdef double quantile(self, double q):
+        if not self.count:
+            return 0
+        cdef long long target = max(<long long>(q * self.count + 0.5), 1)
+        cdef long long seen = 0
+        cdef int index
+        for index in range(BUCKETS):
+            seen += self.counts.data.as_longlongs[index]
+            if seen >= target:
+                return min(self.upper(index), self.max)
+        return self.max
+
+    cpdef dict summary(self):
+        cdef dict summary = dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else 0,
+            max=self.max)
+        for name, q in quantiles:
+            summary[name] = self.quantile(q)
+        return summary
+
+
+cdef class Metrics(object):
+    """Latency histograms per command and stage (``queue`` wait in
+    admission, ``execute``, and ``send`` of the response), with counters
+    of messages and bytes in and out
+
+    Gauges are only computed when the metrics are read, from the
+    ``stats`` command or the Prometheus text endpoint served on ``port``
+    (when not ``0``). Recording can be turned off with ``enabled``.
+    """
+    prefix = "pluggable_socket"
+
+    def __cinit__(self, app, bint enabled=True, str ip=None, int port=0):
+        self.app = app
+        self.enabled = enabled
+        self.ip = ip
+        self.port = port
+        self.histograms = {}
+        self.writes = Histogram()
+
+    cpdef Histogram histogram(self, str stage, command):
+        key = (stage, command)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    cpdef str label(self, dict msg):
+        # unknown commands share a label, to bound the number of series
+        if "batch" in msg:
+            return "batch"
+        name = msg.get("command") or msg.get("cmd")
+        return (
+            name
+            if isinstance(name, str) and name in self.app.runner.dispatch
+            else "unknown")
+
+    cpdef observe(self, str stage, command, double seconds):
+        if self.enabled:
+            self.histogram(stage, command).record(seconds)
+
+    cpdef received(self, msg):
+        if self.enabled:
+            self.messages_in += 1
+            self.bytes_in += len(msg)
+
+    cpdef sent(self, msg, double seconds):
+        # text frames are counted in characters
+        if self.enabled:
+            self.messages_out += 1
+            self.bytes_out += len(msg)
+            self.writes.record(seconds)
+
+    cpdef dict counters(self):
+        return dict(
+            messages_in=self.messages_in,
+            messages_out=self.messages_out,
+            bytes_in=self.bytes_in,
+            bytes_out=self.bytes_out)
+
+    cpdef dict gauges(self):
+        connections = list(self.app.socket.connections.values())
+        return dict(
+            connections=len(connections),
+            in_flight=self.app.runner.admission.running,
+            pending=sum([len(c.pending) for c in connections]),
+            queued=sum([
+                len(c.queue.frames)
+                for c in connections
+                if c.queue is not None]),
+            streams=sum([len(c.streams) for c in connections]),
+            subscriptions=len(self.app.socket.topics.subscriptions))
+
+    cpdef dict snapshot(self):
+        cdef dict commands = {}
+        for (stage, command), histogram in self.histograms.items():
+            commands.setdefault(command, {})[stage] = histogram.summary()
+        return dict(
+            counters=self.counters(),
+            gauges=self.gauges(),
+            writes=self.writes.summary(),
+            commands=commands)
+
+    async def stats(self, connection: int, uuid: str) -> dict:
+        return dict(stats=self.snapshot())
+
+    cpdef str prometheus(self):
+        """The metrics in the Prometheus text exposition format
+        """
+        cdef list lines = []
+        for name, value in self.counters().items():
+            lines += [
+                "# TYPE %s_%s_total counter" % (self.prefix, name),
+                "%s_%s_total %s" % (self.prefix, name, value)]
+        for name, value in self.gauges().items():
+            lines += [
+                "# TYPE %s_%s gauge" % (self.prefix, name),
+                "%s_%s %s" % (self.prefix, name, value)]
+        lines.append("# TYPE %s_command_seconds summary" % self.prefix)
+        for stage, command in sorted(self.histograms):
+            lines += self._summary(
+                "command_seconds",
+                'command="%s",stage="%s"' % (command, stage),
+                self.histograms[(stage, command)])
+        lines.append("# TYPE %s_write_seconds summary" % self.prefix)
+        lines += self._summary("write_seconds", "", self.writes)
+        return "\n".join(lines) + "\n"
+
+    cpdef list _summary(self, str name, str labels, Histogram histogram):
+        cdef list lines = [
+            '%s_%s{%squantile="%s"} %s' % (
+                self.prefix,
+                name,
+                labels + "," if labels else "",
+                q,
+                histogram.quantile(q))
+            for _, q in quantiles]
+        suffix = "{%s}" % labels if labels else ""
+        lines += [
+            "%s_%s_sum%s %s" % (self.prefix, name, suffix, histogram.total),
+            "%s_%s_count%s %s" % (self.prefix, name, suffix, histogram.count)]
+        return lines
+
+    async def serve(self) -> Union[asyncio.AbstractServer, None]:
+        if not self.port:
+            return
+        self.server = await asyncio.start_server(
+            self.handle, self.ip, self.port)
+        return self.server
+
+    async def handle(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        try:
+            request = (await reader.readline()).split()
+            # the headers are not needed
+            while (await reader.readline()).strip():
+                pass
+            if len(request) > 1 and request[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.prometheus().encode("utf8")
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                ("HTTP/1.1 %s\r\n"
+                 "Content-Type: text/plain; version=0.0.4\r\n"
+                 "Content-Length: %s\r\n"
+                 "Connection: close\r\n\r\n" % (status, len(body))).encode()
+                + body)
+            await writer.drain()
+        except Exception as e:
+            self.app.logger.log(ERROR, 'app.metrics:', (repr(e), ))
+        finally:
+            writer.close()
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class Py__Histogram(Histogram):
+    pass
+
+
+class Py__Metrics(Metrics):
+    pass
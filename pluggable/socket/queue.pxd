@@ -0,0 +1,25 @@
+
+cdef class SendQueue:
+     cdef public websocket
+     cdef public send
+     cdef public int maxsize
+     cdef public str policy
+     cdef public codec
+     cdef public double window
+     cdef public frames
+     cdef public long long sent
+     cdef public long long dropped
+     cdef public long long coalesced
+     cdef public bint closed
+     cdef public bint sending
+     cdef public task
+     cdef loop
+     cdef ready
+     cdef space
+     cpdef bint put(self, frame, key=*)
+     cpdef next_frame(self)
+     cpdef bint _coalesce(self, frame, key)
+     cpdef evict(self)
+     cpdef bint empty(self)
+     cpdef start(self, loop)
+     cpdef close(self)
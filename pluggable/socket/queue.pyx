@@ -0,0 +1,171 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+from collections import deque
+from typing import Callable
+
+import websockets
+
+from .frame cimport WireFrame
+
+
+DROP_OLDEST = "drop-oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+cdef class SendQueue(object):
+    """Bounded outbound queue for a single websocket
+
+    Producers ``put`` frames without ever blocking, and a writer task
+    drains them to the peer. When the queue is full the overflow
+    ``policy`` decides what gives:
+
+    - ``disconnect``: the peer is closed as a slow consumer
+    - ``drop-oldest``: the oldest pending frame is discarded
+    - ``coalesce``: a pending frame with the same key is replaced,
+      otherwise the oldest is discarded
+
+    Responses share the queue with broadcasts, so only ``disconnect``
+    never loses one silently, and it is the default. The other policies
+    suit apps whose clients can do without a missed response.
+
+    With a coalescing ``window`` the writer waits that long after a frame
+    arrives, and packs everything then pending into a single ``batch``
+    frame with the connection's ``codec``.
+    """
+
+    def __cinit__(
+            self,
+            websocket: websockets.WebSocketServerProtocol,
+            send: Callable,
+            int maxsize,
+            str policy=DISCONNECT,
+            codec=None,
+            double window=0):
+        if policy not in POLICIES:
+            raise ValueError("Unknown send queue policy: %s" % policy)
+        self.websocket = websocket
+        self.send = send
+        self.maxsize = maxsize
+        self.policy = policy
+        self.codec = codec
+        self.window = window
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames)
+
+    @property
+    def stats(self) -> dict:
+        return dict(
+            depth=len(self.frames),
+            sent=self.sent,
+            dropped=self.dropped,
+            coalesced=self.coalesced)
+
+    cpdef bint put(self, frame, key=None):
+        if self.closed:
+            self.dropped += 1
+            return False
+        if len(self.frames) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                self.dropped += 1
+                self.evict()
+                return False
+            elif self.policy == COALESCE and self._coalesce(frame, key):
+                return True
+            self.frames.popleft()
+            self.dropped += 1
+        self.frames.append((key, frame))
+        self.ready.set()
+        return True
+
+    cpdef bint _coalesce(self, frame, key):
+        if key is None:
+            return False
+        for i, pending in enumerate(self.frames):
+            if pending[0] == key:
+                self.frames[i] = (key, frame)
+                self.coalesced += 1
+                return True
+        return False
+
+    cpdef next_frame(self):
+        if self.window <= 0 or len(self.frames) == 1:
+            return self.frames.popleft()[1]
+        # frames written as they are cannot be batched, so the messages
+        # they were made from are
+        frames = [
+            pending[1].message
+            if type(pending[1]) == WireFrame
+            else pending[1]
+            for pending in self.frames]
+        self.frames.clear()
+        return self.codec.pack(frames)
+
+    cpdef evict(self):
+        self.closed = True
+        self.frames.clear()
+        self.space.set()
+        if self.loop is not None:
+            self.loop.create_task(
+                self.websocket.close(1008, "slow consumer"))
+
+    async def writable(self, int low) -> None:
+        # for producers that must not lose frames to the overflow policy
+        while len(self.frames) > low and not self.closed:
+            self.space.clear()
+            await self.space.wait()
+
+    cpdef bint empty(self):
+        # nothing is left to write, or nothing more will be
+        return self.closed or not (self.frames or self.sending)
+
+    cpdef start(self, loop):
+        self.loop = loop
+        self.task = loop.create_task(self.drain())
+
+    cpdef close(self):
+        self.closed = True
+        self.frames.clear()
+        self.space.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def drain(self) -> None:
+        while not self.closed:
+            if not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+                if self.closed or not self.frames:
+                    continue
+            frame = self.next_frame()
+            self.space.set()
+            self.sending = True
+            try:
+                await self.send(self.websocket, frame)
+            except websockets.exceptions.ConnectionClosed:
+                self.closed = True
+                self.frames.clear()
+                self.space.set()
+            except Exception:
+                self.dropped += 1
+            else:
+                self.sent += 1
+            finally:
+                self.sending = False
+
+
+class Py__SendQueue(SendQueue):
+    pass
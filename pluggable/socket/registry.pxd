@@ -0,0 +1,11 @@
+
+cdef class ConnectionRegistry:
+     cdef public str node
+     cdef public dict store
+     cdef public bint shared
+
+
+cdef class RedisRegistry(ConnectionRegistry):
+     cdef public str url
+     cdef public str prefix
+     cdef public redis
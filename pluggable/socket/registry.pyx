@@ -0,0 +1,149 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+from typing import Dict, List, Union
+
+import aioredis
+
+
+cdef class ConnectionRegistry(object):
+    """Maps connections, and the sessions bound to them, to the ``node``
+    serving them
+
+    The in-memory registry only knows about connections registered with
+    it, so nodes only share it when they share the ``store``. Without one
+    it is not ``shared``, and the wrapper's own connections are used
+    instead.
+    """
+
+    def __cinit__(self, str node, dict store=None, *args, **kwargs):
+        self.node = node
+        self.shared = store is not None
+        self.store = store if store is not None else {}
+        for key in ("connections", "sessions", "bound"):
+            self.store.setdefault(key, {})
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        for connection, node in list(self.store["connections"].items()):
+            if node == self.node:
+                await self.remove(connection)
+
+    async def add(self, connection: int) -> None:
+        self.store["connections"][connection] = self.node
+
+    async def remove(self, connection: int) -> None:
+        await self.bind(connection, None)
+        self.store["connections"].pop(connection, None)
+
+    async def bind(self, connection: int, session: Union[str, None]) -> None:
+        previous = self.store["bound"].pop(connection, None)
+        if previous is not None:
+            connections = self.store["sessions"][previous]
+            connections.discard(connection)
+            if not connections:
+                del self.store["sessions"][previous]
+        if session is not None:
+            self.store["bound"][connection] = session
+            self.store["sessions"].setdefault(session, set()).add(connection)
+
+    async def locate(self, list connections) -> Dict[str, List[int]]:
+        cdef dict routes = {}
+        cdef dict nodes = self.store["connections"]
+        for connection in connections:
+            routes.setdefault(nodes.get(connection), []).append(connection)
+        return routes
+
+    async def lookup(self, list sessions) -> List[int]:
+        cdef dict bound = self.store["sessions"]
+        return [
+            connection
+            for session
+            in sessions
+            for connection
+            in bound.get(session, ())]
+
+
+cdef class RedisRegistry(ConnectionRegistry):
+    """Registry kept in Redis hashes and sets under ``prefix``
+    """
+
+    def __cinit__(
+            self,
+            str node,
+            dict store=None,
+            str url=None,
+            str prefix="pluggable.socket"):
+        self.url = url
+        self.prefix = prefix
+        self.shared = True
+
+    async def start(self) -> None:
+        self.redis = await aioredis.create_redis(self.url)
+
+    async def stop(self) -> None:
+        if self.redis is None:
+            return
+        for connection in await self.redis.smembers(
+                "%s:node:%s" % (self.prefix, self.node),
+                encoding="utf-8"):
+            await self.remove(int(connection))
+        self.redis.close()
+        await self.redis.wait_closed()
+        self.redis = None
+
+    async def add(self, connection: int) -> None:
+        await self.redis.hset(
+            "%s:connections" % self.prefix, connection, self.node)
+        await self.redis.sadd(
+            "%s:node:%s" % (self.prefix, self.node), connection)
+
+    async def remove(self, connection: int) -> None:
+        await self.bind(connection, None)
+        await self.redis.hdel("%s:connections" % self.prefix, connection)
+        await self.redis.srem(
+            "%s:node:%s" % (self.prefix, self.node), connection)
+
+    async def bind(self, connection: int, session: Union[str, None]) -> None:
+        bound = "%s:bound" % self.prefix
+        previous = await self.redis.hget(bound, connection, encoding="utf-8")
+        if previous is not None:
+            await self.redis.srem(
+                "%s:session:%s" % (self.prefix, previous), connection)
+            await self.redis.hdel(bound, connection)
+        if session is not None:
+            await self.redis.hset(bound, connection, session)
+            await self.redis.sadd(
+                "%s:session:%s" % (self.prefix, session), connection)
+
+    async def locate(self, list connections) -> Dict[str, List[int]]:
+        cdef dict routes = {}
+        if not connections:
+            return routes
+        nodes = await self.redis.hmget(
+            "%s:connections" % self.prefix,
+            *connections,
+            encoding="utf-8")
+        for connection, node in zip(connections, nodes):
+            routes.setdefault(node, []).append(connection)
+        return routes
+
+    async def lookup(self, list sessions) -> List[int]:
+        cdef list connections = []
+        for session in sessions:
+            members = await self.redis.smembers(
+                "%s:session:%s" % (self.prefix, session),
+                encoding="utf-8")
+            connections.extend([int(connection) for connection in members])
+        return connections
+
+
+class Py__ConnectionRegistry(ConnectionRegistry):
+    pass
+
+
+class Py__RedisRegistry(RedisRegistry):
+    pass
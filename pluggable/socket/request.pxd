@@ -3,4 +3,5 @@
 cdef class SocketRequest:
      cpdef public dict params
      cpdef public str session
-     cpdef public list args     
+     cpdef public list args
+     cdef public connection     
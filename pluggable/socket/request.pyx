@@ -4,10 +4,16 @@
 
 cdef class SocketRequest(object):
 
-    def __cinit__(self, session=None, params: dict = None, args: list = None):
+    def __cinit__(
+            self,
+            session=None,
+            params: dict = None,
+            args: list = None,
+            connection=None):
         self.session = session
         self.params = params or {}
         self.args = args or []
+        self.connection = connection
 
 
 class Py__SocketRequest(SocketRequest):
@@ -1,4 +1,22 @@
 
 
+from .admission cimport Admission
+from .cache cimport ResponseCache
+from .connection cimport SocketConnection
+from .dispatch cimport Command
+from .limits cimport RateLimiter
+
+
 cdef class SocketRunner(object):
      cdef public app
+     cdef public RateLimiter limiter
+     cdef public Admission admission
+     cdef public ResponseCache cache
+     cdef public dispatch
+     cdef public double timeout
+     cdef public long long timeouts
+     cpdef double timeout_for(self, Command _command, requested=*)
+     cpdef worker_response(
+         self, SocketConnection connection, uuid, response)
+     cpdef _response(
+         self, Command _command, SocketConnection connection, uuid, returns)
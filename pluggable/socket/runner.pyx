@@ -2,39 +2,192 @@
 # cython: linetrace=True
 # cython: binding=True
 
-from typing import Dict
+import asyncio
+from typing import Awaitable, Dict, List, Union
 
 from aioworker.worker cimport Worker
 
+from .admission cimport Admission
+from .cache cimport ResponseCache
 from .connection cimport SocketConnection
+from .dispatch cimport Command, Dispatcher
+from .frame cimport Frame
+from .limits cimport RateLimiter, monotonic
 from .request cimport SocketRequest
+from .stream cimport ResponseStream, streamable
 
 from pluggable.core.exceptions cimport UnrecognizedCommand
 
 
 cdef class SocketRunner(object):
+    # requests per second, per connection
     max_request_rate = 60
 
     def __init__(self, app):
         self.app = app
+        self.limiter = RateLimiter(
+            self.max_request_rate,
+            app.config["request_burst"],
+            app.config["session_rate"],
+            app.config["session_burst"],
+            dict(app.config["command_rates"]))
+        self.dispatch = Dispatcher(app)
+        self.timeout = app.config["command_timeout"] or 0
+        self.admission = Admission(
+            self,
+            app.config["max_in_flight"],
+            app.config["max_in_flight_global"],
+            app.config["max_pending"],
+            app.config["pending_timeout"])
+        backend = app.config["response_cache"]
+        self.cache = ResponseCache(
+            self,
+            app.caches[backend] if backend else None)
+        self.cache.listen()
 
     @property
     def worker(self) -> Worker:
         return self.app.worker
 
-    async def run_worker(
+    cpdef double timeout_for(self, Command _command, requested=None):
+        """Seconds ``_command`` may run for: its own ``timeout``, else the
+        ``command_timeout`` default, shortened to the timeout ``requested``
+        by the client. ``0`` is no limit.
+        """
+        cdef double limit = (
+            _command.timeout
+            if _command is not None and _command.timeout > 0
+            else self.timeout)
+        if (type(requested) in [int, float]
+                and requested > 0
+                and (limit <= 0 or requested < limit)):
+            limit = requested
+        return limit
+
+    async def bounded(
+            self,
+            awaitable: Awaitable,
+            double timeout,
+            uuid: str) -> Union[dict, Frame, bytes, ResponseStream, None]:
+        """Await ``awaitable`` for up to ``timeout`` seconds, cancelling
+        it and returning a ``timeout`` error for ``uuid`` past that
+        """
+        if timeout <= 0:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return dict(uuid=uuid, error="timeout")
+
+    async def call_worker(
             self,
             str command,
             SocketConnection connection,
             str uuid,
-            **kwargs) -> None:
-        response = await self.worker.tasks[command].call(
+            dict params) -> Union[dict, Frame, bytes, ResponseStream]:
+        return self.worker_response(
+            connection,
+            uuid,
+            await self.call_task(command, connection, params))
+
+    async def call_task(
+            self,
+            str command,
+            SocketConnection connection,
+            dict params):
+        """The value returned by the worker task for ``command``
+        """
+        return await self.worker.tasks[command].call(
             SocketRequest(
-                connection=hash(connection),
-                params=kwargs))
-        await self.app.socket.send(
-            dict(uuid=uuid,
-                 response=response), [hash(connection)])
+                connection=connection.id,
+                params=params))
+
+    cpdef worker_response(self, SocketConnection connection, uuid, response):
+        if streamable(response):
+            return ResponseStream(connection, uuid, response)
+        if type(response) == bytes:
+            # already serialized as JSON by the worker
+            return connection.codec.envelope(uuid, response)
+        return dict(uuid=uuid, response=response)
+
+    async def respond(
+            self,
+            SocketConnection connection,
+            response: Union[dict, str, bytes, ResponseStream, None],
+            int window=0,
+            bint compress=True) -> None:
+        if isinstance(response, ResponseStream):
+            response.window = window
+            await response.run()
+        elif response is not None:
+            await connection.respond(response, compress)
+
+    async def execute(
+            self,
+            SocketConnection connection,
+            uuid: str,
+            command: str,
+            dict params,
+            timeout=None) -> Union[dict, str, bytes, ResponseStream, None]:
+        """Run a command, returning the response to send if any
+
+        The command is cancelled if it runs for longer than its timeout,
+        or the shorter ``timeout`` sent by the client. A stream it returns
+        is given what is left of that time to finish.
+        """
+        cdef Command _command = self.dispatch.get(command)
+        if _command is None:
+            raise UnrecognizedCommand(command)
+        if not _command.accepts(params):
+            return dict(uuid=uuid, error="invalid_params")
+        cdef double _timeout = self.timeout_for(_command, timeout)
+        cdef double deadline = monotonic() + _timeout if _timeout > 0 else 0
+        response = await self.bounded(
+            self.cache.call(_command, connection, uuid, params)
+            if _command.cache is not None
+            else self._execute(_command, connection, uuid, params),
+            _timeout,
+            uuid)
+        if isinstance(response, ResponseStream):
+            response.deadline = deadline
+        return response
+
+    async def _execute(
+            self,
+            Command _command,
+            SocketConnection connection,
+            uuid: str,
+            dict params) -> Union[dict, str, bytes, ResponseStream, None]:
+        if _command.local:
+            return await self.app.local.call(
+                connection, uuid, _command.handler, params)
+        return await self.call_worker(
+            _command.name, connection, uuid, params)
+
+    async def _returns(
+            self,
+            Command _command,
+            SocketConnection connection,
+            uuid: str,
+            dict params):
+        """The value returned by the command's handler or worker task,
+        from which ``_response`` makes the response
+        """
+        if _command.local:
+            return await self.app.local.invoke(
+                connection, uuid, _command.handler, params)
+        return await self.call_task(_command.name, connection, params)
+
+    cpdef _response(
+            self,
+            Command _command,
+            SocketConnection connection,
+            uuid,
+            returns):
+        if _command.local:
+            return self.app.local.response(connection, uuid, returns)
+        return self.worker_response(connection, uuid, returns)
 
     async def run(
             self,
@@ -42,15 +195,107 @@ cdef class SocketRunner(object):
             uuid: str = None,
             cmd: str = None,
             command: str = None,
-            params: dict = None) -> None:
+            params: dict = None,
+            batch: list = None,
+            ordered: bool = False,
+            combine: bool = False,
+            window: int = 0,
+            timeout: float = None) -> None:
+        if batch is not None:
+            await self.run_batch(connection, uuid, batch, ordered, combine)
+            return
         command = command or cmd
-        params = params or {}
-        if command in self.app.local.commands:
-            await self.app.local.run(hash(connection), uuid, command, **params)
-        elif command in self.worker.tasks:
-            await self.run_worker(command, connection, uuid, **params)
-        else:
-            raise UnrecognizedCommand(command)
+        metrics = self.app.metrics
+        cdef double start = monotonic()
+        try:
+            response = await self.execute(
+                connection, uuid, command, params or {}, timeout)
+        except UnrecognizedCommand:
+            # as for batched commands, unknown commands are not measured
+            await connection.respond(
+                dict(uuid=uuid, error="unrecognized_command"))
+            return
+        cdef double executed = monotonic()
+        metrics.observe("execute", command, executed - start)
+        await self.respond(
+            connection,
+            response,
+            window,
+            self.dispatch.compresses(command))
+        metrics.observe("send", command, monotonic() - executed)
+
+    async def _run_item(
+            self,
+            SocketConnection connection,
+            dict item,
+            bint combine) -> Union[dict, str, bytes, None]:
+        command = item.get("command") or item.get("cmd")
+        cdef double start = monotonic()
+        try:
+            response = await self.execute(
+                connection,
+                item.get("uuid"),
+                command,
+                item.get("params") or {},
+                item.get("timeout"))
+            self.app.metrics.observe("execute", command, monotonic() - start)
+        except UnrecognizedCommand:
+            response = dict(
+                uuid=item.get("uuid"),
+                error="unrecognized_command")
+        if isinstance(response, ResponseStream):
+            # streams send their own frames, also in combined batches
+            await response.run()
+            return
+        if combine or response is None:
+            return response
+        await connection.respond(response, self.dispatch.compresses(command))
+
+    async def _run_items(
+            self,
+            SocketConnection connection,
+            items,
+            list responses,
+            bint combine,
+            bint reserved=False) -> None:
+        try:
+            for i, item in items:
+                responses[i] = await self._run_item(
+                    connection, item, combine)
+        finally:
+            if reserved:
+                self.admission.release(connection)
+
+    async def run_batch(
+            self,
+            SocketConnection connection,
+            uuid: str,
+            list batch,
+            bint ordered=False,
+            bint combine=False) -> None:
+        """Run a batch of commands, concurrently unless ``ordered``
+
+        Responses are sent as each command completes, or with ``combine``
+        together in a single frame tagged with the batch ``uuid``. The
+        batch runs in its own admission slot, and in as many more as are
+        free when it starts, so it counts towards the in-flight limits as
+        the commands would sent one by one.
+        """
+        cdef list responses = [None] * len(batch)
+        cdef int workers = 0
+        items = iter(enumerate(batch))
+        if not ordered and len(batch) > 1:
+            workers = self.admission.reserve(connection, len(batch) - 1)
+        # workers share the ``items`` iterator, so each command is run
+        # exactly once
+        await asyncio.gather(
+            self._run_items(connection, items, responses, combine),
+            *[self._run_items(connection, items, responses, combine, True)
+              for _ in range(workers)])
+        if combine:
+            await connection.respond_batch(
+                uuid,
+                [r for r in responses if r is not None])
 
 
 class Py__SocketRunner(SocketRunner):
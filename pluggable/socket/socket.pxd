@@ -1,16 +1,41 @@
 
 from .app cimport SocketApp
 from .connection cimport SocketConnection
+from .deflate cimport Deflate
+from .frame cimport WireFrame
 from .service cimport SocketService
+from .topics cimport TopicIndex
+from .wheel cimport TimerWheel
 
 
 cdef class SocketWrapper(object):
     cdef public SocketApp app
     cdef public dict connections
+    cdef public long long node_prefix
+    cdef public long long last_id
     cdef public service
+    cdef public sessions
+    cdef public int concurrency
+    cdef public codec
+    cdef public int queue_size
+    cdef public str queue_policy
+    cdef public double coalesce_window
+    cdef public TopicIndex topics
+    cdef public int max_subscriptions
+    cdef public double heartbeat_interval
+    cdef public double idle_timeout
+    cdef public TimerWheel wheel
+    cdef public Deflate deflate
+    cdef public long long reaped
+    cpdef long long next_id(self)
     cpdef public SocketConnection connect(self, websocket, str path)
     cpdef public disconnect(self, SocketConnection connection)
-    cpdef public log(self, list msgs)
+    cpdef public log(self, list msgs, int level=*)
     cpdef public _log(self, connection, str connection_type)
     cpdef public listen(self)
     cpdef public serve(self)
+    cpdef tune(self, websocket)
+    cpdef double idle_check(self, double idle=*)
+    cpdef on_idle(self, connection_id)
+    cpdef reap(self, SocketConnection connection)
+    cpdef WireFrame _deflated(self, dict frames, codec, frame)
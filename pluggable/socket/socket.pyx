@@ -2,20 +2,40 @@
 # cython: linetrace=True
 # cython: binding=True
 
-from typing import Union
+from __future__ import absolute_import
+
+import asyncio
+from os import environ, urandom
+from socket import IPPROTO_TCP, TCP_NODELAY
+from typing import Callable, Dict, Union
 
-import rapidjson as json
 import websockets
 
 from .app cimport SocketApp
+from .cache cimport SessionCache
+from .codec cimport negotiate
+from .codec import codecs
+from .logger import DEBUG, INFO
 from .connection cimport SocketConnection
+from .deflate cimport Deflate
+from .drain import inherited
+from .frame cimport Frame, WireFrame
+from .limits cimport monotonic
+from .queue cimport SendQueue
 from .request cimport SocketRequest
-from .utils cimport truncate
 from .service cimport SocketService
+from .supervisor import WORKER_ENV
+from .topics cimport TopicIndex
+from .wheel cimport TimerWheel
 
 cimport cython
 
 
+# 23 bits of node id and 40 of connection sequence fit a signed 64-bit int
+DEF ID_BITS = 40
+DEF NODE_MASK = 0x7fffff
+
+
 cdef class SocketWrapper(object):
     ws = None
 
@@ -26,20 +46,85 @@ cdef class SocketWrapper(object):
     def __init__(self, app):
         self.listen()
         self.service = SocketService(app.config["ip"], app.config["port"])
+        self.concurrency = app.config["send_concurrency"]
+        self.codec = codecs[app.config["codec"]]
+        self.sessions = SessionCache(
+            app.sessions,
+            app.config["session_cache_size"],
+            app.config["session_cache_ttl"])
+        self.queue_size = app.config["send_queue_size"]
+        self.queue_policy = app.config["send_queue_policy"]
+        self.coalesce_window = app.config["coalesce_window"]
+        if app.config["compression"] == "deflate":
+            self.deflate = Deflate(
+                app.config["compression_threshold"],
+                app.config["compression_level"],
+                app.config["compression_shared"])
+        self.topics = TopicIndex()
+        node_id = app.config["node_id"]
+        if node_id is None:
+            # pids repeat across hosts, so unconfigured nodes pick at random
+            node_id = int.from_bytes(urandom(3), "big")
+        elif WORKER_ENV in environ:
+            # worker processes share the configured id, so each takes its
+            # own from it
+            node_id = (
+                node_id * app.config["processes"]
+                + int(environ[WORKER_ENV]))
+        self.node_prefix = (node_id & NODE_MASK) << ID_BITS
+        self.max_subscriptions = app.config["max_subscriptions"]
+        self.heartbeat_interval = app.config["heartbeat_interval"]
+        self.idle_timeout = app.config["idle_timeout"]
+        if self.heartbeat_interval > 0 or self.idle_timeout > 0:
+            self.wheel = TimerWheel(
+                app.config["timer_tick"],
+                app.config["timer_slots"],
+                self.on_idle,
+                app.logger)
+
+    cpdef long long next_id(self):
+        # ids are unique to the node, and carry the node id in the high
+        # bits so they are unique across nodes sharing a registry
+        self.last_id += 1
+        return self.node_prefix | self.last_id
 
     cpdef SocketConnection connect(
             self,
             websocket: websockets.WebSocketServerProtocol,
             str path):
         connection = SocketConnection(self, websocket, path)
-        self.connections[hash(connection)] = dict(
-            socket=connection.connection,
-            connection=connection)
+        connection.codec = negotiate(path, self.codec)
+        connection.id = self.next_id()
+        connection.last_seen = monotonic()
+        self.connections[connection.id] = connection
+        if self.wheel is not None:
+            self.wheel.schedule(connection.id, self.idle_check())
+        if self.queue_size > 0:
+            connection.queue = SendQueue(
+                websocket,
+                self._send,
+                self.queue_size,
+                self.queue_policy,
+                connection.codec,
+                self.coalesce_window)
+            connection.queue.start(self.app.loop)
+        if self.app.registry.shared:
+            self.app.loop.create_task(
+                self.app.registry.add(connection.id))
         self._log(connection, "connect")
         return connection
 
     cpdef disconnect(self, SocketConnection connection):
-        del self.connections[hash(connection)]
+        del self.connections[connection.id]
+        connection.cancel()
+        if self.wheel is not None:
+            self.wheel.cancel(connection.id)
+        self.topics.remove(connection.id)
+        if connection.queue is not None:
+            connection.queue.close()
+        if self.app.registry.shared:
+            self.app.loop.create_task(
+                self.app.registry.remove(connection.id))
         self._log(connection, "disconnect")
 
     cpdef listen(self):
@@ -49,6 +134,9 @@ cdef class SocketWrapper(object):
         self.app.signals.listen(
             'auth.session.destroy',
             self.on_session_destroy)
+        self.app.bus.subscribe("send", self.on_bus_send)
+        self.app.bus.subscribe("signal", self.on_bus_signal)
+        self.app.bus.subscribe("topic", self.on_bus_topic)
 
     cpdef _log(self,
                connection: Union[SocketService, SocketConnection],
@@ -57,73 +145,390 @@ cdef class SocketWrapper(object):
         self.app.signals.emit(
             'socket.%s' % connection_type,
             '%s:%s' % (connection.ip, connection.port))
-        msg = (
+        self.app.logger.event(
             '%s (%s): %s %s'
             % (connection_type,
                hash(self),
                connection.ip,
                connection.port))
-        self.app.loop.create_task(
-            self.app.worker.tasks['log'].call(
-                **dict(type="server", msg=msg)))
+
+    cpdef double idle_check(self, double idle=0):
+        """Seconds until a connection idle for ``idle`` seconds is due a
+        heartbeat or to be reaped
+        """
+        cdef double delay = 0
+        if self.heartbeat_interval > 0:
+            delay = (
+                self.heartbeat_interval - idle
+                if idle < self.heartbeat_interval
+                else self.heartbeat_interval)
+        if self.idle_timeout > 0 and (
+                not delay or self.idle_timeout - idle < delay):
+            delay = self.idle_timeout - idle
+        return delay
+
+    cpdef on_idle(self, connection_id):
+        # activity only updates ``last_seen``, so the timer is checked
+        # against it when it fires, and moved on if there was any
+        cdef SocketConnection connection = self.connections.get(
+            connection_id)
+        if connection is None:
+            return
+        cdef double idle = monotonic() - connection.last_seen
+        if self.idle_timeout > 0 and idle >= self.idle_timeout:
+            self.reap(connection)
+            return
+        if self.heartbeat_interval > 0 and idle >= self.heartbeat_interval:
+            self.app.loop.create_task(
+                connection.write(
+                    connection.codec.encode(dict(heartbeat=idle))))
+        self.wheel.schedule(connection_id, self.idle_check(idle))
+
+    cpdef reap(self, SocketConnection connection):
+        # the peer is gone or silent, so there is no closing handshake.
+        # Aborting makes ``recv`` raise, and ``pipe`` disconnects as for
+        # any closed connection
+        self.reaped += 1
+        self.log(['reap:', connection.ip, connection.port])
+        connection.connection.transport.abort()
 
     cpdef serve(self):
         self._log(
             self.service,
             "listening")
+        if self.wheel is not None:
+            self.wheel.start(self.app.loop)
+        config = self.app.config
+        options = dict(
+            backlog=config["backlog"],
+            max_size=config["max_size"],
+            max_queue=config["max_queue"],
+            read_limit=config["read_limit"],
+            write_limit=config["write_limit"],
+            compression=config["compression"],
+            extensions=(
+                [self.deflate.factory()]
+                if self.deflate is not None
+                else None),
+            ping_interval=config["ping_interval"])
+        sock = inherited()
+        if sock is not None:
+            # the listening socket of the process this one replaces
+            return websockets.serve(self.pipe, sock=sock, **options)
         return websockets.serve(
             self.pipe,
             self.service.ip,
-            self.service.port)
+            self.service.port,
+            reuse_port=config["processes"] > 1,
+            **options)
+
+    cpdef tune(self, websocket: websockets.WebSocketServerProtocol):
+        # websockets sets the high water mark only, with the low at a
+        # quarter of it
+        config = self.app.config
+        transport = websocket.transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None and config["tcp_nodelay"] is not None:
+            sock.setsockopt(
+                IPPROTO_TCP, TCP_NODELAY, int(bool(config["tcp_nodelay"])))
+        if config["write_low_water"] is not None:
+            transport.set_write_buffer_limits(
+                config["write_limit"], config["write_low_water"])
 
-    cpdef log(self, list msgs):
-        print('app.socket: ' + ' '.join([str(m) for m in msgs]))
+    cpdef log(self, list msgs, int level=INFO):
+        self.app.logger.log(level, 'app.socket:', tuple(msgs))
 
     async def on_session_create(
             self,
             signal: str,
             session: str = None,
             connection: int = None) -> None:
-        self.connections[connection]['session'] = session
+        if await self._forward(signal, connection, session=session):
+            return
+        _connection = self.connections[connection]
+        _connection.session = session
+        _connection.signalled = True
+        _connection.resolved = False
+        # a lookup made before login may have cached no session
+        self.sessions.invalidate(_connection.session_key)
+        if self.app.registry.shared:
+            await self.app.registry.bind(connection, session)
 
     async def on_session_destroy(self, signal: str, connection: int) -> None:
-        del self.connections[connection]['session']
+        if await self._forward(signal, connection):
+            return
+        _connection = self.connections[connection]
+        _connection.session = None
+        _connection.signalled = False
+        _connection.resolved = False
+        self.sessions.invalidate(_connection.session_key)
+        if self.app.registry.shared:
+            await self.app.registry.bind(connection, None)
+
+    async def _forward(self, str signal, connection: int, **kwargs) -> bool:
+        # session signals for connections served by another process are
+        # passed on over the bus, to the owning node where it is known
+        if not self.app.bus.remote or connection in self.connections:
+            return False
+        node = None
+        if self.app.registry.shared:
+            node = next(
+                iter(await self.app.registry.locate([connection])),
+                None)
+        await self.app.bus.publish(
+            "signal",
+            dict(signal=signal, connection=connection, **kwargs),
+            node)
+        return True
+
+    async def on_bus_signal(self, dict msg) -> None:
+        if msg["connection"] not in self.connections:
+            return
+        if msg["signal"] == 'auth.session.create':
+            await self.on_session_create(
+                msg["signal"],
+                session=msg.get("session"),
+                connection=msg["connection"])
+        elif msg["signal"] == 'auth.session.destroy':
+            await self.on_session_destroy(msg["signal"], msg["connection"])
+
+    async def on_bus_send(self, dict msg) -> None:
+        if msg["connections"] is None:
+            targets = list(self.connections)
+        else:
+            targets = [
+                target
+                for target
+                in msg["connections"]
+                if target in self.connections]
+        if targets:
+            await self.fanout(msg["msg"], targets, msg.get("key"))
+
+    async def on_bus_topic(self, dict msg) -> None:
+        targets = list(self.topics.match(msg["topic"]))
+        if targets:
+            await self.fanout(msg["msg"], targets, msg.get("key"))
+
+    @property
+    def builtins(self) -> Dict[str, Callable]:
+        return dict(
+            subscribe=self.subscribe,
+            unsubscribe=self.unsubscribe,
+            stats=self.app.metrics.stats)
+
+    async def subscribe(
+            self,
+            connection: int,
+            uuid: str,
+            topic) -> dict:
+        # untyped, as clients can send anything
+        if (not isinstance(topic, str)
+                or not topic
+                or "*" in topic[:-1]):
+            return dict(error="invalid_topic")
+        if (len(self.topics.subscriptions.get(connection, ()))
+                >= self.max_subscriptions):
+            return dict(error="too_many_subscriptions")
+        self.topics.subscribe(connection, topic)
+        return dict(subscribed=topic)
+
+    async def unsubscribe(
+            self,
+            connection: int,
+            uuid: str,
+            topic) -> dict:
+        if not isinstance(topic, str):
+            return dict(error="invalid_topic")
+        self.topics.unsubscribe(connection, topic)
+        return dict(unsubscribed=topic)
 
     @cython.iterable_coroutine
     async def pipe(
             self,
             websocket: websockets.WebSocketServerProtocol,
             path: str) -> None:
+        self.tune(websocket)
         connection = self.connect(websocket, path)
         try:
             await connection.connect()
         except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            # however the connection ends, its state is released
             self.disconnect(connection)
 
     async def _send(
             self,
             websocket: websockets.WebSocketServerProtocol,
-            msg: Union[dict, str, bytes]) -> None:
-        msg = (
-            msg
-            if type(msg) in [str, bytes]
-            else json.dumps(msg))
-        await websocket.send(msg)
-        ip, port = websocket.remote_address[:2]
-        self.log(['send:', ip, port, truncate(str(msg))])
+            msg: Union[str, bytes, Frame, WireFrame]) -> None:
+        cdef double start = monotonic()
+        if self.deflate is not None:
+            msg = self.deflate.prepare(websocket, msg)
+        elif type(msg) == WireFrame:
+            msg = msg.message
+        if type(msg) == WireFrame and not msg.compressed:
+            await self.deflate.send_plain(websocket, msg.message)
+        elif type(msg) in [Frame, WireFrame]:
+            await msg.send(websocket)
+        else:
+            await websocket.send(msg)
+        self.app.metrics.sent(msg, monotonic() - start)
+        if self.app.logger.level <= DEBUG:
+            ip, port = websocket.remote_address[:2]
+            self.log(['send:', ip, port, msg], DEBUG)
+
+    async def _fanout(
+            self,
+            targets,
+            msg: Union[dict, str, bytes],
+            key,
+            dict frames,
+            dict failures):
+        # workers share the ``targets`` iterator, so each connection is
+        # written to exactly once, and the message is encoded (and
+        # compressed, if large enough) once for each codec in use
+        cdef SocketConnection connection
+        for target in targets:
+            try:
+                connection = self.connections[target]
+                frame = frames.get(connection.codec)
+                if frame is None:
+                    frame = frames[connection.codec] = (
+                        connection.codec.encode(msg))
+                if (self.deflate is not None
+                        and len(frame) >= self.deflate.threshold
+                        and self.deflate.accepts(
+                            self.deflate.extension(connection.connection))):
+                    frame = self._deflated(frames, connection.codec, frame)
+                if connection.queue is not None:
+                    connection.queue.put(frame, key)
+                else:
+                    await self._send(connection.connection, frame)
+                connection.sent += 1
+            except Exception as e:
+                failures[target] = e
+
+    cpdef WireFrame _deflated(self, dict frames, codec, frame):
+        key = (codec, "deflate")
+        deflated = frames.get(key)
+        if deflated is None:
+            deflated = frames[key] = self.deflate.compress(frame)
+        return deflated
+
+    async def fanout(
+            self,
+            msg: Union[dict, str, bytes],
+            list connections,
+            key=None) -> Dict[int, Exception]:
+        cdef dict failures = {}
+        cdef dict frames = {}
+        cdef int workers = min(max(self.concurrency, 1), len(connections))
+        targets = iter(connections)
+        if workers == 1 or self.queue_size > 0:
+            # queued writes never block, so a single worker suffices
+            await self._fanout(targets, msg, key, frames, failures)
+        else:
+            await asyncio.gather(
+                *[self._fanout(targets, msg, key, frames, failures)
+                  for _ in range(workers)])
+        for connection, e in failures.items():
+            self.log(['failed sending:', connection, repr(e)])
+        return failures
 
     async def send(
             self,
             msg: Union[dict, str, bytes],
-            connections=None) -> None:
+            connections=None,
+            key=None) -> Dict[int, Exception]:
+        cdef list remote
         if len(connections or []) > 0:
-            for connection in connections:
-                await self._send(self.connections[connection]['socket'], msg)
-        elif len(self.connections) == 0:
+            if self.app.registry.shared:
+                return await self.route(msg, list(connections), key)
+            elif not self.app.bus.remote:
+                return await self.fanout(msg, list(connections), key)
+            # targets not connected here may be served by another process
+            remote = [
+                target
+                for target
+                in connections
+                if target not in self.connections]
+            if remote:
+                await self.app.bus.publish(
+                    "send",
+                    dict(msg=msg, connections=remote, key=key))
+            return await self.fanout(
+                msg,
+                [target
+                 for target
+                 in connections
+                 if target in self.connections],
+                key)
+        if self.app.bus.remote:
+            await self.app.bus.publish(
+                "send",
+                dict(msg=msg, connections=None, key=key))
+        if len(self.connections) == 0:
             self.log(['failed sending, nothing connected!'])
+            return {}
+        return await self.fanout(msg, list(self.connections), key)
+
+    async def route(
+            self,
+            msg: Union[dict, str, bytes],
+            list connections,
+            key=None) -> Dict[int, Exception]:
+        # one publish for each node serving any of the targets. Targets
+        # unknown to the registry are tried here, so that they are
+        # reported as failures
+        routes = await self.app.registry.locate(connections)
+        local = routes.pop(self.app.bus.node, []) + routes.pop(None, [])
+        for node, targets in routes.items():
+            await self.app.bus.publish(
+                "send",
+                dict(msg=msg, connections=targets, key=key),
+                node)
+        if not local:
+            return {}
+        return await self.fanout(msg, local, key)
+
+    async def send_sessions(
+            self,
+            msg: Union[dict, str, bytes],
+            list sessions,
+            key=None) -> Dict[int, Exception]:
+        if self.app.registry.shared:
+            connections = await self.app.registry.lookup(sessions)
         else:
-            for connection in self.connections.values():
-                await self._send(connection['socket'], msg)
+            targets = set(sessions)
+            connections = [
+                k
+                for k, v
+                in self.connections.items()
+                if v.session in targets]
+        if not connections:
+            return {}
+        return await self.send(msg, connections, key)
+
+    async def publish(
+            self,
+            str topic,
+            msg: Union[dict, str, bytes],
+            key=None) -> Dict[int, Exception]:
+        if self.app.bus.remote:
+            await self.app.bus.publish(
+                "topic",
+                dict(topic=topic, msg=msg, key=key))
+        targets = list(self.topics.match(topic))
+        if not targets:
+            return {}
+        return await self.fanout(msg, targets, key)
+
+    def queue_stats(self) -> Dict[int, dict]:
+        return {
+            k: v.queue.stats
+            for k, v
+            in self.connections.items()
+            if v.queue is not None}
 
 
 class Py__SocketWrapper(SocketWrapper):
@@ -0,0 +1,16 @@
+from .connection cimport SocketConnection
+
+
+cdef class ResponseStream:
+     cdef public SocketConnection connection
+     cdef public uuid
+     cdef public iterator
+     cdef public int window
+     cdef public double deadline
+     cdef public long long seq
+     cdef public long long acked
+     cdef credit
+     cpdef ack(self, long long seq)
+
+
+cpdef bint streamable(response)
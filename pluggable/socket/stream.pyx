@@ -0,0 +1,103 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+from inspect import isasyncgen
+
+from .connection cimport SocketConnection
+from .limits cimport monotonic
+from .logger import ERROR
+
+
+cpdef bint streamable(response):
+    return isasyncgen(response)
+
+
+cdef class ResponseStream(object):
+    """Sends the items of an async generator to the client as they are
+    produced
+
+    Each item is sent as ``{"uuid": ..., "seq": n, "chunk": item}``, and
+    the stream ends with ``{"uuid": ..., "seq": n, "done": true}``, or an
+    ``error`` if the generator raises.
+
+    Writes wait while the connection's send queue is over half full, so
+    chunks are not dropped by its overflow policy. With a ``window``,
+    requested by the client, at most that many chunks are sent beyond the
+    last ``seq`` it acknowledged with ``{"ack": uuid, "seq": n}``.
+
+    The generator is closed if the stream is cancelled, by the client
+    with ``{"cancel": uuid}`` or by it disconnecting, or if it is still
+    running at the ``deadline`` (on the ``monotonic`` clock) of the
+    command's timeout, in which case the stream ends with a ``timeout``
+    error.
+    """
+
+    def __cinit__(
+            self,
+            SocketConnection connection,
+            uuid,
+            iterator,
+            int window=0):
+        self.connection = connection
+        self.uuid = uuid
+        self.iterator = iterator
+        self.window = window
+        self.credit = asyncio.Event()
+        self.credit.set()
+
+    cpdef ack(self, long long seq):
+        if seq > self.acked:
+            self.acked = seq
+        if self.window <= 0 or self.seq - self.acked < self.window:
+            self.credit.set()
+
+    async def wait(self) -> None:
+        if self.window > 0:
+            while self.seq - self.acked >= self.window:
+                self.credit.clear()
+                await self.credit.wait()
+        queue = self.connection.queue
+        if queue is not None:
+            await queue.writable(queue.maxsize // 2)
+
+    async def write(self, dict msg) -> None:
+        await self.connection.write(self.connection.codec.encode(msg))
+
+    async def run(self) -> None:
+        if self.deadline <= 0:
+            await self._run()
+            return
+        try:
+            await asyncio.wait_for(
+                self._run(), max(self.deadline - monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.connection.app.runner.timeouts += 1
+            await self.write(
+                dict(uuid=self.uuid, seq=self.seq, error="timeout"))
+
+    async def _run(self) -> None:
+        self.connection.streams[self.uuid] = self
+        try:
+            async for item in self.iterator:
+                await self.wait()
+                self.seq += 1
+                await self.write(
+                    dict(uuid=self.uuid, seq=self.seq, chunk=item))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.connection.app.logger.log(
+                ERROR, 'app.stream:', (self.uuid, repr(e)))
+            await self.write(
+                dict(uuid=self.uuid, seq=self.seq, error="stream_failed"))
+        else:
+            await self.write(dict(uuid=self.uuid, seq=self.seq, done=True))
+        finally:
+            self.connection.streams.pop(self.uuid, None)
+            await self.iterator.aclose()
+
+
+class Py__ResponseStream(ResponseStream):
+    pass
@@ -0,0 +1,11 @@
+
+cdef class SocketSupervisor:
+     cdef public app
+     cdef public int processes
+     cdef public dict children
+     cdef public dict started
+     cdef public bint stopping
+     cdef public bint restarting
+     cdef public double restart_delay
+     cpdef restart(self)
+     cpdef stop(self)
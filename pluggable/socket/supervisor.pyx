@@ -0,0 +1,132 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+import os
+import signal
+import sys
+from functools import partial
+
+from .drain import HANDOFF_ENV
+from .logger import INFO, WARNING
+
+
+WORKER_ENV = "PLUGGABLE_SOCKET_WORKER"
+WORKER_READY_ENV = "PLUGGABLE_SOCKET_WORKER_READY"
+
+
+def serving() -> None:
+    """Tell the supervisor this worker is serving
+    """
+    fd = os.environ.pop(WORKER_READY_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b"1")
+    finally:
+        os.close(int(fd))
+
+
+cdef class SocketSupervisor(object):
+    """Runs ``processes`` copies of the current command, each serving the
+    app on the same port with ``SO_REUSEPORT``
+
+    Workers are told apart by the ``PLUGGABLE_SOCKET_WORKER`` environment
+    variable, are restarted if they exit, and are terminated when the
+    supervisor receives ``SIGTERM`` or ``SIGINT``. ``SIGUSR2`` restarts
+    them one at a time, the others serving the port meanwhile: each
+    replacement must be serving before the next worker is stopped.
+    """
+
+    def __cinit__(self, app, int processes, double restart_delay=1.0):
+        self.app = app
+        self.processes = processes
+        self.restart_delay = restart_delay
+        self.children = {}
+        self.started = {}
+
+    async def run(self) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.app.loop.add_signal_handler(sig, self.stop)
+        self.app.loop.add_signal_handler(signal.SIGUSR2, self.restart)
+        await asyncio.gather(
+            *[self.supervise(index)
+              for index in range(self.processes)])
+        self.app.loop.stop()
+
+    async def spawn(self, int index) -> asyncio.subprocess.Process:
+        read, write = os.pipe()
+        env = dict(os.environ)
+        env[WORKER_ENV] = str(index)
+        env[WORKER_READY_ENV] = str(write)
+        # workers bind the port themselves
+        env.pop(HANDOFF_ENV, None)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, *sys.argv, env=env, pass_fds=(write, ))
+        finally:
+            os.close(write)
+        self.started[index] = self.app.loop.create_task(
+            self.wait_started(read))
+        return process
+
+    async def wait_started(self, int fd) -> bool:
+        reader = asyncio.StreamReader()
+        transport, _ = await self.app.loop.connect_read_pipe(
+            partial(asyncio.StreamReaderProtocol, reader),
+            os.fdopen(fd, "rb"))
+        try:
+            # the pipe is closed without a write if the worker fails
+            return bool(await reader.read(1))
+        finally:
+            transport.close()
+
+    async def supervise(self, int index) -> None:
+        while not self.stopping:
+            process = self.children[index] = await self.spawn(index)
+            self.app.logger.log(
+                INFO, 'app.supervisor:', ('started', index, process.pid))
+            code = await process.wait()
+            if self.stopping:
+                break
+            self.app.logger.log(
+                WARNING, 'app.supervisor:', ('exited', index, code))
+            await asyncio.sleep(self.restart_delay)
+
+    cpdef restart(self):
+        if not self.restarting:
+            self.app.loop.create_task(self.roll())
+
+    async def roll(self) -> None:
+        self.restarting = True
+        try:
+            for index in sorted(self.children):
+                process = self.children[index]
+                if process.returncode is None:
+                    # the worker drains, and ``supervise`` replaces it
+                    process.terminate()
+                    await process.wait()
+                while self.children[index] is process and not self.stopping:
+                    await asyncio.sleep(self.restart_delay)
+                if self.stopping:
+                    break
+                if not await self.started[index]:
+                    # stopping the others would leave nothing serving
+                    self.app.logger.log(
+                        WARNING,
+                        'app.supervisor:',
+                        ('restart failed', index))
+                    break
+        finally:
+            self.restarting = False
+
+    cpdef stop(self):
+        self.stopping = True
+        for process in self.children.values():
+            if process.returncode is None:
+                process.terminate()
+
+
+class Py__SocketSupervisor(SocketSupervisor):
+    pass
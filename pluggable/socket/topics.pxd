@@ -0,0 +1,9 @@
+
+cdef class TopicIndex:
+     cdef public dict topics
+     cdef public dict prefixes
+     cdef public dict subscriptions
+     cpdef bint subscribe(self, connection, str topic)
+     cpdef bint unsubscribe(self, connection, str topic)
+     cpdef remove(self, connection)
+     cpdef set match(self, str topic)
@@ -0,0 +1,67 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+
+cdef class TopicIndex(object):
+    """Inverted index of topic to subscribed connections
+
+    A topic ending with ``*`` subscribes to every topic starting with what
+    precedes it. Matching looks up each prefix of the published topic, so
+    it does not depend on the number of subscriptions, and the topics each
+    connection subscribed to are kept so removing it only touches those.
+    """
+
+    def __cinit__(self):
+        self.topics = {}
+        self.prefixes = {}
+        self.subscriptions = {}
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    cpdef bint subscribe(self, connection, str topic):
+        subscriptions = self.subscriptions.setdefault(connection, set())
+        if topic in subscriptions:
+            return False
+        subscriptions.add(topic)
+        if topic.endswith("*"):
+            self.prefixes.setdefault(topic[:-1], set()).add(connection)
+        else:
+            self.topics.setdefault(topic, set()).add(connection)
+        return True
+
+    cpdef bint unsubscribe(self, connection, str topic):
+        subscriptions = self.subscriptions.get(connection)
+        if not subscriptions or topic not in subscriptions:
+            return False
+        subscriptions.remove(topic)
+        if not subscriptions:
+            del self.subscriptions[connection]
+        if topic.endswith("*"):
+            index, topic = self.prefixes, topic[:-1]
+        else:
+            index = self.topics
+        connections = index[topic]
+        connections.discard(connection)
+        if not connections:
+            del index[topic]
+        return True
+
+    cpdef remove(self, connection):
+        for topic in list(self.subscriptions.get(connection, ())):
+            self.unsubscribe(connection, topic)
+
+    cpdef set match(self, str topic):
+        cdef set matched = set(self.topics.get(topic, ()))
+        cdef int i
+        if self.prefixes:
+            for i in range(len(topic) + 1):
+                connections = self.prefixes.get(topic[:i])
+                if connections:
+                    matched.update(connections)
+        return matched
+
+
+class Py__TopicIndex(TopicIndex):
+    pass
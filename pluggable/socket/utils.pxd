@@ -1,3 +1,2 @@
 
-
-cpdef str truncate(str)
+cpdef str truncate(msg, int length=*)
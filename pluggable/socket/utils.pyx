@@ -1,6 +1,17 @@
 
+import reprlib
 
-# this needs improving
 
-cpdef inline str truncate(str msg):
-    return str(msg)[:50]
+_repr = reprlib.Repr()
+_repr.maxlevel = 2
+_repr.maxdict = _repr.maxlist = _repr.maxtuple = 8
+_repr.maxstring = _repr.maxother = 50
+
+
+cpdef inline str truncate(msg, int length=50):
+    # slice before stringifying, so large messages are never rendered whole
+    if type(msg) == str:
+        return msg[:length]
+    if type(msg) == bytes:
+        return str(msg[:length])[:length]
+    return _repr.repr(msg)[:length]
@@ -0,0 +1,15 @@
+
+cdef class TimerWheel:
+     cdef public double tick
+     cdef public int size
+     cdef public callback
+     cdef public logger
+     cdef public list slots
+     cdef public dict timers
+     cdef public int cursor
+     cdef public task
+     cpdef schedule(self, key, double delay)
+     cpdef cancel(self, key)
+     cpdef list advance(self)
+     cpdef start(self, loop)
+     cpdef stop(self)
@@ -0,0 +1,88 @@
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# cython: linetrace=True
+# cython: binding=True
+
+import asyncio
+from math import ceil
+from typing import Callable
+
+from .logger import ERROR
+
+cdef class TimerWheel(object):
+    """Hashed timer wheel of ``size`` slots, ``tick`` seconds apart
+
+    Timers are keyed, with at most one per key. Scheduling and cancelling
+    are constant time, and a single task advances the wheel one slot per
+    tick, calling ``callback`` with the key of each timer that is due.
+    Delays longer than the wheel are kept as the number of turns left.
+    A callback that raises is logged to ``logger``, and the other timers
+    still fire.
+    """
+
+    def __cinit__(
+            self,
+            double tick,
+            int size,
+            callback: Callable,
+            logger=None):
+        self.tick = tick
+        self.size = size
+        self.callback = callback
+        self.logger = logger
+        self.slots = [{} for _ in range(size)]
+        self.timers = {}
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key) -> bool:
+        return key in self.timers
+
+    cpdef schedule(self, key, double delay):
+        cdef long long ticks = max(<long long>ceil(delay / self.tick), 1)
+        cdef int slot = (self.cursor + ticks) % self.size
+        self.cancel(key)
+        self.slots[slot][key] = (ticks - 1) // self.size
+        self.timers[key] = slot
+
+    cpdef cancel(self, key):
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    cpdef list advance(self):
+        self.cursor = (self.cursor + 1) % self.size
+        cdef dict slot = self.slots[self.cursor]
+        cdef list due = []
+        for key, turns in slot.items():
+            if turns:
+                slot[key] = turns - 1
+            else:
+                due.append(key)
+        for key in due:
+            del slot[key]
+            del self.timers[key]
+        for key in due:
+            try:
+                self.callback(key)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.log(ERROR, 'app.wheel:', (key, repr(e)))
+        return due
+
+    cpdef start(self, loop):
+        self.task = loop.create_task(self.run())
+
+    cpdef stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+
+class Py__TimerWheel(TimerWheel):
+    pass
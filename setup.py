@@ -16,11 +16,14 @@ if 'SETUPPY_CFLAGS' in os.environ:
 
 
 install_requires = [
-    'aioredis',
+    # create_redis and the 1.x pubsub API are used, both gone in 2
+    'aioredis>=1.3,<2',
+    # 0.6.1 adds strict_map_key
+    'msgpack>=0.6.1',
     'pluggable.core',
     'python-rapidjson',
-    'umsgpack',
-    'websockets',
+    # the frame-level API of the legacy protocol is removed in 14
+    'websockets>=10,<14',
     'uvloop']
 extras_require = {}
 extras_require['test'] = [
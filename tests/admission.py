@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from pluggable.socket.admission import Py__Admission as Admission
+from pluggable.socket.connection import SocketConnection
+from pluggable.socket.socket import SocketWrapper
+
+
+class _MockSocketWrapper(SocketWrapper):
+
+    def __init__(self, app):
+        pass
+
+
+class _MockConnection(SocketConnection):
+    rejected = None
+
+    def reject(self, uuid, error):
+        self.rejected.append((uuid, error))
+
+
+def MockConnection():
+    connection = _MockConnection(
+        _MockSocketWrapper(None), "CONNECTION", "PATH")
+    connection.rejected = []
+    return connection
+
+
+def MockRunner():
+    runner = MagicMock()
+    runner.app.loop.create_task.side_effect = lambda coro: MagicMock()
+    return runner
+
+
+def test_admission_signature():
+    with pytest.raises(TypeError):
+        Admission()
+
+
+def test_admission():
+    admission = Admission("RUNNER", 2, 3)
+    assert admission.runner == "RUNNER"
+    assert admission.limit == 2
+    assert admission.global_limit == 3
+    assert admission.max_pending == 0
+    assert admission.timeout == 0
+    assert admission.running == 0
+    assert len(admission.waiting) == 0
+
+
+def test_admission_start():
+    runner = MockRunner()
+    admission = Admission(runner, 2, 3)
+    connection = MockConnection()
+    admission.start(connection, {"uuid": "UUID", "command": "FOO"})
+    assert admission.running == 1
+    assert (
+        [c[0] for c in runner.run.call_args_list]
+        == [(connection, )])
+    assert (
+        [c[1] for c in runner.run.call_args_list]
+        == [{"uuid": "UUID", "command": "FOO"}])
+    assert (
+        [c[0] for c in runner.app.metrics.observe.call_args_list]
+        == [("queue", runner.app.metrics.label.return_value, 0)])
+    assert (
+        [c[0] for c in runner.app.metrics.label.call_args_list]
+        == [({"uuid": "UUID", "command": "FOO"}, )])
+    task = list(connection.tasks)[0]
+    assert connection.tasks == {task: "UUID"}
+    callback = task.add_done_callback.call_args[0][0]
+    callback(task)
+    assert admission.running == 0
+    assert connection.tasks == {}
+    # a second callback for the same task is ignored
+    callback(task)
+    assert admission.running == 0
+
+
+def test_admission_start_timeout():
+    runner = MockRunner()
+    admission = Admission(runner, 2, 3)
+    connection = MockConnection()
+    # the time spent queued is taken off the client's timeout
+    admission.start(
+        connection, {"uuid": "UUID1", "timeout": 5}, 2)
+    admission.start(
+        connection, {"uuid": "UUID2", "timeout": 5}, 5)
+    admission.start(
+        connection, {"uuid": "UUID3", "timeout": "5"}, 5)
+    assert (
+        [c[1] for c in runner.run.call_args_list]
+        == [{"uuid": "UUID1", "timeout": 3},
+            {"uuid": "UUID3", "timeout": "5"}])
+    assert connection.rejected == [("UUID2", "timeout")]
+    assert admission.running == 2
+
+
+def test_admission_closed():
+    runner = MockRunner()
+    admission = Admission(runner, 2, 3)
+    connection = MockConnection()
+    assert not admission.closed
+    admission.closed = True
+    assert not admission.submit(connection, {"uuid": "UUID"})
+    assert connection.rejected == [("UUID", "draining")]
+    assert admission.running == 0
+    assert not runner.run.called
+
+
+def test_admission_invalid():
+    runner = MockRunner()
+    admission = Admission(runner, 2, 3)
+    connection = MockConnection()
+    assert not admission.submit(
+        connection, {"uuid": "UUID", "command": "FOO", "bar": 7})
+    assert connection.rejected == [("UUID", "invalid_request")]
+    assert admission.running == 0
+    assert not runner.run.called
+
+
+def test_admission_error():
+    runner = MockRunner()
+    runner.app.loop.create_task.side_effect = Exception("FAIL")
+    admission = Admission(runner, 2, 3)
+    connection = MockConnection()
+    # errors are raised rather than returned as false
+    with pytest.raises(Exception, match="FAIL"):
+        admission.submit(connection, {"uuid": "UUID"})
+    _patch = patch(
+        "pluggable.socket.admission.Py__Admission.available",
+        side_effect=Exception("FAIL"))
+    with _patch:
+        with pytest.raises(Exception, match="FAIL"):
+            admission.reserve(connection, 1)
+
+
+def test_admission_reject():
+    runner = MockRunner()
+    admission = Admission(runner, 1, 3)
+    connection = MockConnection()
+    assert admission.submit(connection, {"uuid": "UUID1"})
+    assert not admission.submit(connection, {"uuid": "UUID2"})
+    assert connection.rejected == [("UUID2", "overloaded")]
+    assert admission.running == 1
+
+
+def test_admission_pending():
+    runner = MockRunner()
+    admission = Admission(runner, 1, 3, 1, 10)
+    connection = MockConnection()
+    assert admission.submit(connection, {"uuid": "UUID1"})
+    assert admission.submit(connection, {"uuid": "UUID2"})
+    assert not admission.submit(connection, {"uuid": "UUID3"})
+    assert connection.rejected == [("UUID3", "overloaded")]
+    assert len(connection.pending) == 1
+    task = list(connection.tasks)[0]
+    admission.done(connection, task)
+    assert list(connection.tasks.values()) == ["UUID2"]
+    assert len(connection.pending) == 0
+    assert admission.running == 1
+    # the time spent pending is recorded
+    waits = [c[0][2] for c in runner.app.metrics.observe.call_args_list]
+    assert waits[0] == 0
+    assert 0 <= waits[1] < 1
+
+
+def test_admission_pending_expired():
+    runner = MockRunner()
+    admission = Admission(runner, 1, 3, 1, 10)
+    connection = MockConnection()
+    admission.submit(connection, {"uuid": "UUID1"})
+    connection.pending.append((0, {"uuid": "UUID2"}))
+    admission.done(connection, list(connection.tasks)[0])
+    assert connection.rejected == [("UUID2", "overloaded")]
+    assert connection.tasks == {}
+    assert admission.running == 0
+
+
+def test_admission_global():
+    runner = MockRunner()
+    admission = Admission(runner, 2, 1, 2, 10)
+    connection1 = MockConnection()
+    connection2 = MockConnection()
+    assert admission.submit(connection1, {"uuid": "UUID1"})
+    assert admission.submit(connection2, {"uuid": "UUID2"})
+    assert list(admission.waiting) == [connection2]
+    assert connection2.tasks == {}
+    admission.done(connection1, list(connection1.tasks)[0])
+    assert list(connection2.tasks.values()) == ["UUID2"]
+    assert len(admission.waiting) == 0
+    assert admission.running == 1
+
+
+def test_admission_reserve():
+    runner = MockRunner()
+    admission = Admission(runner, 4, 5, 2, 10)
+    connection = MockConnection()
+    assert admission.submit(connection, {"uuid": "BATCH"})
+    # a batch takes the slots left to the connection
+    assert admission.reserve(connection, 99) == 3
+    assert connection.held == 3
+    assert admission.running == 4
+    assert admission.reserve(connection, 1) == 0
+    # so requests sent meanwhile wait for them
+    assert admission.submit(connection, {"uuid": "UUID1"})
+    assert len(connection.pending) == 1
+    admission.release(connection)
+    assert connection.held == 2
+    assert admission.running == 4
+    assert list(connection.tasks.values()) == ["BATCH", "UUID1"]
+    assert len(connection.pending) == 0
+    # and global slots are shared with other connections
+    other = MockConnection()
+    assert admission.reserve(other, 2) == 1
+    assert admission.running == 5
+    admission.release(connection)
+    admission.release(connection)
+    admission.release(other)
+    assert connection.held == 0
+    assert other.held == 0
+    assert admission.running == 2
+
+
+def test_admission_cancel():
+    runner = MockRunner()
+    admission = Admission(runner, 1, 3, 1, 10)
+    connection = MockConnection()
+    admission.submit(connection, {"uuid": "UUID1"})
+    admission.submit(connection, {"uuid": "UUID2"})
+    task = list(connection.tasks)[0]
+    with patch.object(task, "cancel") as cancel_m:
+        connection.cancel()
+    assert cancel_m.called
+    assert len(connection.pending) == 0
+    admission.done(connection, task)
+    assert connection.tasks == {}
+    assert admission.running == 0
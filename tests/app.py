@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 from unittest.mock import patch, MagicMock
 
 import pytest
 
+import uvloop
+
 from aioworker.worker import Worker
 
 from pluggable.core.hooks import Hook
 from pluggable.socket.app import (
-    default_config,
+    default_config, event_loop,
     Py__SocketApp as SocketApp)
+from pluggable.socket.bus import SocketBus
+from pluggable.socket.drain import Drain
 from pluggable.socket.local import LocalRunner
+from pluggable.socket.logger import SocketLogger
+from pluggable.socket.metrics import Metrics
+from pluggable.socket.registry import ConnectionRegistry
 from pluggable.socket.runner import SocketRunner
 from pluggable.socket.socket import SocketWrapper
+from pluggable.socket.supervisor import WORKER_ENV, SocketSupervisor
 
 from .base import AsyncMock, nested
 
@@ -48,6 +57,24 @@ class MockLocalRunner(LocalRunner):
         self.app = app
 
 
+class MockSocketLogger(SocketLogger):
+
+    def __init__(self, app):
+        self.started = []
+
+    def start(self, loop):
+        self.started.append(loop)
+
+
+class MockDrain(Drain):
+
+    def __init__(self, app):
+        self.listened = 0
+
+    def listen(self):
+        self.listened += 1
+
+
 @patch('pluggable.socket.app.Py__SocketApp.configure')
 def test_app(configure_m):
     worker = MockWorker()
@@ -100,23 +127,67 @@ async def test_app_connect():
         app = SocketApp(worker, {})
 
     app.socket = AsyncMock()
-    await app.connect()
+    app.bus = AsyncMock()
+    app.registry = AsyncMock()
+    app.metrics = AsyncMock()
+    _patches = nested(
+        patch('pluggable.socket.app.ready'),
+        patch('pluggable.socket.app.serving'))
+    with _patches as (ready_m, serving_m):
+        assert await app.connect() is app.socket.serve.return_value
+    assert app.server is app.socket.serve.return_value
+    assert (
+        [c[0] for c in ready_m.call_args_list]
+        == [()])
+    assert (
+        [c[0] for c in serving_m.call_args_list]
+        == [()])
+    assert (
+        [c[0] for c in app.metrics.serve.call_args_list]
+        == [()])
     assert (
         [c[0] for c in app.socket.serve.call_args_list]
         == [()])
+    assert (
+        [c[0] for c in app.bus.start.call_args_list]
+        == [()])
+    assert (
+        [c[0] for c in app.registry.start.call_args_list]
+        == [()])
 
 
+@patch('pluggable.socket.app.Py__SocketApp._logger')
+@patch('pluggable.socket.app.Py__SocketApp._bus')
+@patch('pluggable.socket.app.Py__SocketApp._registry')
+@patch('pluggable.socket.app.Py__SocketApp._metrics')
+@patch('pluggable.socket.app.Py__SocketApp._drain')
 @patch('pluggable.socket.app.Py__SocketApp._wrapper')
 @patch('pluggable.socket.app.Py__SocketApp._runner')
 @patch('pluggable.socket.app.Py__SocketApp.connect')
 @patch('pluggable.socket.app.Py__SocketApp.configure')
-def test_app_serve(configure_m, connect_m, runner_m, wrapper_m):
+def test_app_serve(configure_m, connect_m, runner_m, wrapper_m, drain_m,
+                   metrics_m, registry_m, bus_m, logger_m):
     worker = MockWorker()
     app = SocketApp(worker, {})
+    app.config = dict(processes=1)
     app.loop = MagicMock()
+    app.signals = MagicMock()
+    logger_m.return_value = MockSocketLogger(app)
+    bus_m.return_value = SocketBus(app, "NODE")
+    registry_m.return_value = ConnectionRegistry("NODE")
+    metrics_m.return_value = Metrics(app)
+    drain_m.return_value = MockDrain(app)
     runner_m.return_value = MockSocketRunner(app)
+    runner_m.return_value.dispatch = MagicMock()
     wrapper_m.return_value = MockSocketWrapper(app)
+    app.commands = dict(unsubscribe="UNSUBSCRIBE", foo="FOO")
     app.serve()
+    assert (
+        app.commands
+        == dict(subscribe=wrapper_m.return_value.subscribe,
+                unsubscribe="UNSUBSCRIBE",
+                stats=metrics_m.return_value.stats,
+                foo="FOO"))
     assert (
         [c[0] for c in connect_m.call_args_list]
         == [()])
@@ -128,11 +199,149 @@ def test_app_serve(configure_m, connect_m, runner_m, wrapper_m):
         == [()])
     assert app.socket == wrapper_m.return_value
     assert app.runner == runner_m.return_value
+    assert app.logger == logger_m.return_value
+    assert app.bus == bus_m.return_value
+    assert app.registry == registry_m.return_value
+    assert app.metrics == metrics_m.return_value
+    assert app.drain == drain_m.return_value
+    assert drain_m.return_value.listened == 1
+    assert (
+        [c[0] for c
+         in runner_m.return_value.dispatch.refresh.call_args_list]
+        == [()])
+    assert (
+        [c[0] for c in app.signals.listen.call_args_list]
+        == [('plugins.change', app.on_plugins_change)])
+    assert logger_m.return_value.started == [app.loop]
     assert (
         [c[0] for c in app.loop.create_task.call_args_list]
         == [(connect_m.return_value, )])
 
 
+@patch('pluggable.socket.app.Py__SocketApp._logger')
+@patch('pluggable.socket.app.Py__SocketApp._supervisor')
+@patch('pluggable.socket.app.Py__SocketApp._wrapper')
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_serve_supervisor(configure_m, wrapper_m, supervisor_m,
+                              logger_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(processes=3, bus="redis://")
+    app.loop = MagicMock()
+    app.signals = MagicMock()
+    logger_m.return_value = MockSocketLogger(app)
+    supervisor_m.return_value = SocketSupervisor(app, 3)
+    with patch.dict('pluggable.socket.app.environ', {}, clear=True):
+        app.serve()
+    assert app.supervisor == supervisor_m.return_value
+    assert not wrapper_m.called
+    assert (
+        [c[0][0].cr_code.co_name
+         for c in app.loop.create_task.call_args_list]
+        == ["run"])
+    app.loop.create_task.call_args[0][0].close()
+
+    app.loop.reset_mock()
+    runner = MockSocketRunner(app)
+    runner.dispatch = MagicMock()
+    wrapper_m.return_value = MockSocketWrapper(app)
+    _patches = nested(
+        patch.dict(
+            'pluggable.socket.app.environ',
+            {'PLUGGABLE_SOCKET_WORKER': '0'}),
+        patch('pluggable.socket.app.Py__SocketApp._bus',
+              return_value=SocketBus(app, "NODE")),
+        patch('pluggable.socket.app.Py__SocketApp._registry',
+              return_value=ConnectionRegistry("NODE")),
+        patch('pluggable.socket.app.Py__SocketApp._metrics',
+              return_value=Metrics(app)),
+        patch('pluggable.socket.app.Py__SocketApp._drain',
+              return_value=MockDrain(app)),
+        patch('pluggable.socket.app.Py__SocketApp._runner',
+              return_value=runner),
+        patch('pluggable.socket.app.Py__SocketApp.connect'))
+    with _patches:
+        app.serve()
+    assert (
+        [c[0] for c in wrapper_m.call_args_list]
+        == [()])
+    assert len(supervisor_m.call_args_list) == 1
+
+
+@patch('pluggable.socket.app.Py__SocketApp._logger')
+@patch('pluggable.socket.app.Py__SocketApp._supervisor')
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_serve_supervisor_bus(configure_m, supervisor_m, logger_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(processes=3, bus=None)
+    app.loop = MagicMock()
+    logger_m.return_value = MockSocketLogger(app)
+    # broadcasts must reach every process
+    with patch.dict('pluggable.socket.app.environ', {}, clear=True):
+        with pytest.raises(ValueError):
+            app.serve()
+    assert not supervisor_m.called
+    assert not app.loop.create_task.called
+
+
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_bus(configure_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(
+        node=None,
+        bus=None,
+        bus_channel='CHANNEL')
+    with patch('pluggable.socket.app.getpid', return_value=23):
+        with patch('pluggable.socket.app.gethostname', return_value='HOST'):
+            bus = app._bus()
+    assert type(bus).__name__ == 'SocketBus'
+    assert bus.node == 'HOST:23'
+    assert not bus.remote
+    app.config.update(dict(node='NODE', bus='redis://BUS'))
+    with patch.dict('pluggable.socket.app.environ', {}, clear=True):
+        bus = app._bus()
+    assert type(bus).__name__ == 'RedisBus'
+    assert bus.node == 'NODE'
+    assert bus.url == 'redis://BUS'
+    assert bus.channel == 'CHANNEL'
+    assert bus.remote
+    # worker processes each take their own name from the configured one
+    with patch.dict('pluggable.socket.app.environ', {WORKER_ENV: "3"}):
+        assert app._bus().node == 'NODE:3'
+
+
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_registry(configure_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.bus = MagicMock(node="NODE")
+    app.config = dict(registry=None, registry_prefix='PREFIX')
+    registry = app._registry()
+    assert type(registry).__name__ == 'ConnectionRegistry'
+    assert registry.node == 'NODE'
+    assert not registry.shared
+    app.config["registry"] = 'redis://REGISTRY'
+    registry = app._registry()
+    assert type(registry).__name__ == 'RedisRegistry'
+    assert registry.node == 'NODE'
+    assert registry.url == 'redis://REGISTRY'
+    assert registry.prefix == 'PREFIX'
+    assert registry.shared
+
+
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_supervisor(configure_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(processes=7)
+    supervisor = app._supervisor()
+    assert supervisor.app is app
+    assert supervisor.processes == 7
+    assert supervisor.children == {}
+
+
 @pytest.mark.asyncio
 async def test_app_on_start():
     worker = MockWorker()
@@ -178,3 +387,141 @@ async def test_app_on_start():
         assert (
             [c[0] for c in serve_m.call_args_list]
             == [()])
+
+
+@pytest.mark.asyncio
+async def test_app_on_plugins_change():
+    worker = MockWorker()
+    with patch('pluggable.socket.app.Py__SocketApp.configure'):
+        app = SocketApp(worker, {})
+    app.socket = MagicMock()
+    app.socket.builtins = dict(stats="STATS", foo="BUILTIN")
+    app.runner = MagicMock()
+    app.hooks = {
+        "tasks.local": MagicMock(),
+        "tasks.worker": MagicMock()}
+    app.hooks["tasks.local"].gather.return_value = dict(foo="FOO")
+    app.hooks[
+        "tasks.worker"].gather.return_value.values.return_value = [17]
+    with patch('pluggable.socket.app.import_module') as import_m:
+        await app.on_plugins_change('plugins.change')
+    assert (
+        [c[0] for c in import_m.call_args_list]
+        == [(17, )])
+    # plugin commands take precedence over the builtins
+    assert app.commands == dict(stats="STATS", foo="FOO")
+    assert (
+        [c[0] for c in app.runner.dispatch.refresh.call_args_list]
+        == [()])
+
+
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_logger(configure_m):
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(default_config)
+    logger = app._logger()
+    assert logger.app is app
+    assert logger.level == 20
+    assert logger.buffer.maxlen == app.config["log_buffer"]
+    assert logger.interval == app.config["log_interval"]
+    assert logger.sample == app.config["log_sample"]
+
+
+@pytest.mark.asyncio
+async def test_app_invalidate():
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.runner = MagicMock()
+    app.runner.cache.invalidate = AsyncMock()
+    await app.invalidate("FOO")
+    await app.invalidate("FOO", dict(bar=7), "SESSION")
+    assert (
+        [c[0] for c in app.runner.cache.invalidate.call_args_list]
+        == [("FOO", None, None),
+            ("FOO", dict(bar=7), "SESSION")])
+
+
+def test_app_metrics():
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(default_config, ip="IP")
+    metrics = app._metrics()
+    assert metrics.app is app
+    assert metrics.enabled
+    assert metrics.ip == "IP"
+    assert metrics.port == 0
+    app.config["metrics"] = False
+    app.config["metrics_port"] = 9100
+    metrics = app._metrics()
+    assert not metrics.enabled
+    assert metrics.port == 9100
+    with patch.dict('pluggable.socket.app.environ', {WORKER_ENV: "3"}):
+        assert app._metrics().port == 9103
+
+
+def test_app_drain():
+    worker = MockWorker()
+    app = SocketApp(worker, {})
+    app.config = dict(default_config)
+    drain = app._drain()
+    assert drain.app is app
+    assert drain.grace == 30
+    assert drain.reconnect_min == 1
+    assert drain.reconnect_max == 10
+    assert not drain.handoff
+    app.config.update(
+        drain_grace=5, reconnect_min=2, reconnect_max=3, handoff=True)
+    drain = app._drain()
+    assert drain.grace == 5
+    assert drain.reconnect_min == 2
+    assert drain.reconnect_max == 3
+    assert drain.handoff
+    # worker processes are restarted by the supervisor instead
+    with patch.dict('pluggable.socket.app.environ', {WORKER_ENV: "3"}):
+        assert not app._drain().handoff
+
+
+@patch('pluggable.socket.app.Py__SocketApp.configure')
+def test_app_loop(configure_m):
+    worker = MockWorker()
+
+    def configure(config):
+        app.config = dict(default_config, **config)
+
+    with patch('pluggable.socket.app.event_loop') as loop_m:
+        app = SocketApp(worker, {})
+        loop = app.loop
+        configure_m.side_effect = configure
+        app.__init__(worker, dict(loop="asyncio"))
+        assert app.loop is loop
+        assert not loop_m.called
+        # the loop is only known once the app is configured
+        app.__init__(worker, dict(loop="uvloop"))
+        assert app.loop is loop_m.return_value
+        assert (
+            [c[0] for c in loop_m.call_args_list]
+            == [("uvloop", )])
+
+
+def test_app_event_loop():
+    policy = asyncio.get_event_loop_policy()
+    try:
+        current = asyncio.get_event_loop()
+    except RuntimeError:
+        # closed by an earlier test
+        current = None
+    try:
+        loop = event_loop("uvloop")
+        assert isinstance(loop, uvloop.Loop)
+        assert asyncio.get_event_loop() is loop
+        loop.close()
+        loop = event_loop()
+        assert not isinstance(loop, uvloop.Loop)
+        assert asyncio.get_event_loop() is loop
+        loop.close()
+        with pytest.raises(ValueError):
+            event_loop("trio")
+    finally:
+        asyncio.set_event_loop_policy(policy)
+        asyncio.set_event_loop(current)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import msgpack
+
+from pluggable.socket.bus import (
+    Py__RedisBus as RedisBus,
+    Py__SocketBus as SocketBus)
+
+from .base import AsyncMock
+
+
+def test_bus_signature():
+    with pytest.raises(TypeError):
+        SocketBus()
+
+
+def test_bus():
+    bus = SocketBus("APP", "NODE")
+    assert bus.app == "APP"
+    assert bus.node == "NODE"
+    assert bus.handlers == {}
+    assert not bus.remote
+    bus.subscribe("send", "HANDLER")
+    assert bus.handlers == {"send": "HANDLER"}
+
+
+@pytest.mark.asyncio
+async def test_bus_receive():
+    bus = SocketBus("APP", "NODE")
+    handler = AsyncMock()
+    bus.subscribe("send", handler)
+    await bus.receive(dict(type="send", origin="NODE", msg=1))
+    await bus.receive(dict(type="other", origin="ELSEWHERE", msg=2))
+    await bus.receive(dict(type="send", origin="ELSEWHERE", msg=3))
+    assert (
+        [c[0] for c in handler.call_args_list]
+        == [(dict(type="send", origin="ELSEWHERE", msg=3), )])
+    await bus.publish("send", {})
+
+
+def test_bus_redis():
+    bus = RedisBus("APP", "NODE", "redis://BUS")
+    assert bus.url == "redis://BUS"
+    assert bus.channel == "pluggable.socket"
+    assert bus.remote
+    bus = RedisBus("APP", "NODE", "redis://BUS", "CHANNEL")
+    assert bus.channel == "CHANNEL"
+
+
+@pytest.mark.asyncio
+async def test_bus_redis_start():
+    app = MagicMock()
+    bus = RedisBus(app, "NODE", "redis://BUS", "CHANNEL")
+    redis = [AsyncMock(), AsyncMock()]
+    redis[1].subscribe.return_value = ["SUBSCRIPTION", "NODE_SUBSCRIPTION"]
+    _patch = patch(
+        'pluggable.socket.bus.aioredis.create_redis',
+        new_callable=AsyncMock,
+        side_effect=redis)
+    with _patch as create_m:
+        with patch('pluggable.socket.bus.Py__RedisBus.listen') as listen_m:
+            await bus.start()
+    assert (
+        [c[0] for c in create_m.call_args_list]
+        == [("redis://BUS", ), ("redis://BUS", )])
+    assert bus.publisher is redis[0]
+    assert bus.subscriber is redis[1]
+    assert (
+        [c[0] for c in redis[1].subscribe.call_args_list]
+        == [("CHANNEL", "CHANNEL:NODE")])
+    assert (
+        [c[0] for c in listen_m.call_args_list]
+        == [("SUBSCRIPTION", ), ("NODE_SUBSCRIPTION", )])
+    assert (
+        bus.tasks
+        == [app.loop.create_task.return_value,
+            app.loop.create_task.return_value])
+
+    await bus.publish("send", dict(msg="MSG"))
+    await bus.publish("send", dict(msg="MSG"), "OTHER")
+    packed = msgpack.packb(dict(msg="MSG", type="send", origin="NODE"))
+    assert (
+        [c[0] for c in redis[0].publish.call_args_list]
+        == [("CHANNEL", packed),
+            ("CHANNEL:OTHER", packed)])
+
+    redis[0].close = MagicMock()
+    redis[1].close = MagicMock()
+    await bus.stop()
+    assert bus.tasks == []
+    assert len(app.loop.create_task.return_value.cancel.call_args_list) == 2
+    assert redis[0].close.called
+    assert redis[1].close.called
+
+
+@pytest.mark.asyncio
+async def test_bus_redis_listen():
+    app = MagicMock()
+    bus = RedisBus(app, "NODE", "redis://BUS")
+    channel = AsyncMock()
+    channel.wait_message.side_effect = [True, True, True, False]
+    channel.get.side_effect = [
+        msgpack.packb(dict(type="send", origin="ELSEWHERE")),
+        b"\xc1",
+        msgpack.packb(dict(type="send", origin="NODE"))]
+    handler = AsyncMock()
+    bus.subscribe("send", handler)
+    await bus.listen(channel)
+    assert (
+        [c[0] for c in handler.call_args_list]
+        == [(dict(type="send", origin="ELSEWHERE"), )])
+    assert len(app.logger.log.call_args_list) == 1
+    assert app.logger.log.call_args[0][:2] == (40, 'app.bus:')
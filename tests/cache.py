@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+import rapidjson as json
+
+from pluggable.socket.cache import (
+    cached,
+    Py__LRUCache as LRUCache,
+    Py__ResponseCache as ResponseCache,
+    Py__SessionCache as SessionCache)
+from pluggable.socket.codec import codecs
+from pluggable.socket.dispatch import Py__Command as Command
+from pluggable.socket.frame import Frame
+
+from .base import AsyncMock
+
+
+def test_lru_signature():
+    with pytest.raises(TypeError):
+        LRUCache()
+
+
+def test_lru():
+    cache = LRUCache(2)
+    assert cache.maxsize == 2
+    assert cache.ttl == 0
+    assert len(cache) == 0
+    cache.set("foo", 7)
+    cache.set("bar", 23)
+    assert cache.get("foo") == 7
+    cache.set("baz", 113)
+    # bar was least recently used
+    assert "bar" not in cache
+    assert cache.get("bar", "DEFAULT") == "DEFAULT"
+    assert cache.get("foo") == 7
+    assert cache.get("baz") == 113
+    cache.delete("foo")
+    cache.delete("foo")
+    assert "foo" not in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_ttl():
+    cache = LRUCache(2, 100)
+    cache.set("foo", None)
+    assert "foo" in cache
+    assert cache.get("foo", "DEFAULT") is None
+    cache.ttl = -1
+    cache.set("foo", 7)
+    assert cache.get("foo", "DEFAULT") == "DEFAULT"
+    assert len(cache) == 0
+
+
+def test_lru_stats():
+    cache = LRUCache(2)
+    cache.set("foo", 7)
+    cache.get("foo")
+    cache.get("bar")
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_session_cache():
+    backend = MagicMock()
+    backend.get = AsyncMock(return_value="SESSION")
+    sessions = SessionCache(backend, 10, 60)
+    assert sessions.backend is backend
+    assert sessions.cache.maxsize == 10
+    assert sessions.cache.ttl == 60
+    assert await sessions.get("KEY") == "SESSION"
+    assert await sessions.get("KEY") == "SESSION"
+    assert (
+        [c[0] for c in backend.get.call_args_list]
+        == [("KEY", )])
+    backend.get.return_value = None
+    assert await sessions.get("ANON") is None
+    assert await sessions.get("ANON") is None
+    assert len(backend.get.call_args_list) == 2
+    sessions.invalidate("KEY")
+    assert await sessions.get("KEY") is None
+    assert len(backend.get.call_args_list) == 3
+
+
+@pytest.mark.asyncio
+async def test_session_cache_sync():
+    backend = MagicMock()
+    backend.get.return_value = "SESSION"
+    sessions = SessionCache(backend, 10, 60)
+    assert await sessions.get("KEY") == "SESSION"
+
+
+async def local_foo(connection, uuid, bar=None):
+    pass
+
+
+async def items():
+    yield 1
+
+
+class MockBackend(object):
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=None):
+        self.data[key] = value
+        self.expires[key] = expire
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def MockRunner(local=False, **declaration):
+    runner = MagicMock()
+    try:
+        runner.app.loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # not every test runs in a loop
+        pass
+    runner.app.bus.publish = AsyncMock()
+
+    @cached(**declaration)
+    async def foo(connection, uuid, bar=None):
+        pass
+
+    command = Command("FOO", foo, local)
+    runner.dispatch.get.return_value = command
+    runner._returns = AsyncMock(
+        side_effect=lambda command, connection, uuid, params: params)
+    runner._response.side_effect = response
+    runner._execute = AsyncMock(
+        side_effect=lambda command, connection, uuid, params: response(
+            command, connection, uuid, params))
+    return runner, command
+
+
+def response(command, connection, uuid, returns):
+    # as the runner responds with what handlers and tasks return
+    if isinstance(returns, bytes):
+        return connection.codec.envelope(uuid, returns)
+    if command.local:
+        return dict(uuid=uuid, **returns)
+    return dict(uuid=uuid, response=returns)
+
+
+def MockConnection(id=7, session=None, codec="json"):
+    connection = MagicMock()
+    connection.id = id
+    connection.session = session
+    connection.codec = codecs[codec]
+    return connection
+
+
+def test_cached():
+    handler = cached(30, 10, "session")(local_foo)
+    assert handler is local_foo
+    assert handler.cache == dict(ttl=30, size=10, scope="session")
+    assert cached()(local_foo).cache == dict(
+        ttl=60.0, size=1000, scope="shared")
+    with pytest.raises(ValueError):
+        cached(scope="global")
+
+
+def test_response_cache_signature():
+    with pytest.raises(TypeError):
+        ResponseCache()
+
+
+def test_response_cache():
+    runner, command = MockRunner(ttl=30, size=10)
+    responses = ResponseCache(runner)
+    assert responses.runner is runner
+    assert responses.app is runner.app
+    assert responses.backend is None
+    assert responses.caches == {}
+    assert responses.inflight == {}
+    cache = responses.cache(command)
+    assert cache.maxsize == 10
+    assert cache.ttl == 30
+    assert responses.cache(command) is cache
+    responses.listen()
+    assert (
+        [c[0] for c in runner.app.bus.subscribe.call_args_list]
+        == [("invalidate", responses.on_bus_invalidate)])
+
+
+def test_response_cache_key():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    connection = MockConnection(session="SESSION")
+    assert (
+        responses.key(command, connection, dict(b=1, a=2))
+        == responses.key(command, MockConnection(), dict(a=2, b=1))
+        == (None, '{"a":2,"b":1}'))
+    command.cache["scope"] = "session"
+    assert (
+        responses.key(command, connection, {})
+        == ("SESSION", "{}"))
+    assert (
+        responses.key(command, MockConnection(23), {})
+        == ("#23", "{}"))
+
+
+def test_response_cache_body():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    assert responses.body(command, [1, 2]) == b'[1,2]'
+    assert responses.body(command, None) == b'null'
+    payload = b'{"bar": 7}'
+    assert responses.body(command, payload) is payload
+    assert responses.body(command, b'') is None
+    assert responses.body(command, object()) is None
+    assert responses.body(command, items()) is None
+    # the fields of a local handler's response
+    runner, command = MockRunner(local=True)
+    assert responses.body(command, dict(bar=7)) == b'={"bar":7}'
+    assert responses.body(command, payload) is payload
+    assert responses.body(command, None) is None
+    assert responses.body(command, {}) is None
+    assert responses.body(command, dict(error="failed")) is None
+    assert responses.body(command, [1, 2]) is None
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+def test_response_cache_response(codec):
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    connection = MockConnection(codec=codec)
+    assert (
+        connection.codec.decode(
+            bytes(responses.response(command, connection, 7, b'[1,2]')))
+        == dict(uuid=7, response=[1, 2]))
+    runner, command = MockRunner(local=True)
+    assert (
+        responses.response(command, connection, 7, b'={"bar":7}')
+        == dict(uuid=7, bar=7))
+
+
+@pytest.mark.asyncio
+async def test_response_cache_call():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    connection = MockConnection()
+    assert (
+        await responses.call(command, connection, "UUID1", dict(bar=7))
+        == dict(uuid="UUID1", response=dict(bar=7)))
+    frame = await responses.call(command, connection, "UUID2", dict(bar=7))
+    assert isinstance(frame, Frame)
+    assert (
+        json.loads(frame.tobytes())
+        == dict(uuid="UUID2", response=dict(bar=7)))
+    await responses.call(command, connection, "UUID3", dict(bar=23))
+    assert (
+        [c[0][2:] for c in runner._returns.call_args_list]
+        == [("UUID1", dict(bar=7)), ("UUID3", dict(bar=23))])
+    # values that can not be encoded are not cached
+    runner._returns.side_effect = None
+    runner._returns.return_value = object()
+    await responses.call(command, connection, "UUID", dict(bar=73))
+    await responses.call(command, connection, "UUID", dict(bar=73))
+    assert len(runner._returns.call_args_list) == 4
+    # nor are params that can not be keyed
+    await responses.call(command, connection, "UUID", dict(bar=object()))
+    assert len(runner._execute.call_args_list) == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache_call_local():
+    runner, command = MockRunner(local=True)
+    responses = ResponseCache(runner)
+    connection = MockConnection()
+    assert (
+        await responses.call(command, connection, "UUID1", dict(bar=7))
+        == dict(uuid="UUID1", bar=7))
+    assert (
+        await responses.call(command, connection, "UUID2", dict(bar=7))
+        == dict(uuid="UUID2", bar=7))
+    assert len(runner._returns.call_args_list) == 1
+    # errors are not cached
+    runner._returns.side_effect = None
+    runner._returns.return_value = dict(error="failed")
+    await responses.call(command, connection, "UUID", dict(bar=73))
+    assert (
+        await responses.call(command, connection, "UUID", dict(bar=73))
+        == dict(uuid="UUID", error="failed"))
+    assert len(runner._returns.call_args_list) == 3
+
+
+@pytest.mark.asyncio
+async def test_response_cache_coalesce():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    release = asyncio.Event()
+    calls = []
+
+    async def returns(command, connection, uuid, params):
+        calls.append(uuid)
+        await release.wait()
+        return params
+
+    runner._returns = returns
+    results = [
+        asyncio.ensure_future(
+            responses.call(
+                command, MockConnection(), "UUID%s" % i, dict(bar=7)))
+        for i in range(3)]
+    await asyncio.sleep(0)
+    assert len(responses.inflight) == 1
+    release.set()
+    results = await asyncio.gather(*results)
+    assert calls == ["UUID0"]
+    assert responses.coalesced == 2
+    assert responses.inflight == {}
+    assert results[0] == dict(uuid="UUID0", response=dict(bar=7))
+    assert (
+        [json.loads(r.tobytes()) for r in results[1:]]
+        == [dict(uuid="UUID1", response=dict(bar=7)),
+            dict(uuid="UUID2", response=dict(bar=7))])
+
+
+@pytest.mark.asyncio
+async def test_response_cache_coalesce_failed():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    release = asyncio.Event()
+    calls = []
+
+    async def returns(command, connection, uuid, params):
+        calls.append(uuid)
+        await release.wait()
+        raise ValueError(uuid)
+
+    runner._returns = returns
+    first = asyncio.ensure_future(
+        responses.call(command, MockConnection(), "UUID0", {}))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(
+        responses.call(command, MockConnection(), "UUID1", {}))
+    await asyncio.sleep(0)
+    release.set()
+    with pytest.raises(ValueError):
+        await first
+    # the waiting call runs for itself
+    assert await second == dict(uuid="UUID1", response={})
+    assert calls == ["UUID0"]
+    assert (
+        [c[0][2:] for c in runner._execute.call_args_list]
+        == [("UUID1", {})])
+
+
+@pytest.mark.asyncio
+async def test_response_cache_invalidate():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    connection = MockConnection()
+    await responses.call(command, connection, "UUID", dict(bar=7))
+    await responses.call(command, connection, "UUID", dict(bar=23))
+    await responses.invalidate("FOO", dict(bar=7))
+    assert (
+        list(responses.caches["FOO"].entries)
+        == [(None, '{"bar":23}')])
+    await responses.invalidate("FOO")
+    assert len(responses.caches["FOO"]) == 0
+    assert responses.generations["FOO"] > 0
+    assert (
+        [c[0][:2] for c in runner.app.bus.publish.call_args_list]
+        == [("invalidate",
+             dict(command="FOO", params=dict(bar=7), session=None,
+                  generation=0)),
+            ("invalidate",
+             dict(command="FOO", params=None, session=None,
+                  generation=responses.generations["FOO"]))])
+    await responses.invalidate("UNCACHED")
+
+
+@pytest.mark.asyncio
+async def test_response_cache_invalidate_session():
+    runner, command = MockRunner(scope="session")
+    responses = ResponseCache(runner)
+    for session in ["S1", "S2"]:
+        await responses.call(
+            command, MockConnection(session=session), "UUID", {})
+        await responses.call(
+            command, MockConnection(session=session), "UUID", dict(bar=7))
+    assert not responses.drop("FOO", None, "S1")
+    assert (
+        sorted(responses.caches["FOO"].entries)
+        == [("S2", '{"bar":7}'), ("S2", "{}")])
+    assert responses.drop("FOO", dict(bar=7), "S2")
+    assert not responses.drop("FOO", {})
+    assert len(responses.caches["FOO"]) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_invalidate_inflight():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    release = asyncio.Event()
+    calls = []
+
+    async def returns(command, connection, uuid, params):
+        calls.append(uuid)
+        await release.wait()
+        return params
+
+    runner._returns = returns
+    call = asyncio.ensure_future(
+        responses.call(command, MockConnection(), "UUID", {}))
+    await asyncio.sleep(0)
+    await responses.invalidate("FOO")
+    assert responses.inflight == {}
+    release.set()
+    await call
+    # the superseded response is not cached
+    assert len(responses.caches["FOO"]) == 0
+
+
+@pytest.mark.asyncio
+async def test_response_cache_bus():
+    runner, command = MockRunner()
+    responses = ResponseCache(runner)
+    await responses.call(command, MockConnection(), "UUID", {})
+    await responses.on_bus_invalidate(
+        dict(command="FOO", params={}, session=None, generation=0))
+    assert len(responses.caches["FOO"]) == 0
+    assert responses.generations == {}
+    await responses.on_bus_invalidate(
+        dict(command="FOO", params=None, session=None, generation=73))
+    assert responses.generations == dict(FOO=73)
+
+
+@pytest.mark.asyncio
+async def test_response_cache_backend():
+    runner, command = MockRunner(ttl=30)
+    backend = MockBackend()
+    responses = ResponseCache(runner, backend)
+    connection = MockConnection()
+    await responses.call(command, connection, "UUID", dict(bar=7))
+    key = 'pluggable.socket.response:FOO:0::{"bar":7}'
+    assert backend.data == {key: b'{"bar":7}'}
+    assert backend.expires == {key: 30}
+    # another process
+    responses = ResponseCache(runner, backend)
+    frame = await responses.call(command, connection, "UUID", dict(bar=7))
+    assert (
+        json.loads(frame.tobytes())
+        == dict(uuid="UUID", response=dict(bar=7)))
+    assert len(runner._returns.call_args_list) == 1
+    assert len(responses.caches["FOO"]) == 1
+    await responses.invalidate("FOO", dict(bar=7))
+    assert backend.data == {}
+    await responses.call(command, connection, "UUID", dict(bar=7))
+    await responses.invalidate("FOO")
+    generation = responses.generations["FOO"]
+    assert (
+        backend.data["pluggable.socket.response:FOO:generation"]
+        == generation)
+    # superseded entries are not found by any process
+    responses = ResponseCache(runner, backend)
+    await responses.call(command, connection, "UUID", dict(bar=7))
+    assert len(runner._returns.call_args_list) == 3
+    assert (
+        'pluggable.socket.response:FOO:%s::{"bar":7}' % generation
+        in backend.data)
+
+
+@pytest.mark.asyncio
+async def test_response_cache_backend_failure():
+    runner, command = MockRunner()
+    backend = MagicMock()
+    backend.get = AsyncMock(side_effect=ConnectionError("down"))
+    responses = ResponseCache(runner, backend)
+    assert (
+        await responses.call(command, MockConnection(), "UUID", {})
+        == dict(uuid="UUID", response={}))
+    assert runner.app.logger.log.call_args[0][1:] == (
+        'app.cache:', ("get", repr(ConnectionError("down"))))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import rapidjson as json
+import msgpack
+
+import pytest
+
+from pluggable.socket.codec import (
+    codecs, negotiate,
+    Py__JSONCodec as JSONCodec,
+    Py__MsgpackCodec as MsgpackCodec)
+from pluggable.socket.frame import Frame
+
+
+def test_codec_json():
+    codec = JSONCodec()
+    assert codec.name == "json"
+    assert not codec.binary
+    assert codec.encode({"foo": 7}) == '{"foo":7}'
+    assert codec.encode('{"foo":7}') == '{"foo":7}'
+    assert codec.encode(b'{"foo":7}') == b'{"foo":7}'
+    assert codec.decode('{"foo":7}') == {"foo": 7}
+    assert codec.decode(b'{"foo":7}') == {"foo": 7}
+    payload = b'{"bar": [1, 2]}'
+    frame = codec.envelope("UUID", payload)
+    assert isinstance(frame, Frame)
+    # the payload is wrapped, not copied
+    assert frame.payload is payload
+    assert (
+        json.loads(frame.tobytes())
+        == {"uuid": "UUID", "response": {"bar": [1, 2]}})
+    assert codec.encode(frame) is frame
+    assert (
+        json.loads(codec.envelope(7, b'null').tobytes())
+        == {"uuid": 7, "response": None})
+
+
+def test_codec_msgpack():
+    codec = MsgpackCodec()
+    assert codec.name == "msgpack"
+    assert codec.binary
+    packed = msgpack.packb({"foo": 7})
+    assert codec.encode({"foo": 7}) == packed
+    assert codec.encode('{"foo":7}') == packed
+    assert codec.encode(b'{"foo":7}') == packed
+    assert codec.decode(packed) == {"foo": 7}
+    # text frames are still accepted as json
+    assert codec.decode('{"foo":7}') == {"foo": 7}
+    assert (
+        msgpack.unpackb(codec.envelope("UUID", b'{"bar": [1, 2]}'))
+        == {"uuid": "UUID", "response": {"bar": [1, 2]}})
+    assert (
+        codec.encode(Frame(b'{"foo":', b'7', b'}'))
+        == packed)
+
+
+def test_codec_json_pack():
+    codec = JSONCodec()
+    frames = [
+        codec.encode({"foo": 7}),
+        b'{"bar":23}',
+        codec.envelope("U", b'1')]
+    assert (
+        json.loads(codec.pack(frames))
+        == {"batch": [{"foo": 7}, {"bar": 23}, {"uuid": "U", "response": 1}]})
+    assert (
+        json.loads(codec.pack(frames, "UUID"))
+        == {"uuid": "UUID",
+            "batch": [{"foo": 7}, {"bar": 23}, {"uuid": "U", "response": 1}]})
+    assert json.loads(codec.pack([])) == {"batch": []}
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 0xffff, 0x10000])
+def test_codec_msgpack_pack(size):
+    codec = MsgpackCodec()
+    frames = [codec.encode(i) for i in range(size)]
+    assert (
+        msgpack.unpackb(codec.pack(frames))
+        == {"batch": list(range(size))})
+    assert (
+        msgpack.unpackb(codec.pack(frames[:3], "UUID"))
+        == {"uuid": "UUID", "batch": list(range(min(size, 3)))})
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [(None, "json"),
+     ("/", "json"),
+     ("/?codec=json", "json"),
+     ("/?codec=msgpack", "msgpack"),
+     ("/foo?bar=baz&codec=msgpack", "msgpack"),
+     ("/?codec=unknown", "json")])
+def test_codec_negotiate(path, expected):
+    assert negotiate(path, codecs["json"]) is codecs[expected]
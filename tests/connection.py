@@ -3,15 +3,21 @@
 import json
 from unittest.mock import patch, MagicMock
 
+import msgpack
 import websockets
+from websockets.frames import Close
 
 import pytest
 
 from aioworker.worker import Worker
 
 from pluggable.socket.app import SocketApp
+from pluggable.socket.codec import codecs
+from pluggable.socket.deflate import Deflate
 from pluggable.socket.connection import (
     Py__SocketConnection as SocketConnection)
+from pluggable.socket.frame import Frame, WireFrame
+from pluggable.socket.registry import ConnectionRegistry
 from pluggable.socket.socket import SocketWrapper
 
 from .base import AsyncMock, nested
@@ -34,6 +40,8 @@ class _MockApp(SocketApp):
     def __init__(self, *args, **kwargs):
         self.runner = MagicMock()
         self.loop = MagicMock()
+        self.registry = ConnectionRegistry("NODE")
+        self.metrics = MagicMock()
 
 
 def MockApp():
@@ -61,7 +69,11 @@ def test_connection():
     assert connection.socket is socket
     assert connection.path == "PATH"
     assert connection.connection == "CONNECTION"
-    assert hash(connection) == hash(connection.connection)
+    assert connection.id == 0
+    connection.id = 7
+    assert connection.id == 7
+    assert connection.tasks == {}
+    assert list(connection.pending) == []
 
 
 def test_connection_app(mocker):
@@ -94,32 +106,252 @@ def test_connection_port(mocker):
         == [(1,)])
 
 
-@patch("pluggable.socket.connection.json")
-def test_connection_parse_request(json_m):
+def test_connection_parse_request():
     socket = MockSocketWrapper()
     connection = SocketConnection(socket, "CONNECTION", "PATH")
-    json_m.loads.return_value = {"FOO": 23}
-    response = connection.parse_request("MESSAGE")
-    assert response == json_m.loads.return_value
+    assert connection.codec.name == "json"
+    assert connection.parse_request('{"foo": 23}') == {"foo": 23}
+    connection.codec = codecs["msgpack"]
     assert (
-        [c[0] for c in json_m.loads.call_args_list]
-        == [('MESSAGE', )])
+        connection.parse_request(msgpack.packb({"foo": 23}))
+        == {"foo": 23})
+
+
+@pytest.mark.asyncio
+async def test_connection_write():
+    socket = MockSocketWrapper()
+    socket._send = AsyncMock()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    await connection.write("FRAME")
+    assert (
+        [c[0] for c in socket._send.call_args_list]
+        == [("CONNECTION", "FRAME")])
+    connection.queue = MagicMock()
+    await connection.write("FRAME", "KEY")
+    assert (
+        [c[0] for c in connection.queue.put.call_args_list]
+        == [("FRAME", "KEY")])
+    assert len(socket._send.call_args_list) == 1
+    assert connection.sent == 2
 
 
 def test_connection_handle_request(mocker):
     socket = MockSocketWrapper()
     connection = SocketConnection(socket, "CONNECTION", "PATH")
-    connection.handle_request("SESSION", {"msg": "MESSAGE"})
+    connection.app.runner.dispatch.get.return_value = None
+    connection.handle_request("SESSION", {"command": "FOO"})
+    assert connection.session == "SESSION"
+    assert (
+        [c[0] for c in connection.app.runner.admission.submit.call_args_list]
+        == [(connection, {'command': 'FOO'})])
+    assert (
+        [c[0] for c in connection.app.runner.limiter.allow.call_args_list]
+        == [(connection, "SESSION", "FOO")])
+
+
+def test_connection_handle_request_unrecognized(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    _patch = patch(
+        "pluggable.socket.connection.Py__SocketConnection.reject")
+    with _patch as reject_m:
+        connection.handle_request(
+            "SESSION",
+            {"uuid": "UUID1", "command": ["FOO"]})
+        connection.handle_request(
+            "SESSION",
+            {"uuid": "UUID2", "cmd": {"FOO": 7}})
+        connection.handle_request("SESSION", {"uuid": "UUID3"})
+    assert (
+        [c[0] for c in reject_m.call_args_list]
+        == [("UUID1", "unrecognized_command"),
+            ("UUID2", "unrecognized_command"),
+            ("UUID3", "unrecognized_command")])
+    assert not connection.app.runner.dispatch.get.called
+    assert not connection.app.runner.limiter.allow.called
+    assert not connection.app.runner.admission.submit.called
+
+
+def test_connection_handle_request_limited(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.app.runner.dispatch.get.return_value.rate = "RATE"
+    connection.app.runner.limiter.allow.return_value = False
+    _patch = patch(
+        "pluggable.socket.connection.Py__SocketConnection.reject")
+    with _patch as reject_m:
+        connection.handle_request(
+            "SESSION",
+            {"uuid": "UUID", "command": "FOO"})
+    assert (
+        [c[0] for c in connection.app.runner.dispatch.get.call_args_list]
+        == [("FOO", )])
+    assert (
+        [c[0] for c in connection.app.runner.limiter.allow.call_args_list]
+        == [(connection, "SESSION", "RATE")])
+    assert (
+        [c[0] for c in reject_m.call_args_list]
+        == [("UUID", "rate_limited")])
+    assert not connection.app.runner.admission.submit.called
+
+
+def test_connection_cancel(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    tasks = [MagicMock(), MagicMock()]
+    connection.tasks = {tasks[0]: "UUID1", tasks[1]: "UUID2"}
+    connection.pending.append((0, {"uuid": "UUID3"}))
+    connection.cancel()
+    assert len(connection.pending) == 0
+    for task in tasks:
+        assert (
+            [c[0] for c in task.cancel.call_args_list]
+            == [()])
+
+
+def test_connection_control(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    stream = mocker.MagicMock()
+    connection.streams = {"UUID1": stream}
+    tasks = [MagicMock(), MagicMock()]
+    connection.tasks = {tasks[0]: "UUID1", tasks[1]: "UUID2"}
+    connection.pending.append((0, {"uuid": "UUID3"}))
+    connection.pending.append((0, {"uuid": "UUID4"}))
+    assert not connection.control({"uuid": "UUID5", "command": "FOO"})
+    assert connection.control({"ack": "UUID1", "seq": 3})
+    assert connection.control({"ack": "UUID1", "seq": "3"})
+    assert connection.control({"ack": "UUID7", "seq": 3})
+    assert (
+        [c[0] for c in stream.ack.call_args_list]
+        == [(3, )])
+    assert connection.control({"cancel": "UUID1"})
+    assert connection.control({"cancel": "UUID3"})
+    assert connection.control({"heartbeat": 12.0})
+    assert tasks[0].cancel.called
+    assert not tasks[1].cancel.called
+    assert list(connection.pending) == [(0, {"uuid": "UUID4"})]
+    with patch("pluggable.socket.connection.Py__SocketConnection.allow") as m:
+        connection.handle_request("SESSION", {"cancel": "UUID2"})
+        assert not m.called
+    assert tasks[1].cancel.called
+
+
+def test_connection_reject(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.respond = mocker.MagicMock()
+    connection.reject("UUID", "ERROR")
     assert (
         [c[0] for c in connection.app.loop.create_task.call_args_list]
-        == [(connection.app.runner.run.return_value, )])
+        == [(connection.respond.return_value, )])
+    assert (
+        [c[0] for c in connection.respond.call_args_list]
+        == [({"uuid": "UUID", "error": "ERROR"}, )])
+
+
+def test_connection_handle_request_batch(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.app.runner.dispatch.get.return_value = None
+    connection.app.runner.limiter.allow.side_effect = (
+        lambda connection, session, command: command != "LIMITED")
+    _patch = patch(
+        "pluggable.socket.connection.Py__SocketConnection.reject")
+    with _patch as reject_m:
+        connection.handle_request(
+            "SESSION",
+            {"uuid": "BATCH",
+             "batch": [
+                 {"uuid": "UUID1", "command": "FOO"},
+                 {"uuid": "UUID2", "command": "LIMITED"},
+                 {"uuid": "UUID3", "command": "BAR"}]})
+        assert (
+            [c[0] for c in reject_m.call_args_list]
+            == [("UUID2", "rate_limited")])
+        submit_m = connection.app.runner.admission.submit
+        assert (
+            [c[0] for c in submit_m.call_args_list]
+            == [(connection,
+                 {"uuid": "BATCH",
+                  "batch": [
+                      {"uuid": "UUID1", "command": "FOO"},
+                      {"uuid": "UUID3", "command": "BAR"}]})])
+        connection.handle_request(
+            "SESSION",
+            {"uuid": "BATCH",
+             "batch": [{"uuid": "UUID4", "command": "LIMITED"}]})
+        assert len(submit_m.call_args_list) == 1
+        assert (
+            [c[0] for c in reject_m.call_args_list]
+            == [("UUID2", "rate_limited"), ("UUID4", "rate_limited")])
+
 
+def test_connection_handle_request_invalid_batch(mocker):
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    _patch = patch(
+        "pluggable.socket.connection.Py__SocketConnection.reject")
+    with _patch as reject_m:
+        for batch in ["ab", [1], 5, None, [{"command": "FOO"}, "BAR"]]:
+            connection.handle_request(
+                "SESSION",
+                {"uuid": "BATCH", "batch": batch})
+    assert (
+        [c[0] for c in reject_m.call_args_list]
+        == [("BATCH", "invalid_batch")] * 5)
+    assert not connection.app.runner.limiter.allow.called
+    assert not connection.app.runner.admission.submit.called
+
+
+@pytest.mark.asyncio
+async def test_connection_respond():
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.queue = MagicMock()
+    await connection.respond({"foo": 7})
+    await connection.respond('{"foo":7}')
+    await connection.respond(b'{"foo":7}')
     assert (
-        [c[0] for c in connection.app.runner.run.call_args_list]
-        == [(connection, )])
+        [c[0] for c in connection.queue.put.call_args_list]
+        == [('{"foo":7}', None), ('{"foo":7}', None), (b'{"foo":7}', None)])
+    connection.codec = codecs["msgpack"]
+    await connection.respond({"foo": 7})
     assert (
-        [c[1] for c in connection.app.runner.run.call_args_list]
-        == [{'msg': 'MESSAGE'}])
+        connection.queue.put.call_args[0]
+        == (msgpack.packb({"foo": 7}), None))
+    frame = Frame(b'[', b'1', b']')
+    await connection.respond(frame)
+    assert connection.queue.put.call_args[0] == (frame, None)
+
+
+@pytest.mark.asyncio
+async def test_connection_respond_uncompressed():
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.queue = MagicMock()
+    await connection.respond({"foo": 7}, False)
+    assert connection.queue.put.call_args[0] == ('{"foo":7}', None)
+    socket.deflate = Deflate()
+    await connection.respond({"foo": 7})
+    assert connection.queue.put.call_args[0] == ('{"foo":7}', None)
+    await connection.respond({"foo": 7}, False)
+    frame = connection.queue.put.call_args[0][0]
+    assert isinstance(frame, WireFrame)
+    assert not frame.compressed
+    assert frame.message == '{"foo":7}'
+    assert frame.data == b'{"foo":7}'
+
+
+@pytest.mark.asyncio
+async def test_connection_respond_batch():
+    socket = MockSocketWrapper()
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    connection.queue = MagicMock()
+    await connection.respond_batch("BATCH", [{"foo": 7}, '{"bar":23}'])
+    assert (
+        json.loads(connection.queue.put.call_args[0][0])
+        == {"uuid": "BATCH", "batch": [{"foo": 7}, {"bar": 23}]})
 
 
 called = 0
@@ -135,7 +367,7 @@ async def test_connection_connect(mocker):
         global called
         if called > 2:
             raise websockets.exceptions.ConnectionClosed(
-                999, "Got bored")
+                Close(999, "Got bored"), None)
         called += 1
         return json.dumps({"msg": 23})
 
@@ -171,6 +403,11 @@ async def test_connection_connect(mocker):
         assert (
             [c[0] for c in parse_m.call_args_list]
             == [('{"msg": 23}', ), ('{"msg": 23}', ), ('{"msg": 23}', )])
+        assert connection.received == 3
+        assert connection.last_seen > 0
+        assert (
+            [c[0] for c in connection.app.metrics.received.call_args_list]
+            == [('{"msg": 23}', )] * 3)
         assert (
             [c[0] for c in log_m.call_args_list]
             == [(parse_m.return_value, ),
@@ -227,21 +464,24 @@ async def test_connection_handle_connection(mocker):
         assert (
             [c[0] for c in connection.socket.send.call_args_list]
             == [({'user': 'BINGO', 'msg': 'connected'},
-                 [hash(connection)])])
+                 [connection.id])])
 
 
-@pytest.mark.asyncio
-async def test_connection_log_request(mocker, capsys):
+def test_connection_log_request(mocker):
     socket = MockSocketWrapper()
     connection = SocketConnection(socket, mocker.MagicMock(), "PATH")
+    connection.app.logger = mocker.MagicMock(level=20)
+    connection.log_request({"foo": 113, "bar": 117})
+    assert not connection.app.logger.log.called
+    connection.app.logger.level = 10
     connection.log_request({"foo": 113, "bar": 117})
     assert (
-        capsys.readouterr().out.strip()
-        == " ".join([
-            'app.socket.recv',
-            str(connection.connection.remote_address['ip']),
-            str(connection.connection.remote_address['port']),
-            str({"foo": 113, "bar": 117})]))
+        [c[0] for c in connection.app.logger.log.call_args_list]
+        == [(10,
+             'app.socket.recv',
+             (connection.connection.remote_address.__getitem__.return_value,
+              connection.connection.remote_address.__getitem__.return_value,
+              {"foo": 113, "bar": 117}))])
 
 
 @pytest.mark.asyncio
@@ -259,6 +499,15 @@ async def test_socket_handle_session(mocker):
             [c[0] for c in _session[0].load.call_args_list]
             == [(_session[1], )])
         assert result == _session[1]
+        assert connection.user is _session[0]
+        assert connection.session is _session[1]
+        assert connection.resolved
+        # resolved sessions are not looked up again
+        assert await connection.handle_session() == _session[1]
+        assert len(session_m.call_args_list) == 1
+        assert len(_session[0].load.call_args_list) == 1
+
+    connection.resolved = False
     _patch = patch(
         "pluggable.socket.connection.Py__SocketConnection._get_session",
         new_callable=AsyncMock)
@@ -268,3 +517,52 @@ async def test_socket_handle_session(mocker):
         result = await connection.handle_session()
         assert not _session[0].load.called
         assert result is None
+        assert connection.resolved
+        # anonymous connections are cached too
+        assert await connection.handle_session() is None
+        assert len(session_m.call_args_list) == 1
+
+
+@pytest.mark.asyncio
+async def test_socket_handle_session_registry():
+    socket = MockSocketWrapper()
+    socket.app.registry = ConnectionRegistry("NODE", {})
+    connection = SocketConnection(socket, "CONNECTION", "PATH")
+    _patch = patch(
+        "pluggable.socket.connection.Py__SocketConnection._get_session",
+        new_callable=AsyncMock)
+    with _patch as session_m:
+        session_m.return_value = [AsyncMock(), "SESSION"]
+        await connection.handle_session()
+    assert (
+        await socket.app.registry.lookup(["SESSION"])
+        == [connection.id])
+
+
+@pytest.mark.asyncio
+async def test_socket_get_session(mocker):
+    socket = MockSocketWrapper()
+    socket.connections = {}
+    socket.sessions = mocker.MagicMock()
+    socket.sessions.get = AsyncMock(return_value="SESSION")
+    _connection = mocker.MagicMock()
+    _connection.request_headers = {'Sec-Websocket-Protocol': 'KEY'}
+    connection = SocketConnection(socket, _connection, "PATH")
+    socket.connections[connection.id] = connection
+    user, session = await connection._get_session()
+    assert user.connection == connection.id
+    assert session == "SESSION"
+    assert (
+        [c[0] for c in socket.sessions.get.call_args_list]
+        == [('KEY', )])
+    connection.session = "OTHER"
+    connection.signalled = True
+    user, session = await connection._get_session()
+    assert session == "OTHER"
+    assert len(socket.sessions.get.call_args_list) == 1
+    connection.session = None
+    connection.signalled = False
+    _connection.request_headers = {}
+    user, session = await connection._get_session()
+    assert session is None
+    assert len(socket.sessions.get.call_args_list) == 1
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from websockets.extensions.permessage_deflate import (
+    ServerPerMessageDeflateFactory)
+from websockets.frames import Frame as WebsocketFrame, Opcode
+
+from pluggable.socket.deflate import (
+    DeflateExtension,
+    DeflateExtensionFactory,
+    Py__Deflate as Deflate)
+from pluggable.socket.frame import Frame
+
+from .base import AsyncMock
+
+
+def MockWebsocket(name="permessage-deflate", takeover=False, bits=None):
+    websocket = MagicMock()
+    extension = MagicMock(
+        local_no_context_takeover=not takeover,
+        local_max_window_bits=bits)
+    extension.name = name
+    websocket.extensions = [extension]
+    return websocket
+
+
+def inflate(data):
+    return zlib.decompressobj(-15).decompress(data + b"\x00\x00\xff\xff")
+
+
+def test_deflate():
+    deflate = Deflate()
+    assert deflate.threshold == 1024
+    assert deflate.level == 6
+    assert deflate.shared
+    assert deflate.window_bits == 15
+    assert (
+        deflate.stats
+        == dict(compressed=0, reused=0, bytes_in=0, bytes_out=0))
+    deflate = Deflate(23, 1, False, 12)
+    assert deflate.threshold == 23
+    assert deflate.level == 1
+    assert not deflate.shared
+    assert deflate.window_bits == 12
+
+
+@patch('pluggable.socket.deflate.DeflateExtensionFactory')
+def test_deflate_factory(factory_m):
+    assert Deflate(23, 1).factory() is factory_m.return_value
+    Deflate(23, 1, False).factory()
+    assert (
+        [c[0] for c in factory_m.call_args_list]
+        == [(23, ), (23, )])
+    assert (
+        [c[1] for c in factory_m.call_args_list]
+        == [dict(server_no_context_takeover=True,
+                 compress_settings=dict(level=1)),
+            dict(server_no_context_takeover=False,
+                 compress_settings=dict(level=1))])
+
+
+def test_deflate_extension_factory():
+    factory = DeflateExtensionFactory(
+        23,
+        server_no_context_takeover=True,
+        compress_settings=dict(level=1))
+    assert isinstance(factory, ServerPerMessageDeflateFactory)
+    response, extension = factory.process_request_params([], [])
+    assert response == [("server_no_context_takeover", None)]
+    assert isinstance(extension, DeflateExtension)
+    assert extension.threshold == 23
+    assert extension.local_no_context_takeover
+    assert not extension.remote_no_context_takeover
+    assert extension.compress_settings == dict(level=1)
+
+
+def DataFrame(data, opcode=Opcode.TEXT, fin=True):
+    return WebsocketFrame(opcode, data, fin)
+
+
+def test_deflate_extension_encode():
+    extension = DeflateExtension(10, False, True, 15, 15)
+    # messages shorter than the threshold are sent as they are
+    frame = DataFrame(b"SHORT")
+    assert extension.encode(frame) is frame
+    frame = DataFrame(b"LONGER MESSAGE")
+    encoded = extension.encode(frame)
+    assert encoded.rsv1
+    assert inflate(encoded.data) == b"LONGER MESSAGE"
+    # as are those sent while ``plain``
+    extension.plain = True
+    assert extension.encode(frame) is frame
+    extension.plain = False
+    # control frames are never compressed
+    frame = DataFrame(b"PING", Opcode.PING)
+    assert extension.encode(frame) is frame
+
+
+def test_deflate_extension_encode_fragments():
+    extension = DeflateExtension(10, False, True, 15, 15)
+    # fragments follow the first frame of their message, as its size is
+    # not known from it
+    first = extension.encode(DataFrame(b"[", fin=False))
+    cont = extension.encode(DataFrame(b"1", Opcode.CONT, False))
+    last = extension.encode(DataFrame(b"]", Opcode.CONT))
+    assert first.rsv1
+    assert not cont.rsv1
+    assert inflate(first.data + cont.data + last.data) == b"[1]"
+    extension.plain = True
+    frames = [
+        DataFrame(b"[", fin=False),
+        DataFrame(b"1", Opcode.CONT, False),
+        DataFrame(b"]", Opcode.CONT)]
+    first = extension.encode(frames[0])
+    extension.plain = False
+    assert [first] + [extension.encode(f) for f in frames[1:]] == frames
+
+
+def test_deflate_extension():
+    deflate = Deflate()
+    websocket = MockWebsocket()
+    assert deflate.extension(websocket) is websocket.extensions[0]
+    assert deflate.extension(MockWebsocket("OTHER")) is None
+    assert deflate.extension(MagicMock(extensions=[])) is None
+    assert deflate.extension(object()) is None
+
+
+def test_deflate_accepts():
+    deflate = Deflate()
+    assert deflate.accepts(MockWebsocket().extensions[0])
+    assert deflate.accepts(MockWebsocket(bits=15).extensions[0])
+    assert not deflate.accepts(None)
+    assert not deflate.accepts(MockWebsocket(takeover=True).extensions[0])
+    # the peer's window would be too small
+    assert not deflate.accepts(MockWebsocket(bits=10).extensions[0])
+    assert Deflate(window_bits=10).accepts(
+        MockWebsocket(bits=10).extensions[0])
+
+
+@pytest.mark.parametrize(
+    "message, data, text",
+    [('{"foo": 7}', b'{"foo": 7}', True),
+     (b'\x81\xa3foo\x07', b'\x81\xa3foo\x07', False),
+     (Frame(b'{"foo": ', b'7', b'}'), b'{"foo": 7}', True),
+     (Frame(b'', b'7', b'', False), b'7', False)])
+def test_deflate_compress(message, data, text):
+    deflate = Deflate()
+    frame = deflate.compress(message)
+    assert frame.message is message
+    assert frame.compressed
+    assert frame.text == text
+    assert not frame.data.endswith(b"\x00\x00\xff\xff")
+    assert inflate(frame.data) == data
+    assert deflate.compressed == 1
+    assert deflate.bytes_in == len(data)
+    assert deflate.bytes_out == len(frame.data)
+    frame = deflate.plain(message)
+    assert frame.message is message
+    assert not frame.compressed
+    assert frame.text == text
+    assert frame.data == data
+
+
+def test_deflate_compress_ratio():
+    deflate = Deflate()
+    message = '{"items": [%s]}' % ", ".join(['"item"'] * 1000)
+    frame = deflate.compress(message)
+    assert len(frame) < len(message) / 10
+    assert inflate(frame.data) == message.encode("utf8")
+
+
+def test_deflate_prepare():
+    deflate = Deflate(threshold=10)
+    shared, takeover = MockWebsocket(), MockWebsocket(takeover=True)
+    plain = MagicMock(extensions=[])
+    # messages are left to ``websocket.send`` and the connection's
+    # extension, whatever their size
+    assert deflate.prepare(shared, "SHORT") == "SHORT"
+    assert deflate.prepare(takeover, "SHORT") == "SHORT"
+    assert deflate.prepare(plain, "SHORT") == "SHORT"
+    assert deflate.prepare(shared, "LONGER MESSAGE") == "LONGER MESSAGE"
+    assert deflate.prepare(plain, "LONGER MESSAGE") == "LONGER MESSAGE"
+    # compressed frames are only written to connections that can share
+    # them
+    frame = deflate.compress("LONGER MESSAGE")
+    assert deflate.prepare(shared, frame) is frame
+    assert deflate.prepare(shared, frame) is frame
+    assert deflate.reused == 2
+    assert deflate.prepare(takeover, frame) == "LONGER MESSAGE"
+    assert deflate.prepare(plain, frame) == "LONGER MESSAGE"
+    assert deflate.reused == 2
+    # as are those a command sends uncompressed
+    frame = deflate.plain("LONGER MESSAGE")
+    assert deflate.prepare(plain, frame) is frame
+    assert deflate.prepare(takeover, frame) is frame
+
+
+@pytest.mark.asyncio
+async def test_deflate_send_plain():
+    deflate = Deflate()
+    websocket = MockWebsocket()
+    extension = websocket.extensions[0]
+    extension.plain = False
+    sent = []
+
+    def send(message):
+        sent.append((message, extension.plain))
+
+    websocket.send = AsyncMock(side_effect=send)
+    await deflate.send_plain(websocket, "MESSAGE")
+    assert sent == [("MESSAGE", True)]
+    assert not extension.plain
+    websocket.send.side_effect = ConnectionError
+    with pytest.raises(ConnectionError):
+        await deflate.send_plain(websocket, "MESSAGE")
+    assert not extension.plain
+    # connections without the extension are sent the message
+    websocket = MagicMock(extensions=[])
+    websocket.send = AsyncMock()
+    await deflate.send_plain(websocket, "MESSAGE")
+    assert websocket.send.call_args[0] == ("MESSAGE", )
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from pluggable.socket.cache import cached
+from pluggable.socket.dispatch import (
+    Py__Command as Command,
+    Py__Dispatcher as Dispatcher)
+
+
+async def local_foo(connection, uuid, bar=None, baz=None):
+    pass
+
+
+async def local_any(connection, uuid, **kwargs):
+    pass
+
+
+def test_command_signature():
+    with pytest.raises(TypeError):
+        Command()
+
+
+def test_command():
+    command = Command("FOO", local_foo, True)
+    assert command.name == "FOO"
+    assert command.handler is local_foo
+    assert command.local
+    assert command.timeout == 0
+    assert command.rate == "FOO"
+    assert command.cache is None
+    assert command.compress
+    assert command.params == frozenset(["bar", "baz"])
+    assert command.accepts({})
+    assert command.accepts(dict(bar=7, baz=23))
+    assert not command.accepts(dict(bar=7, other=23))
+
+
+def test_command_any():
+    assert Command("FOO", local_any, True).params is None
+    assert Command("FOO", local_any, True).accepts(dict(other=23))
+    # worker task params are not inspected
+    assert Command("FOO", local_foo, False).params is None
+
+
+def test_command_metadata():
+    task = MagicMock(timeout=7.5, rate="SLOW")
+    command = Command("FOO", task, False)
+    assert not command.local
+    assert command.timeout == 7.5
+    assert command.rate == "SLOW"
+    # mocks have every attribute, but no cache declaration
+    assert command.cache is None
+    cached(30, scope="session")(task)
+    assert (
+        Command("FOO", task, False).cache
+        == dict(ttl=30, size=1000, scope="session"))
+    # only an explicit ``False`` opts out of compression
+    assert command.compress
+    task.compress = False
+    assert not Command("FOO", task, False).compress
+
+
+def test_command_metadata_invalid():
+    # other attributes of the same names are ignored
+    task = MagicMock()
+    command = Command("FOO", task, False)
+    assert command.timeout == 0
+    assert command.rate == "FOO"
+    task = MagicMock(timeout=-1, rate="")
+    command = Command("FOO", task, False)
+    assert command.timeout == 0
+    assert command.rate == "FOO"
+    assert Command("FOO", MagicMock(timeout=3), False).timeout == 3
+
+
+def test_dispatcher():
+    app = MagicMock()
+    dispatcher = Dispatcher(app)
+    assert dispatcher.app is app
+    assert dispatcher.commands == {}
+    assert len(dispatcher) == 0
+    assert dispatcher.get("FOO") is None
+
+
+def test_dispatcher_compresses():
+    dispatcher = Dispatcher(MagicMock())
+    task = MagicMock(compress=False)
+    dispatcher.commands = dict(
+        FOO=Command("FOO", local_foo, True),
+        BAR=Command("BAR", task, False))
+    assert dispatcher.compresses("FOO")
+    assert not dispatcher.compresses("BAR")
+    assert dispatcher.compresses("BAZ")
+
+
+def test_dispatcher_refresh():
+    app = MagicMock()
+    task = MagicMock(timeout=None, rate=None)
+    app.worker.tasks = dict(FOO=task, BAR=task)
+    app.commands = dict(BAR=local_foo, BAZ=local_any)
+    dispatcher = Dispatcher(app)
+    dispatcher.refresh()
+    assert sorted(dispatcher.commands) == ["BAR", "BAZ", "FOO"]
+    assert "FOO" in dispatcher
+    assert not dispatcher.get("FOO").local
+    assert dispatcher.get("FOO").handler is task
+    # local commands win
+    assert dispatcher.get("BAR").local
+    assert dispatcher.get("BAR").handler is local_foo
+    assert dispatcher.get("BAZ").local
+
+    foo = dispatcher.get("FOO")
+    bar = dispatcher.get("BAR")
+    app.commands = dict(BAZ=local_foo)
+    dispatcher.refresh()
+    assert sorted(dispatcher.commands) == ["BAR", "BAZ", "FOO"]
+    # unchanged entries are kept
+    assert dispatcher.get("FOO") is foo
+    assert dispatcher.get("BAR") is not bar
+    assert not dispatcher.get("BAR").local
+    assert dispatcher.get("BAZ").handler is local_foo
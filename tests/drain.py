@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import signal
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from pluggable.socket.drain import (
+    HANDOFF_ENV,
+    SERVICE_RESTART,
+    inherited,
+    ready,
+    Py__Drain as Drain)
+from pluggable.socket.logger import INFO, WARNING
+from pluggable.socket.queue import SendQueue
+
+from .base import AsyncMock
+
+
+def MockApp():
+    app = MagicMock()
+    app.runner.admission.running = 0
+    app.runner.admission.closed = False
+    connections = [MagicMock(), MagicMock()]
+    for i, connection in enumerate(connections):
+        connection.id = "ID%s" % i
+        connection.pending = []
+        connection.queue = None
+        connection.connection.close = AsyncMock()
+        connection.codec.encode.side_effect = lambda msg: msg
+    app.socket.connections = dict(enumerate(connections))
+    app.socket._send = AsyncMock()
+    app.server.wait_closed = AsyncMock()
+    app.registry.shared = True
+    app.registry.remove = AsyncMock()
+    app.registry.stop = AsyncMock()
+    app.bus.stop = AsyncMock()
+    app.metrics.stop = AsyncMock()
+    return app
+
+
+def test_drain_signature():
+    with pytest.raises(TypeError):
+        Drain()
+
+
+def test_drain():
+    drain = Drain("APP")
+    assert drain.app == "APP"
+    assert drain.grace == 30
+    assert drain.reconnect_min == 1
+    assert drain.reconnect_max == 10
+    assert not drain.handoff
+    assert drain.interval == 0.1
+    assert not drain.draining
+    assert drain.task is None
+
+
+def test_drain_listen():
+    app = MagicMock()
+    drain = Drain(app)
+    drain.listen()
+    assert (
+        [c[0] for c in app.loop.add_signal_handler.call_args_list]
+        == [(signal.SIGTERM, drain.start),
+            (signal.SIGINT, drain.start)])
+    app = MagicMock()
+    drain = Drain(app, handoff=True)
+    drain.listen()
+    assert (
+        [c[0] for c in app.loop.add_signal_handler.call_args_list]
+        == [(signal.SIGTERM, drain.start),
+            (signal.SIGINT, drain.start),
+            (signal.SIGUSR2, drain.start_handoff)])
+
+
+def test_drain_start():
+    app = MagicMock()
+    drain = Drain(app)
+    drain.start()
+    drain.start()
+    drain.start_handoff()
+    assert (
+        [c[0][0].cr_code.co_name
+         for c in app.loop.create_task.call_args_list]
+        == ["run"])
+    assert drain.task is app.loop.create_task.return_value
+    app.loop.create_task.call_args[0][0].close()
+    drain = Drain(app)
+    drain.start_handoff()
+    assert (
+        app.loop.create_task.call_args[0][0].cr_code.co_name
+        == "hand_off")
+    app.loop.create_task.call_args[0][0].close()
+
+
+def test_drain_hint():
+    drain = Drain("APP", reconnect_min=2, reconnect_max=3)
+    delays = [drain.hint()["reconnect"]["delay"] for _ in range(100)]
+    assert all(2 <= delay <= 3 for delay in delays)
+    # jittered, so that clients do not all reconnect at once
+    assert len(set(delays)) > 1
+    assert list(drain.hint()) == ["reconnect"]
+
+
+def test_drain_settled():
+    app = MockApp()
+    drain = Drain(app)
+    assert drain.settled()
+    app.socket.connections[1].pending = ["UUID"]
+    assert not drain.settled()
+    app.socket.connections[1].pending = []
+    app.runner.admission.running = 1
+    assert not drain.settled()
+    app.runner.admission.running = 0
+    app.socket.connections[1].queue = SendQueue("WS", AsyncMock(), 5)
+    assert drain.settled()
+    app.socket.connections[1].queue.put("FRAME")
+    assert not drain.settled()
+
+
+@pytest.mark.asyncio
+async def test_drain_run_slow_consumer():
+    app = MockApp()
+    drain = Drain(app, grace=1, interval=0.01)
+    connection = app.socket.connections[0]
+    written = []
+
+    async def send(websocket, frame):
+        await asyncio.sleep(0.02)
+        written.append(frame)
+
+    async def close(code, reason):
+        written.append(code)
+
+    connection.connection.close = close
+    connection.queue = SendQueue(connection.connection, send, 5)
+    connection.queue.start(asyncio.get_event_loop())
+    for frame in ["FOO", "BAR", "BAZ"]:
+        connection.queue.put(frame)
+    with patch('pluggable.socket.drain.Py__Drain.log') as log_m:
+        await drain.run()
+    # responses queued for a slow reader are written before it is closed
+    assert written == ["FOO", "BAR", "BAZ", SERVICE_RESTART]
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(INFO, ['draining', 2]), (INFO, ['drained'])])
+    connection.queue.close()
+
+
+@pytest.mark.asyncio
+async def test_drain_run():
+    app = MockApp()
+    drain = Drain(app, grace=1, interval=0.01)
+    connections = list(app.socket.connections.values())
+    connections[0].pending = ["UUID"]
+
+    async def finish(delay):
+        connections[0].pending = []
+
+    _patch = patch('pluggable.socket.drain.asyncio.sleep', new=finish)
+    with _patch:
+        with patch('pluggable.socket.drain.Py__Drain.log') as log_m:
+            await drain.run()
+    assert drain.draining
+    assert app.runner.admission.closed
+    assert app.server.server.close.called
+    sent = [c[0] for c in app.socket._send.call_args_list]
+    assert [c[0] for c in sent] == [c.connection for c in connections]
+    assert all(
+        1 <= msg["reconnect"]["delay"] <= 10
+        for _, msg in sent)
+    for connection in connections:
+        assert (
+            [c[0] for c in connection.connection.close.call_args_list]
+            == [(SERVICE_RESTART, "draining")])
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(INFO, ['draining', 2]), (INFO, ['drained'])])
+    # the log is flushed before the loop stops
+    assert (
+        [c[0] for c in app.mock_calls
+         if c[0] in ("logger.stop", "loop.stop")]
+        == ["logger.stop", "loop.stop"])
+
+
+@pytest.mark.asyncio
+async def test_drain_run_grace():
+    app = MockApp()
+    app.runner.admission.running = 3
+    drain = Drain(app, grace=0.05, interval=0.01)
+    with patch('pluggable.socket.drain.Py__Drain.log') as log_m:
+        await drain.run()
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(INFO, ['draining', 2]),
+            (WARNING, ['grace period expired', 3]),
+            (INFO, ['drained'])])
+    assert app.loop.stop.called
+
+
+@pytest.mark.asyncio
+async def test_drain_close():
+    app = MockApp()
+    drain = Drain(app)
+    await drain.close()
+    assert app.server.close.called
+    assert app.server.wait_closed.called
+    assert app.socket.wheel.stop.called
+    assert (
+        [c[0] for c in app.registry.remove.call_args_list]
+        == [("ID0", ), ("ID1", )])
+    assert app.registry.stop.called
+    assert app.bus.stop.called
+    assert app.metrics.stop.called
+    app = MockApp()
+    app.server = None
+    app.socket.wheel = None
+    app.registry.shared = False
+    await Drain(app).close()
+    assert not app.registry.remove.called
+    assert app.registry.stop.called
+
+
+def test_drain_inherited():
+    with patch.dict('pluggable.socket.drain.os.environ', clear=True):
+        assert inherited() is None
+    _patch = patch.dict(
+        'pluggable.socket.drain.os.environ', {HANDOFF_ENV: "7,8"})
+    with _patch:
+        with patch('pluggable.socket.drain.socket.socket') as socket_m:
+            assert inherited() is socket_m.return_value
+    assert (
+        [c[1] for c in socket_m.call_args_list]
+        == [dict(fileno=7)])
+
+
+def test_drain_ready():
+    read, write = os.pipe()
+    _patch = patch.dict(
+        'pluggable.socket.drain.os.environ',
+        {HANDOFF_ENV: "7,%s" % write})
+    with _patch:
+        ready()
+        assert HANDOFF_ENV not in os.environ
+        # only once
+        ready()
+    assert os.read(read, 1) == b"1"
+    # the write end is closed
+    assert os.read(read, 1) == b""
+    os.close(read)
+
+
+@pytest.mark.asyncio
+async def test_drain_hand_off_failed():
+    app = MockApp()
+    app.loop = asyncio.get_event_loop()
+    sock = MagicMock()
+    sock.fileno.return_value = 7
+    app.server.server.sockets = [sock]
+    drain = Drain(app, grace=1)
+    drain.task = "TASK"
+    process = MagicMock(pid=23, returncode=None)
+
+    async def exec_m(*args, **kwargs):
+        exec_m.kwargs = kwargs
+        # the write end is closed without the process signalling it is
+        # ready
+        return process
+
+    _patch = patch(
+        'pluggable.socket.drain.asyncio.create_subprocess_exec',
+        new=exec_m)
+    with _patch:
+        with patch('pluggable.socket.drain.Py__Drain.log') as log_m:
+            await drain.hand_off()
+    env = exec_m.kwargs["env"]
+    assert env[HANDOFF_ENV].split(",")[0] == "7"
+    assert exec_m.kwargs["pass_fds"][0] == 7
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(WARNING, ['handoff failed', 23])])
+    assert process.terminate.called
+    assert drain.task is None
+    assert not drain.draining
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from pluggable.socket.frame import (
+    OP_CONT, OP_TEXT,
+    Py__Frame as Frame,
+    Py__WireFrame as WireFrame)
+
+from .base import AsyncMock
+
+
+def test_frame_signature():
+    with pytest.raises(TypeError):
+        Frame()
+
+
+def test_frame():
+    payload = b'{"foo": 7}'
+    frame = Frame(b'{"response": ', payload, b'}')
+    assert frame.prefix == b'{"response": '
+    assert frame.payload is payload
+    assert frame.suffix == b'}'
+    assert frame.text
+    assert len(frame) == 24
+    assert repr(frame) == "<Frame 24 bytes>"
+    assert frame.parts() == [b'{"response": ', payload, b'}']
+    assert frame.tobytes() == b'{"response": {"foo": 7}}'
+    assert bytes(frame) == frame.tobytes()
+    assert not Frame(b'', b'', b'', False).text
+    # payloads can be any buffer
+    frame = Frame(b'[', memoryview(b'1, 2'), b']')
+    assert frame.tobytes() == b'[1, 2]'
+
+
+@pytest.mark.asyncio
+async def test_frame_send():
+    websocket = MagicMock()
+    websocket._fragmented_message_waiter = None
+    websocket.write_frame = AsyncMock()
+    websocket.send = AsyncMock()
+    await Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX').send(websocket)
+    assert (
+        [c[0] for c in websocket.write_frame.call_args_list]
+        == [(False, OP_TEXT, b'PREFIX'),
+            (False, OP_CONT, b'PAYLOAD'),
+            (True, OP_CONT, b'SUFFIX')])
+    assert websocket._fragmented_message_waiter is None
+    assert not websocket.send.called
+    # binary fragments can go through the public API
+    websocket.write_frame.reset_mock()
+    await Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX', False).send(websocket)
+    assert not websocket.write_frame.called
+    assert (
+        [c[0] for c in websocket.send.call_args_list]
+        == [([b'PREFIX', b'PAYLOAD', b'SUFFIX'], )])
+
+
+@pytest.mark.asyncio
+async def test_frame_send_public():
+    # connections without the legacy frame-level API are sent the joined
+    # message
+    websocket = MagicMock(spec=["send"])
+    websocket.send = AsyncMock()
+    await Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX').send(websocket)
+    await Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX', False).send(websocket)
+    assert (
+        [c[0] for c in websocket.send.call_args_list]
+        == [('PREFIXPAYLOADSUFFIX', ),
+            ([b'PREFIX', b'PAYLOAD', b'SUFFIX'], )])
+
+
+@pytest.mark.asyncio
+async def test_frame_send_waits():
+    # fragments are not interleaved with another fragmented message
+    websocket = MagicMock()
+    waiter = asyncio.get_event_loop().create_future()
+    websocket._fragmented_message_waiter = waiter
+    websocket.write_frame = AsyncMock()
+    task = asyncio.ensure_future(
+        Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX').send(websocket))
+    await asyncio.sleep(0)
+    assert not websocket.write_frame.called
+    websocket._fragmented_message_waiter = None
+    waiter.set_result(None)
+    await task
+    assert len(websocket.write_frame.call_args_list) == 3
+
+
+@pytest.mark.asyncio
+async def test_frame_send_fails():
+    websocket = MagicMock()
+    websocket._fragmented_message_waiter = None
+    websocket.write_frame = AsyncMock(side_effect=ConnectionError)
+    with pytest.raises(ConnectionError):
+        await Frame(b'PREFIX', b'PAYLOAD', b'SUFFIX').send(websocket)
+    assert websocket._fragmented_message_waiter is None
+
+
+def test_wire_frame():
+    frame = WireFrame("MESSAGE", b"DATA")
+    assert frame.message == "MESSAGE"
+    assert frame.data == b"DATA"
+    assert frame.text
+    assert not frame.compressed
+    assert frame.header == b"\x81\x04"
+    assert len(frame) == 4
+    assert repr(frame) == "<WireFrame 4 bytes>"
+    frame = WireFrame(b"MESSAGE", b"DATA", False, True)
+    assert frame.header == b"\xc2\x04"
+    assert repr(frame) == "<WireFrame 4 bytes compressed>"
+
+
+@pytest.mark.parametrize(
+    "size, header",
+    [(125, b"\x81\x7d"),
+     (126, b"\x81\x7e\x00\x7e"),
+     (0xffff, b"\x81\x7e\xff\xff"),
+     (0x10000, b"\x81\x7f\x00\x00\x00\x00\x00\x01\x00\x00")])
+def test_wire_frame_header(size, header):
+    assert WireFrame("MESSAGE", b"x" * size).header == header
+
+
+@pytest.mark.asyncio
+async def test_wire_frame_send():
+    websocket = MagicMock()
+    websocket._fragmented_message_waiter = None
+    websocket.ensure_open = AsyncMock()
+    websocket.drain = AsyncMock()
+    await WireFrame("MESSAGE", b"DATA", True, True).send(websocket)
+    assert websocket.ensure_open.called
+    # the negotiated extensions are bypassed
+    assert not websocket.write_frame.called
+    assert (
+        [c[0] for c in websocket.transport.write.call_args_list]
+        == [(b"\xc1\x04", ), (b"DATA", )])
+    assert websocket.drain.called
+
+
+@pytest.mark.asyncio
+async def test_wire_frame_send_closed():
+    websocket = MagicMock()
+    websocket._fragmented_message_waiter = None
+    websocket.ensure_open = AsyncMock(side_effect=ConnectionError)
+    with pytest.raises(ConnectionError):
+        await WireFrame("MESSAGE", b"DATA").send(websocket)
+    assert not websocket.transport.write.called
+
+
+@pytest.mark.asyncio
+async def test_wire_frame_send_public():
+    websocket = MagicMock(spec=["send", "transport"])
+    websocket.send = AsyncMock()
+    await WireFrame("MESSAGE", b"DATA", True, True).send(websocket)
+    await WireFrame(
+        Frame(b'[', b'1', b']'), b"DATA", True, True).send(websocket)
+    assert not websocket.transport.write.called
+    assert (
+        [c[0] for c in websocket.send.call_args_list]
+        == [("MESSAGE", ), ("[1]", )])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pluggable.socket.connection import SocketConnection
+from pluggable.socket.limits import (
+    Py__RateLimiter as RateLimiter,
+    Py__TokenBucket as TokenBucket)
+from pluggable.socket.socket import SocketWrapper
+
+
+class _MockSocketWrapper(SocketWrapper):
+
+    def __init__(self, app):
+        pass
+
+
+def MockConnection():
+    return SocketConnection(_MockSocketWrapper(None), "CONNECTION", "PATH")
+
+
+def test_bucket_signature():
+    with pytest.raises(TypeError):
+        TokenBucket()
+
+
+def test_bucket():
+    bucket = TokenBucket(2, 3)
+    assert bucket.rate == 2
+    assert bucket.burst == 3
+    assert bucket.tokens == 3
+    now = bucket.updated
+    assert bucket.consume(now)
+    assert bucket.consume(now)
+    assert bucket.consume(now)
+    assert not bucket.consume(now)
+    assert not bucket.full(now)
+    # half a second refills one token
+    assert bucket.consume(now + .5)
+    assert not bucket.consume(now + .5)
+    # never more than burst
+    assert bucket.full(now + 10)
+    assert bucket.consume(now + 10, 3)
+    assert not bucket.consume(now + 10)
+
+
+def test_bucket_now():
+    bucket = TokenBucket(1, 1, 10)
+    assert bucket.updated == 10
+    # an earlier time does not drain the bucket
+    assert bucket.full(9)
+    assert bucket.consume(9.5)
+    assert bucket.updated == 10
+    assert not bucket.consume(10)
+    assert bucket.consume(11)
+
+
+def test_limiter():
+    limiter = RateLimiter(60, 120)
+    assert limiter.rate == 60
+    assert limiter.burst == 120
+    assert limiter.session_rate == 0
+    assert limiter.session_burst == 0
+    assert limiter.commands == {}
+    assert limiter.sessions == {}
+    assert limiter.max_sessions == 10000
+
+
+def test_limiter_allow():
+    limiter = RateLimiter(1, 2, commands=dict(SLOW=(1, 1), FREE=(0, 0)))
+    connection = MockConnection()
+    assert limiter.allow(connection, None, "FOO")
+    assert limiter.allow(connection, None, "BAR")
+    assert not limiter.allow(connection, None, "FOO")
+    assert list(connection.buckets) == [None]
+    # overridden commands have their own bucket
+    assert limiter.allow(connection, None, "SLOW")
+    assert not limiter.allow(connection, None, "SLOW")
+    assert list(connection.buckets) == [None, "SLOW"]
+    # and a zero rate is unlimited
+    for _ in range(10):
+        assert limiter.allow(connection, None, "FREE")
+
+
+def test_limiter_allow_session():
+    limiter = RateLimiter(0, 0, 1, 2)
+    connection1 = MockConnection()
+    connection2 = MockConnection()
+    assert limiter.allow(connection1, "SESSION", "FOO")
+    assert limiter.allow(connection2, "SESSION", "FOO")
+    assert not limiter.allow(connection1, "SESSION", "FOO")
+    assert not limiter.allow(connection2, "SESSION", "FOO")
+    assert limiter.allow(connection2, "OTHER", "FOO")
+    # anonymous requests are only limited per connection
+    assert limiter.allow(connection2, None, "FOO")
+    assert connection1.buckets is None
+    assert list(limiter.sessions) == ["SESSION", "OTHER"]
+
+
+def test_limiter_prune():
+    limiter = RateLimiter(0, 0, 1, 1, max_sessions=2)
+    connection = MockConnection()
+    assert limiter.allow(connection, "S1", "FOO")
+    assert limiter.allow(connection, "S2", "FOO")
+    now = limiter.sessions["S1"].updated
+    limiter.sessions["S2"].tokens = 1
+    limiter.prune(now)
+    assert list(limiter.sessions) == ["S1"]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import MagicMock
+
+import rapidjson as json
+import msgpack
+
+import pytest
+
+from pluggable.socket.codec import codecs
+from pluggable.socket.connection import Py__SocketConnection
+from pluggable.socket.local import Py__LocalRunner as LocalRunner
+from pluggable.socket.socket import SocketWrapper
+from pluggable.socket.stream import ResponseStream
+
+from .base import AsyncMock
+
+
+class _MockSocketWrapper(SocketWrapper):
+
+    def __init__(self, app):
+        pass
+
+
+def MockConnection():
+    connection = Py__SocketConnection(
+        _MockSocketWrapper(None), "CONNECTION", "PATH")
+    connection.respond = AsyncMock()
+    return connection
+
+
+def MockApp(returns):
+    app = MagicMock()
+    app.commands = dict(FOO=AsyncMock(return_value=returns))
+    return app
+
+
+def test_local_signature():
+    with pytest.raises(TypeError):
+        LocalRunner()
+
+
+def test_local_commands():
+    app = MockApp(None)
+    runner = LocalRunner(app)
+    assert list(runner.commands) == ["FOO"]
+
+
+@pytest.mark.asyncio
+async def test_local_call():
+    app = MockApp(None)
+    runner = LocalRunner(app)
+    connection = MockConnection()
+    handler = AsyncMock(return_value=None)
+    assert await runner.call(connection, "UUID", handler, {}) is None
+    handler.return_value = dict(response=7)
+    response = await runner.call(connection, "UUID", handler, dict(bar=7))
+    assert response == dict(uuid="UUID", response=7)
+    assert (
+        [(c[0], c[1]) for c in handler.call_args_list]
+        == [((connection.id, "UUID"), {}),
+            ((connection.id, "UUID"), dict(bar=7))])
+    assert not app.commands["FOO"].called
+    assert not connection.respond.called
+
+
+@pytest.mark.asyncio
+async def test_local_call_stream():
+    app = MockApp(None)
+    runner = LocalRunner(app)
+    connection = MockConnection()
+
+    async def generator(connection, uuid, count):
+        for i in range(count):
+            yield i
+
+    async def returns_generator(connection, uuid):
+        return generator(connection, uuid, 2)
+
+    for handler, params in [(generator, dict(count=3)),
+                            (returns_generator, {})]:
+        stream = await runner.call(connection, "UUID", handler, params)
+        assert isinstance(stream, ResponseStream)
+        assert stream.uuid == "UUID"
+        assert stream.connection is connection
+        await stream.iterator.aclose()
+
+
+@pytest.mark.asyncio
+async def test_local_call_encoded():
+    app = MockApp(None)
+    runner = LocalRunner(app)
+    connection = MockConnection()
+    handler = AsyncMock(return_value=b'{"bar": 7}')
+    frame = await runner.call(connection, "UUID", handler, {})
+    assert frame.payload is handler.return_value
+    assert (
+        json.loads(frame.tobytes())
+        == dict(uuid="UUID", response=dict(bar=7)))
+
+    connection.codec = codecs["msgpack"]
+    frame = await runner.call(connection, "UUID", handler, {})
+    assert msgpack.unpackb(frame) == dict(uuid="UUID", response=dict(bar=7))
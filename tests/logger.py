@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from pluggable.socket.logger import (
+    DEBUG, INFO, WARNING,
+    Py__SocketLogger as SocketLogger)
+
+
+def test_logger_signature():
+    with pytest.raises(TypeError):
+        SocketLogger()
+
+
+def test_logger():
+    logger = SocketLogger("APP")
+    assert logger.app == "APP"
+    assert logger.level == INFO
+    assert logger.buffer.maxlen == 10000
+    assert logger.interval == 1.0
+    assert logger.sample == 1
+    assert logger.events == []
+    assert logger.enabled(INFO)
+    assert logger.enabled(WARNING)
+    assert not logger.enabled(DEBUG)
+    with pytest.raises(KeyError):
+        SocketLogger("APP", "NOT A LEVEL")
+
+
+def test_logger_log():
+    logger = SocketLogger("APP", "info", 2)
+    logger.log(DEBUG, "app.debug", ("foo", ))
+    assert len(logger.buffer) == 0
+    logger.log(INFO, "app.info", ("foo", ))
+    logger.log(WARNING, "app.warning", ("bar", 7))
+    logger.log(INFO, "app.info", ("baz", ))
+    assert (
+        list(logger.buffer)
+        == [("app.warning", ("bar", 7)),
+            ("app.info", ("baz", ))])
+    assert logger.dropped == 1
+
+
+@patch("pluggable.socket.logger.sys.stdout.write")
+def test_logger_flush(write_m):
+    app = MagicMock()
+    logger = SocketLogger(app, "info", 2)
+    logger.flush()
+    assert not write_m.called
+    logger.log(INFO, "app.info", ("foo", 7))
+    logger.log(INFO, "app.info", ("x" * 100, {"bar": "y" * 100}))
+    logger.log(INFO, "app.info", ("baz", ))
+    logger.flush()
+    output = write_m.call_args[0][0].split("\n")
+    assert output[0].startswith("app.info %s {'bar': 'yyy" % ("x" * 50))
+    assert len(output[0]) <= len("app.info  ") + 100
+    assert output[1] == "app.info baz"
+    assert output[2] == "app.log: dropped 1 entries"
+    assert logger.dropped == 0
+    assert len(logger.buffer) == 0
+    assert not app.loop.create_task.called
+
+
+def test_logger_event():
+    app = MagicMock()
+    logger = SocketLogger(app, "info", 2, 1.0, 2)
+    for i in range(5):
+        logger.event("EVENT%s" % i)
+    assert logger.events == ["EVENT1", "EVENT3"]
+    logger.flush()
+    assert logger.events == []
+    assert (
+        [c[1] for c in app.worker.tasks['log'].call.call_args_list]
+        == [dict(type="server", msg="EVENT1\nEVENT3")])
+    assert (
+        [c[0] for c in app.loop.create_task.call_args_list]
+        == [(app.worker.tasks['log'].call.return_value, )])
+
+
+def test_logger_start_stop():
+    loop = MagicMock()
+    logger = SocketLogger("APP")
+    logger.start(loop)
+    task = logger.task
+    assert task is loop.create_task.return_value
+    with patch("pluggable.socket.logger.Py__SocketLogger.flush") as flush_m:
+        logger.stop()
+    assert flush_m.called
+    assert task.cancel.called
+    assert logger.task is None
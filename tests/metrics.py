@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from pluggable.socket.dispatch import Dispatcher
+from pluggable.socket.metrics import (
+    Py__Histogram as Histogram,
+    Py__Metrics as Metrics)
+from pluggable.socket.topics import TopicIndex
+
+
+def MockApp():
+    app = MagicMock()
+    app.runner.dispatch = Dispatcher(app)
+    app.runner.dispatch.commands = dict(FOO=7)
+    app.runner.admission.running = 3
+    connections = [MagicMock(), MagicMock()]
+    connections[0].pending = [1, 2]
+    connections[0].queue.frames = [1]
+    connections[0].streams = {}
+    connections[1].pending = []
+    connections[1].queue = None
+    connections[1].streams = dict(UUID=7)
+    app.socket.connections = dict(enumerate(connections))
+    app.socket.topics = TopicIndex()
+    app.socket.topics.subscribe(1, "TOPIC")
+    return app
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.count == 0
+    assert histogram.quantile(0.5) == 0
+    assert len(histogram.counts) == 544
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+    assert histogram.count == 100
+    assert histogram.max == 0.1
+    assert histogram.total == pytest.approx(5.05)
+    # within the 1/16th bucket resolution
+    assert histogram.quantile(0.5) == pytest.approx(0.05, rel=1 / 16)
+    assert histogram.quantile(0.99) == pytest.approx(0.099, rel=1 / 16)
+    assert histogram.quantile(1) == 0.1
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["mean"] == pytest.approx(0.0505)
+    assert summary["max"] == 0.1
+    assert sorted(summary) == [
+        "count", "max", "mean", "p50", "p90", "p99", "p999"]
+
+
+@pytest.mark.parametrize(
+    "seconds",
+    [0, 1e-6, 31e-6, 32e-6, 0.001234, 1.5, 600])
+def test_histogram_buckets(seconds):
+    histogram = Histogram()
+    histogram.record(seconds)
+    index = [i for i, count in enumerate(histogram.counts) if count][0]
+    upper = histogram.upper(index)
+    assert seconds <= upper + 1e-9
+    assert upper <= seconds * 17 / 16 + 1e-6
+
+
+def test_histogram_bounds():
+    histogram = Histogram()
+    histogram.record(-1)
+    histogram.record(1e9)
+    assert histogram.counts[0] == 1
+    assert histogram.counts[-1] == 1
+
+
+def test_metrics_signature():
+    with pytest.raises(TypeError):
+        Metrics()
+
+
+def test_metrics():
+    app = MockApp()
+    metrics = Metrics(app)
+    assert metrics.app is app
+    assert metrics.enabled
+    assert metrics.port == 0
+    assert metrics.histograms == {}
+    metrics.observe("execute", "FOO", 0.01)
+    metrics.observe("execute", "FOO", 0.02)
+    metrics.observe("queue", "FOO", 0)
+    assert metrics.histogram("execute", "FOO").count == 2
+    assert metrics.histogram("queue", "FOO").count == 1
+    metrics.received('{"foo": 7}')
+    metrics.sent(b"1234", 0.001)
+    assert (
+        metrics.counters()
+        == dict(messages_in=1, messages_out=1, bytes_in=10, bytes_out=4))
+    assert metrics.writes.count == 1
+    assert (
+        metrics.gauges()
+        == dict(connections=2,
+                in_flight=3,
+                pending=2,
+                queued=1,
+                streams=1,
+                subscriptions=1))
+    snapshot = metrics.snapshot()
+    assert sorted(snapshot["commands"]["FOO"]) == ["execute", "queue"]
+    assert snapshot["commands"]["FOO"]["execute"]["count"] == 2
+    assert snapshot["counters"] == metrics.counters()
+    assert snapshot["writes"]["count"] == 1
+
+
+def test_metrics_disabled():
+    metrics = Metrics(MockApp(), False)
+    metrics.observe("execute", "FOO", 0.01)
+    metrics.received("MSG")
+    metrics.sent("MSG", 0.01)
+    assert metrics.histograms == {}
+    assert metrics.messages_in == metrics.messages_out == 0
+    assert metrics.writes.count == 0
+
+
+def test_metrics_label():
+    metrics = Metrics(MockApp())
+    assert metrics.label(dict(command="FOO")) == "FOO"
+    assert metrics.label(dict(cmd="FOO")) == "FOO"
+    assert metrics.label(dict(command="BAR")) == "unknown"
+    assert metrics.label(dict(uuid="UUID")) == "unknown"
+    assert metrics.label(dict(command=["FOO"])) == "unknown"
+    assert metrics.label(dict(batch=[])) == "batch"
+
+
+@pytest.mark.asyncio
+async def test_metrics_stats():
+    metrics = Metrics(MockApp())
+    metrics.observe("execute", "FOO", 0.01)
+    assert (
+        await metrics.stats(23, "UUID")
+        == dict(stats=metrics.snapshot()))
+
+
+def test_metrics_prometheus():
+    metrics = Metrics(MockApp())
+    metrics.observe("execute", "FOO", 0.01)
+    metrics.received("MSG")
+    lines = metrics.prometheus().splitlines()
+    assert "# TYPE pluggable_socket_messages_in_total counter" in lines
+    assert "pluggable_socket_messages_in_total 1" in lines
+    assert "# TYPE pluggable_socket_connections gauge" in lines
+    assert "pluggable_socket_connections 2" in lines
+    assert "# TYPE pluggable_socket_command_seconds summary" in lines
+    assert (
+        'pluggable_socket_command_seconds'
+        '{command="FOO",stage="execute",quantile="0.5"} 0.01'
+        in lines)
+    assert (
+        'pluggable_socket_command_seconds_count'
+        '{command="FOO",stage="execute"} 1'
+        in lines)
+    assert 'pluggable_socket_write_seconds_count 0' in lines
+    assert 'pluggable_socket_write_seconds{quantile="0.99"} 0.0' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_handle():
+    metrics = Metrics(MockApp())
+    assert await metrics.serve() is None
+    assert metrics.server is None
+    server = await asyncio.start_server(
+        metrics.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET %s HTTP/1.1\r\nHost: metrics\r\n\r\n" % path)
+        response = await reader.read()
+        writer.close()
+        return response
+
+    response = await get(b"/metrics")
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"pluggable_socket_connections 2\n" in response
+    response = await get(b"/other")
+    assert response.startswith(b"HTTP/1.1 404 Not Found\r\n")
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest.mock import MagicMock
+
+import websockets
+from websockets.frames import Close
+
+import pytest
+
+from pluggable.socket.frame import WireFrame
+from pluggable.socket.queue import Py__SendQueue as SendQueue
+
+from .base import AsyncMock
+
+
+def test_queue_signature():
+    with pytest.raises(TypeError):
+        SendQueue()
+    with pytest.raises(ValueError):
+        SendQueue("WS", "SEND", 3, "BAD POLICY")
+
+
+def test_queue():
+    queue = SendQueue("WS", "SEND", 3)
+    assert queue.websocket == "WS"
+    assert queue.send == "SEND"
+    assert queue.maxsize == 3
+    assert queue.policy == "disconnect"
+    assert queue.codec is None
+    assert queue.window == 0
+    assert queue.depth == 0
+    assert queue.stats == dict(depth=0, sent=0, dropped=0, coalesced=0)
+
+
+def test_queue_drop_oldest():
+    queue = SendQueue("WS", "SEND", 3, "drop-oldest")
+    for i in range(5):
+        assert queue.put(i)
+    assert [f[1] for f in queue.frames] == [2, 3, 4]
+    assert queue.stats == dict(depth=3, sent=0, dropped=2, coalesced=0)
+
+
+def test_queue_coalesce():
+    queue = SendQueue("WS", "SEND", 3, "coalesce")
+    queue.put(1, "A")
+    queue.put(2, "B")
+    queue.put(3)
+    queue.put(4, "B")
+    assert list(queue.frames) == [("A", 1), ("B", 4), (None, 3)]
+    queue.put(5, "C")
+    assert list(queue.frames) == [("B", 4), (None, 3), ("C", 5)]
+    assert queue.stats == dict(depth=3, sent=0, dropped=1, coalesced=1)
+
+
+def test_queue_disconnect():
+    websocket = MagicMock()
+    loop = MagicMock()
+    queue = SendQueue(websocket, "SEND", 2, "disconnect")
+    queue.start(loop)
+    queue.put(1)
+    queue.put(2)
+    assert not queue.put(3)
+    assert queue.closed
+    assert queue.depth == 0
+    assert (
+        [c[0] for c in websocket.close.call_args_list]
+        == [(1008, "slow consumer")])
+    assert not queue.put(4)
+    assert queue.dropped == 2
+
+
+def test_queue_close():
+    loop = MagicMock()
+    queue = SendQueue("WS", "SEND", 2)
+    queue.start(loop)
+    task = queue.task
+    assert task is loop.create_task.return_value
+    queue.put(1)
+    queue.close()
+    assert queue.closed
+    assert queue.task is None
+    assert queue.depth == 0
+    assert (
+        [c[0] for c in task.cancel.call_args_list]
+        == [()])
+
+
+@pytest.mark.asyncio
+async def test_queue_drain():
+    send = AsyncMock()
+    queue = SendQueue("WS", send, 5)
+    queue.start(asyncio.get_event_loop())
+    queue.put("FOO")
+    queue.put("BAR")
+    await asyncio.sleep(0)
+    assert (
+        [c[0] for c in send.call_args_list]
+        == [("WS", "FOO"), ("WS", "BAR")])
+    assert queue.sent == 2
+    send.side_effect = websockets.exceptions.ConnectionClosed(
+        Close(1006, "gone"), None)
+    queue.put("BAZ")
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert queue.closed
+    assert queue.sent == 2
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_queue_empty():
+    sent = asyncio.Event()
+
+    async def send(websocket, frame):
+        await sent.wait()
+
+    queue = SendQueue("WS", send, 5)
+    assert queue.empty()
+    queue.put("FOO")
+    assert not queue.empty()
+    queue.start(asyncio.get_event_loop())
+    await asyncio.sleep(0)
+    # the frame being written is not sent yet
+    assert queue.depth == 0
+    assert queue.sending
+    assert not queue.empty()
+    sent.set()
+    await asyncio.sleep(0)
+    assert not queue.sending
+    assert queue.empty()
+    queue.put("BAR")
+    queue.close()
+    assert queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_queue_writable():
+    queue = SendQueue("WS", AsyncMock(), 5)
+    await queue.writable(0)
+    for i in range(3):
+        queue.put(i)
+    task = asyncio.ensure_future(queue.writable(1))
+    await asyncio.sleep(0)
+    assert not task.done()
+    queue.start(asyncio.get_event_loop())
+    await task
+    assert queue.depth <= 1
+    task = asyncio.ensure_future(queue.writable(0))
+    queue.put(7)
+    queue.close()
+    await task
+
+
+def test_queue_next_frame():
+    codec = MagicMock()
+    queue = SendQueue("WS", "SEND", 5, "drop-oldest", codec)
+    queue.put("FOO")
+    queue.put("BAR")
+    assert queue.next_frame() == "FOO"
+    queue.window = 0.01
+    assert queue.next_frame() == "BAR"
+    assert not codec.pack.called
+    queue.put("FOO")
+    queue.put("BAR")
+    queue.put("BAZ")
+    assert queue.next_frame() == codec.pack.return_value
+    assert (
+        [c[0] for c in codec.pack.call_args_list]
+        == [(["FOO", "BAR", "BAZ"], )])
+    assert queue.depth == 0
+    # frames written as they are are batched as their messages
+    queue.put(WireFrame("FOO", b"DEFLATED", True, True))
+    queue.put("BAR")
+    queue.next_frame()
+    assert codec.pack.call_args[0] == (["FOO", "BAR"], )
+
+
+@pytest.mark.asyncio
+async def test_queue_drain_coalesced():
+    send = AsyncMock()
+    codec = MagicMock()
+    queue = SendQueue("WS", send, 5, "drop-oldest", codec, 0.01)
+    queue.start(asyncio.get_event_loop())
+    queue.put("FOO")
+    queue.put("BAR")
+    await asyncio.sleep(0)
+    assert not send.called
+    await asyncio.sleep(0.02)
+    assert (
+        [c[0] for c in send.call_args_list]
+        == [("WS", codec.pack.return_value)])
+    queue.close()
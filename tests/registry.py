@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+import pytest
+
+from pluggable.socket.registry import (
+    Py__ConnectionRegistry as ConnectionRegistry,
+    Py__RedisRegistry as RedisRegistry)
+
+from .base import AsyncMock
+
+
+class FakeRedis(object):
+    """Local stand-in for the hash and set commands of an aioredis
+    connection, storing everything as strings as Redis does
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.closed = False
+
+    async def hset(self, key, field, value):
+        self.data.setdefault(key, {})[str(field)] = str(value)
+
+    async def hget(self, key, field, encoding=None):
+        return self.data.get(key, {}).get(str(field))
+
+    async def hmget(self, key, *fields, encoding=None):
+        return [self.data.get(key, {}).get(str(field)) for field in fields]
+
+    async def hdel(self, key, field):
+        self.data.get(key, {}).pop(str(field), None)
+
+    async def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(str(member))
+
+    async def srem(self, key, member):
+        self.data.get(key, set()).discard(str(member))
+
+    async def smembers(self, key, encoding=None):
+        return list(self.data.get(key, set()))
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def test_registry_signature():
+    with pytest.raises(TypeError):
+        ConnectionRegistry()
+
+
+def test_registry():
+    registry = ConnectionRegistry("NODE")
+    assert registry.node == "NODE"
+    assert not registry.shared
+    assert registry.store == dict(connections={}, sessions={}, bound={})
+    store = {}
+    registry = ConnectionRegistry("NODE", store)
+    assert registry.shared
+    assert registry.store is store
+    assert store == dict(connections={}, sessions={}, bound={})
+
+
+def _registries():
+    store = {}
+    yield (
+        ConnectionRegistry("NODE1", store),
+        ConnectionRegistry("NODE2", store))
+    redis = FakeRedis()
+    registries = (
+        RedisRegistry("NODE1", None, "redis://REGISTRY"),
+        RedisRegistry("NODE2", None, "redis://REGISTRY"))
+    for registry in registries:
+        registry.redis = redis
+    yield registries
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("registries", list(_registries()))
+async def test_registry_routes(registries):
+    node1, node2 = registries
+    await node1.add(1)
+    await node1.add(2)
+    await node2.add(3)
+    assert (
+        await node1.locate([1, 2, 3, 4])
+        == {"NODE1": [1, 2], "NODE2": [3], None: [4]})
+    assert await node2.locate([]) == {}
+
+    await node1.bind(1, "A")
+    await node2.bind(3, "A")
+    await node1.bind(2, "B")
+    assert sorted(await node2.lookup(["A"])) == [1, 3]
+    assert sorted(await node2.lookup(["A", "B", "C"])) == [1, 2, 3]
+    await node1.bind(2, "A")
+    assert await node2.lookup(["B"]) == []
+    assert sorted(await node2.lookup(["A"])) == [1, 2, 3]
+    await node1.bind(2, None)
+    assert sorted(await node2.lookup(["A"])) == [1, 3]
+
+    await node1.remove(1)
+    assert await node2.lookup(["A"]) == [3]
+    assert await node2.locate([1]) == {None: [1]}
+
+    await node2.stop()
+    assert await node1.lookup(["A"]) == []
+    assert await node1.locate([2, 3]) == {"NODE1": [2], None: [3]}
+
+
+def test_registry_redis():
+    registry = RedisRegistry("NODE", None, "redis://REGISTRY")
+    assert registry.url == "redis://REGISTRY"
+    assert registry.prefix == "pluggable.socket"
+    assert registry.shared
+    registry = RedisRegistry("NODE", None, "redis://REGISTRY", "PREFIX")
+    assert registry.prefix == "PREFIX"
+
+
+@pytest.mark.asyncio
+async def test_registry_redis_start_stop():
+    registry = RedisRegistry("NODE", None, "redis://REGISTRY", "PREFIX")
+    redis = FakeRedis()
+    _patch = patch(
+        'pluggable.socket.registry.aioredis.create_redis',
+        new_callable=AsyncMock,
+        return_value=redis)
+    with _patch as create_m:
+        await registry.start()
+    assert (
+        [c[0] for c in create_m.call_args_list]
+        == [("redis://REGISTRY", )])
+    assert registry.redis is redis
+    await registry.add(7)
+    await registry.bind(7, "SESSION")
+    assert redis.data["PREFIX:connections"] == {"7": "NODE"}
+    assert redis.data["PREFIX:session:SESSION"] == {"7"}
+    await registry.stop()
+    assert registry.redis is None
+    assert redis.closed
+    assert redis.data["PREFIX:connections"] == {}
+    assert redis.data["PREFIX:session:SESSION"] == set()
+    assert redis.data["PREFIX:node:NODE"] == set()
+    await registry.stop()
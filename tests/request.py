@@ -6,6 +6,7 @@ from pluggable.socket.request import Py__SocketRequest as SocketRequest
 def test_request():
     request = SocketRequest()
     assert request.session is None
+    assert request.connection is None
     assert request.params == {}
     assert request.args == []
 
@@ -22,3 +23,9 @@ def test_request_params():
     assert request.session is None
     assert request.params == dict(foo=7, bar=23)
     assert request.args == []
+
+
+def test_request_connection():
+    request = SocketRequest(connection=23, params=dict(foo=7))
+    assert request.connection == 23
+    assert request.params == dict(foo=7)
@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+from time import monotonic
 from unittest.mock import patch, MagicMock
 
 import pytest
 
+import rapidjson as json
+
 from aioworker.worker import Worker
 
-from pluggable.socket.app import SocketApp
+from pluggable.socket.app import SocketApp, default_config
+from pluggable.socket.cache import cached
 from pluggable.core.exceptions import UnrecognizedCommand
+from pluggable.socket.codec import codecs
 from pluggable.socket.connection import SocketConnection
+from pluggable.socket.dispatch import Command
+from pluggable.socket.local import LocalRunner
 from pluggable.socket.runner import (
     Py__SocketRunner as SocketRunner)
 from pluggable.socket.socket import SocketWrapper
+from pluggable.socket.stream import ResponseStream
 
-from .base import AsyncMock
+from .base import AsyncMock, nested
 
 
 class _MockWorker(Worker):
@@ -26,6 +35,8 @@ def MockWorker():
 
 class MockApp(object):
     worker = 7
+    config = dict(default_config)
+    bus = MagicMock()
 
 
 class _MockApp(SocketApp):
@@ -46,6 +57,8 @@ class _MockConnection(SocketConnection):
         self.handle_session = AsyncMock(return_value=True)
         self.handle_connection = AsyncMock()
         self.connect = AsyncMock()
+        self.respond = AsyncMock()
+        self.respond_batch = AsyncMock()
 
 
 def MockConnection(runner):
@@ -64,54 +77,469 @@ def test_runner():
     app = MockApp()
     runner = SocketRunner(app)
     assert runner.app is app
+    assert runner.limiter.rate == SocketRunner.max_request_rate
+    assert runner.limiter.burst == app.config["request_burst"]
+    assert runner.limiter.session_rate == app.config["session_rate"]
+    assert runner.limiter.session_burst == app.config["session_burst"]
+    assert runner.limiter.commands == {}
+    assert runner.admission.runner is runner
+    assert runner.admission.limit == app.config["max_in_flight"]
+    assert (
+        runner.admission.global_limit
+        == app.config["max_in_flight_global"])
+    assert runner.admission.max_pending == app.config["max_pending"]
+    assert runner.admission.timeout == app.config["pending_timeout"]
+    assert runner.cache.runner is runner
+    assert runner.cache.backend is None
+    app.config = dict(
+        default_config,
+        response_cache="responses")
+    app.caches = dict(responses="RESPONSES")
+    runner = SocketRunner(app)
+    assert runner.cache.backend == "RESPONSES"
 
 
 @pytest.mark.asyncio
-async def test_runner_run(mocker):
+async def test_runner_execute(mocker):
     app = mocker.MagicMock()
+    app.config = dict(default_config)
     runner = SocketRunner(app)
+
+    async def local_foo(connection, uuid, something=None, andanother=None):
+        pass
+
     app.worker.tasks = {"FOO": 7, "BAR": 13}
-    app.local.commands = {"LOCAL_FOO": 7, "LOCAL_BAR": 13}
+    app.commands = {"LOCAL_FOO": local_foo}
+    runner.dispatch.refresh()
     connection = MockConnection(runner)
 
     with pytest.raises(TypeError):
-        await runner.run('CONNECTION')
+        await runner.execute('CONNECTION', "UUID", "FOO", {})
     with pytest.raises(UnrecognizedCommand):
-        await runner.run(connection, uuid="UUID")
+        await runner.execute(connection, "UUID", None, {})
     with pytest.raises(UnrecognizedCommand):
-        await runner.run(connection, uuid="UUID", command="BAZ")
+        await runner.execute(connection, "UUID", "BAZ", {})
     _patch = patch(
-        "pluggable.socket.runner.Py__SocketRunner.run_worker",
+        "pluggable.socket.runner.Py__SocketRunner.call_worker",
         new_callable=AsyncMock)
     with _patch as worker_m:
-        await runner.run(connection, uuid="UUID", command="FOO")
+        response = await runner.execute(
+            connection, "UUID", "FOO", dict(something=23))
+        assert response == worker_m.return_value
         assert (
             [c[0] for c in worker_m.call_args_list]
-            == [('FOO', connection, 'UUID')])
+            == [('FOO', connection, 'UUID', dict(something=23))])
+
+    app.local.call = AsyncMock()
+    response = await runner.execute(
+        connection, "UUID", "LOCAL_FOO", dict(something=23))
+    assert response == app.local.call.return_value
+    assert (
+        [c[0] for c in app.local.call.call_args_list]
+        == [(connection, 'UUID', local_foo, dict(something=23))])
+    response = await runner.execute(
+        connection, "UUID", "LOCAL_FOO", dict(unexpected=23))
+    assert response == dict(uuid="UUID", error="invalid_params")
+    assert len(app.local.call.call_args_list) == 1
+
+
+def test_runner_timeout_for(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config, command_timeout=30)
+    runner = SocketRunner(app)
+    assert runner.timeout == 30
+    assert runner.timeout_for(None) == 30
+    command = Command("FOO", MagicMock(timeout=None), False)
+    assert runner.timeout_for(command) == 30
+    assert runner.timeout_for(command, 5) == 5
+    assert runner.timeout_for(command, 0.5) == 0.5
+    # clients can only shorten it
+    assert runner.timeout_for(command, 60) == 30
+    assert runner.timeout_for(command, -1) == 30
+    assert runner.timeout_for(command, "5") == 30
+    assert runner.timeout_for(command, True) == 30
+    command = Command("FOO", MagicMock(timeout=120), False)
+    assert runner.timeout_for(command) == 120
+    assert runner.timeout_for(command, 60) == 60
+    runner.timeout = 0
+    assert runner.timeout_for(None) == 0
+    assert runner.timeout_for(None, 5) == 5
+
+
+@pytest.mark.asyncio
+async def test_runner_bounded(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    cancelled = []
+
+    async def work(seconds):
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            cancelled.append(seconds)
+            raise
+        return seconds
+
+    assert await runner.bounded(work(0), 0, "UUID") == 0
+    assert await runner.bounded(work(0.001), 1, "UUID") == 0.001
+    assert runner.timeouts == 0
+    assert (
+        await runner.bounded(work(10), 0.01, "UUID")
+        == dict(uuid="UUID", error="timeout"))
+    assert cancelled == [10]
+    assert runner.timeouts == 1
+
+
+@pytest.mark.asyncio
+async def test_runner_execute_timeout(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+
+    async def local_foo(connection, uuid):
+        pass
 
+    local_foo.timeout = 0.01
+    app.worker.tasks = {}
+    app.commands = {"LOCAL_FOO": local_foo}
+    runner.dispatch.refresh()
+    connection = MockConnection(runner)
+
+    async def call(connection, uuid, handler, params):
+        await asyncio.sleep(10)
+
+    app.local.call = call
+    assert (
+        await runner.execute(connection, "UUID", "LOCAL_FOO", {})
+        == dict(uuid="UUID", error="timeout"))
+    local_foo.timeout = 10
+    runner.dispatch.refresh()
+    assert (
+        await runner.execute(connection, "UUID", "LOCAL_FOO", {}, 0.01)
+        == dict(uuid="UUID", error="timeout"))
+    assert runner.timeouts == 2
+
+
+@pytest.mark.asyncio
+async def test_runner_execute_stream(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+
+    async def local_foo(connection, uuid):
+        pass
+
+    async def local_bar(connection, uuid):
+        pass
+
+    async def generator():
+        yield "CHUNK"
+
+    local_foo.timeout = 10
+    app.worker.tasks = {}
+    app.commands = {"LOCAL_FOO": local_foo, "LOCAL_BAR": local_bar}
+    runner.dispatch.refresh()
+    connection = MockConnection(runner)
+    stream = ResponseStream(connection, "UUID", generator())
+    app.local.call = AsyncMock(return_value=stream)
+    start = monotonic()
+    assert await runner.execute(connection, "UUID", "LOCAL_FOO", {}) is stream
+    # the stream has what is left of the command's time to finish
+    assert start + 10 <= stream.deadline <= monotonic() + 10
+    # nor is there a deadline without a timeout
+    runner.timeout = 0
+    stream = ResponseStream(connection, "UUID", generator())
+    app.local.call.return_value = stream
+    await runner.execute(connection, "UUID", "LOCAL_BAR", {})
+    assert stream.deadline == 0
+
+
+@pytest.mark.asyncio
+async def test_runner_execute_cached(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    app.loop = asyncio.get_event_loop()
+    app.bus.publish = AsyncMock()
+    runner = SocketRunner(app)
+
+    calls = []
+
+    @cached(ttl=30)
+    async def local_foo(connection, uuid, something=None):
+        calls.append(uuid)
+        return dict(answer=something)
+
+    app.worker.tasks = {}
+    app.commands = {"LOCAL_FOO": local_foo}
+    app.local = LocalRunner(app)
+    runner.dispatch.refresh()
+    connection = MockConnection(runner)
+    connection.codec = codecs["json"]
+    response = await runner.execute(
+        connection, "UUID1", "LOCAL_FOO", dict(something=23))
+    assert response == dict(uuid="UUID1", answer=23)
+    response = await runner.execute(
+        connection, "UUID2", "LOCAL_FOO", dict(something=23))
+    assert response == dict(uuid="UUID2", answer=23)
+    assert calls == ["UUID1"]
+    await runner.cache.invalidate("LOCAL_FOO")
+    await runner.execute(
+        connection, "UUID3", "LOCAL_FOO", dict(something=23))
+    assert calls == ["UUID1", "UUID3"]
+    # worker responses are cached too
+    task = mocker.MagicMock()
+    task.call = AsyncMock(return_value=7)
+    app.worker.tasks = dict(FOO=cached()(task))
+    runner.dispatch.refresh()
+    response = await runner.execute(connection, "UUID4", "FOO", {})
+    assert response == dict(uuid="UUID4", response=7)
+    response = await runner.execute(connection, "UUID5", "FOO", {})
+    assert json.loads(response.tobytes()) == dict(uuid="UUID5", response=7)
+    assert len(task.call.call_args_list) == 1
+
+
+@pytest.mark.asyncio
+async def test_runner_run(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+
+    with pytest.raises(TypeError):
+        await runner.run('CONNECTION')
+    _patches = nested(
+        patch("pluggable.socket.runner.Py__SocketRunner.execute",
+              new_callable=AsyncMock),
+        patch("pluggable.socket.runner.Py__SocketRunner.run_batch",
+              new_callable=AsyncMock))
+    with _patches as (execute_m, batch_m):
+        await runner.run(connection, uuid="UUID", command="FOO")
         await runner.run(
             connection,
             uuid="UUID",
-            command="FOO",
+            cmd="FOO",
             params=dict(something=23, andanother=73))
         assert (
-            [c[0] for c in worker_m.call_args_list]
-            == [('FOO', connection, 'UUID')] * 2)
+            [c[0] for c in execute_m.call_args_list]
+            == [(connection, 'UUID', 'FOO', {}, None),
+                (connection, 'UUID', 'FOO',
+                 {'something': 23, 'andanother': 73}, None)])
+        assert (
+            [c[0] for c in connection.respond.call_args_list]
+            == [(execute_m.return_value, True)] * 2)
+        assert (
+            [c[0][:2] for c in app.metrics.observe.call_args_list]
+            == [("execute", "FOO"), ("send", "FOO")] * 2)
+        execute_m.return_value = None
+        await runner.run(connection, uuid="UUID", command="FOO")
+        assert len(connection.respond.call_args_list) == 2
+        assert not batch_m.called
+        await runner.run(connection, uuid="UUID", batch=["ITEM"])
+        await runner.run(
+            connection, uuid="UUID", batch=["ITEM"],
+            ordered=True, combine=True)
+        assert (
+            [c[0] for c in batch_m.call_args_list]
+            == [(connection, "UUID", ["ITEM"], False, False),
+                (connection, "UUID", ["ITEM"], True, True)])
+        assert len(execute_m.call_args_list) == 3
+        # commands can opt out of compression
+        runner.dispatch.commands = dict(
+            FOO=Command("FOO", MagicMock(compress=False), False))
+        execute_m.return_value = "RESPONSE"
+        await runner.run(connection, uuid="UUID", command="FOO")
+        assert connection.respond.call_args[0] == ("RESPONSE", False)
+        # unknown commands are answered with an error
+        observed = len(app.metrics.observe.call_args_list)
+        execute_m.side_effect = UnrecognizedCommand("BAR")
+        await runner.run(connection, uuid="UUID", command="BAR")
         assert (
-            [c[1] for c in worker_m.call_args_list]
-            == [{}, {'something': 23, 'andanother': 73}])
+            connection.respond.call_args[0]
+            == (dict(uuid="UUID", error="unrecognized_command"), ))
+        assert len(app.metrics.observe.call_args_list) == observed
 
-    app.local.run = AsyncMock()
-    await runner.run(connection, uuid="UUID", command="LOCAL_FOO")
-    assert (
-        [c[0] for c in app.local.run.call_args_list]
-        == [(hash(connection), 'UUID', 'LOCAL_FOO')])
-    await runner.run(
-        connection, uuid="UUID", command="LOCAL_FOO",
-        params=dict(something=23, andanother=73))
+
+@pytest.mark.asyncio
+async def test_runner_call_worker(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+    task = mocker.MagicMock()
+    task.call = AsyncMock(return_value="RESPONSE")
+    app.worker.tasks = dict(FOO=task)
+    response = await runner.call_worker(
+        "FOO", connection, "UUID", dict(bar=7))
+    assert response == dict(uuid="UUID", response="RESPONSE")
+    request = task.call.call_args[0][0]
+    assert request.params == dict(bar=7)
+    assert request.connection == connection.id
+
+
+@pytest.mark.asyncio
+async def test_runner_call_worker_encoded(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+    task = mocker.MagicMock()
+    payload = b'{"bar": 7}'
+    task.call = AsyncMock(return_value=payload)
+    app.worker.tasks = dict(FOO=task)
+    frame = await runner.call_worker("FOO", connection, "UUID", {})
+    assert frame.payload is payload
     assert (
-        [c[0] for c in app.local.run.call_args_list]
-        == [(hash(connection), 'UUID', 'LOCAL_FOO')] * 2)
+        json.loads(frame.tobytes())
+        == dict(uuid="UUID", response=dict(bar=7)))
+
+
+@pytest.mark.asyncio
+async def test_runner_call_worker_stream(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+
+    async def generator():
+        yield "CHUNK"
+
+    iterator = generator()
+    task = mocker.MagicMock()
+    task.call = AsyncMock(return_value=iterator)
+    app.worker.tasks = dict(FOO=task)
+    stream = await runner.call_worker("FOO", connection, "UUID", {})
+    assert isinstance(stream, ResponseStream)
+    assert stream.iterator is iterator
+    assert stream.uuid == "UUID"
+    await iterator.aclose()
+
+
+@pytest.mark.asyncio
+async def test_runner_respond(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+    await runner.respond(connection, None)
+    assert not connection.respond.called
+    await runner.respond(connection, "RESPONSE")
     assert (
-        [c[1] for c in app.local.run.call_args_list]
-        == [{}, {'andanother': 73, 'something': 23}])
+        [c[0] for c in connection.respond.call_args_list]
+        == [("RESPONSE", True)])
+
+    class MockStream(ResponseStream):
+        ran = 0
+
+        async def run(self):
+            self.ran += 1
+
+    async def generator():
+        yield "CHUNK"
+
+    stream = MockStream(connection, "UUID", generator())
+    await runner.respond(connection, stream, 5)
+    assert stream.window == 5
+    assert stream.ran == 1
+    assert len(connection.respond.call_args_list) == 1
+    _patch = patch(
+        "pluggable.socket.runner.Py__SocketRunner.execute",
+        new_callable=AsyncMock,
+        return_value=stream)
+    with _patch:
+        await runner.run(connection, uuid="UUID", command="FOO", window=3)
+        assert await runner._run_item(
+            connection, dict(uuid="UUID", command="FOO"), True) is None
+    assert stream.window == 3
+    assert stream.ran == 3
+    await stream.iterator.aclose()
+
+
+@pytest.mark.asyncio
+async def test_runner_run_batch(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config)
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+    batch = [
+        dict(uuid="UUID1", command="FOO", params=dict(bar=7)),
+        dict(uuid="UUID2", cmd="NOTHING"),
+        dict(uuid="UUID3", command="MISSING", timeout=5)]
+
+    def execute(connection, uuid, command, params, timeout=None):
+        if command == "MISSING":
+            raise UnrecognizedCommand(command)
+        if command == "NOTHING":
+            return
+        return dict(uuid=uuid, response=params)
+
+    _patch = patch(
+        "pluggable.socket.runner.Py__SocketRunner.execute",
+        new_callable=AsyncMock)
+    with _patch as execute_m:
+        execute_m.side_effect = execute
+        await runner.run_batch(connection, "BATCH", batch)
+        assert (
+            sorted(c[0][0]["uuid"]
+                   for c in connection.respond.call_args_list)
+            == ["UUID1", "UUID3"])
+        assert not connection.respond_batch.called
+        await runner.run_batch(connection, "BATCH", batch, True, True)
+        assert (
+            [c[0][1:3] for c in execute_m.call_args_list[3:]]
+            == [("UUID1", "FOO"), ("UUID2", "NOTHING"),
+                ("UUID3", "MISSING")])
+        # each item carries its own timeout
+        assert (
+            [c[0][4] for c in execute_m.call_args_list[3:]]
+            == [None, None, 5])
+        assert len(connection.respond.call_args_list) == 2
+        assert (
+            [c[0] for c in connection.respond_batch.call_args_list]
+            == [("BATCH",
+                 [dict(uuid="UUID1", response=dict(bar=7)),
+                  dict(uuid="UUID3", error="unrecognized_command")])])
+
+
+@pytest.mark.asyncio
+async def test_runner_run_batch_in_flight(mocker):
+    app = mocker.MagicMock()
+    app.config = dict(default_config, max_in_flight=4)
+    app.loop = asyncio.get_event_loop()
+    runner = SocketRunner(app)
+    connection = MockConnection(runner)
+    running = []
+    peak = []
+
+    # the tests' AsyncMock does not await its side effect, so execute is
+    # replaced with a coroutine function that yields to the others
+    async def execute(self, connection, uuid, command, params, timeout=None):
+        running.append(uuid)
+        peak.append(len(running))
+        await asyncio.sleep(0)
+        running.remove(uuid)
+        return dict(uuid=uuid, response=None)
+
+    _patch = patch(
+        "pluggable.socket.runner.Py__SocketRunner.execute",
+        new=execute)
+    with _patch:
+        runner.admission.submit(
+            connection,
+            dict(uuid="BATCH",
+                 batch=[dict(uuid="UUID%s" % i, command="FOO")
+                        for i in range(100)]))
+        await asyncio.sleep(0)
+        assert connection.held == 3
+        # requests sent while the batch runs wait for a free slot
+        runner.admission.submit(
+            connection, dict(uuid="SINGLE", command="FOO"))
+        assert len(connection.pending) == 1
+        while runner.admission.running:
+            await asyncio.sleep(0)
+    assert len(peak) == 101
+    assert max(peak) == 4
+    assert connection.held == 0
+    assert connection.tasks == {}
+    assert len(connection.pending) == 0
+    assert len(connection.respond.call_args_list) == 101
@@ -1,16 +1,28 @@
 # -*- coding: utf-8 -*-
 
+from socket import IPPROTO_TCP, TCP_NODELAY
+from time import monotonic
 from unittest.mock import patch, MagicMock
 
+import rapidjson as json
 import websockets
+from websockets.frames import Close
 
 import pytest
 
 from aioworker.worker import Worker
 
 from pluggable.socket.app import SocketApp
+from pluggable.socket.bus import SocketBus
+from pluggable.socket.codec import JSONCodec
 from pluggable.socket.connection import SocketConnection
+from pluggable.socket.frame import Frame, WireFrame
+from pluggable.socket.logger import INFO
+from pluggable.socket.metrics import Metrics
+from pluggable.socket.queue import SendQueue
+from pluggable.socket.registry import ConnectionRegistry
 from pluggable.socket.socket import Py__SocketWrapper as SocketWrapper
+from pluggable.socket.supervisor import WORKER_ENV
 
 from .base import AsyncMock, nested
 
@@ -24,13 +36,62 @@ def MockWorker():
 
 
 class _MockApp(SocketApp):
-    config = dict(
-        ip='MOCKIP',
-        port=999)
+    pass
+
+
+mock_config = dict(
+    ip='MOCKIP',
+    port=999,
+    processes=1,
+    node_id=7,
+    codec='json',
+    session_cache_size=7,
+    session_cache_ttl=23.0,
+    send_concurrency=3,
+    send_queue_size=0,
+    send_queue_policy='drop-oldest',
+    coalesce_window=0.0,
+    max_subscriptions=3,
+    backlog=1024,
+    tcp_nodelay=True,
+    max_size=2 ** 20,
+    max_queue=32,
+    read_limit=2 ** 16,
+    write_limit=2 ** 16,
+    write_low_water=None,
+    compression='deflate',
+    compression_threshold=1024,
+    compression_level=6,
+    compression_shared=True,
+    ping_interval=20,
+    heartbeat_interval=0,
+    idle_timeout=0,
+    timer_tick=1.0,
+    timer_slots=8)
 
 
 def MockApp():
-    return _MockApp(MockWorker(), {})
+    app = _MockApp(MockWorker(), mock_config)
+    app.logger = MagicMock(level=20)
+    app.bus = SocketBus(app, "NODE")
+    app.registry = ConnectionRegistry("NODE")
+    app.metrics = Metrics(app)
+    return app
+
+
+class _MockRemoteBus(SocketBus):
+
+    def __init__(self, *args):
+        self.remote = True
+        self.publish = AsyncMock()
+
+
+def MockRemoteApp(store=None):
+    app = MockApp()
+    app.bus = _MockRemoteBus(app, "NODE")
+    if store is not None:
+        app.registry = ConnectionRegistry("NODE", store)
+    return app
 
 
 class _MockConnection(SocketConnection):
@@ -59,21 +120,91 @@ def test_socket(listen_m):
     assert listen_m.called
     assert socket.app == app
     assert socket.connections == {}
+    assert socket.concurrency == 3
+    assert socket.codec.name == 'json'
+    assert socket.sessions.backend is app.sessions
+    assert socket.sessions.cache.maxsize == 7
+    assert socket.sessions.cache.ttl == 23.0
+    assert socket.queue_size == 0
+    assert socket.queue_policy == 'drop-oldest'
 
 
-@patch('sys.stdout.write')
 @patch('pluggable.socket.socket.Py__SocketWrapper.listen')
-def test_socket_log(listen_m, print_m):
+def test_socket_log(listen_m):
     app = MockApp()
     socket = SocketWrapper(app)
     assert listen_m.called
     assert socket.app is app
-    expected = []
     for args in [[''], ['foo'], ['foo', 'bar', 'baz']]:
         socket.log(args)
-        expected.append(("app.socket: %s" % (' '.join(args)), ))
-        expected.append(("\n", ))
-    assert [list(a)[0] for a in print_m.call_args_list] == expected
+    socket.log(['debug'], 10)
+    assert (
+        [c[0] for c in app.logger.log.call_args_list]
+        == [(20, 'app.socket:', ('', )),
+            (20, 'app.socket:', ('foo', )),
+            (20, 'app.socket:', ('foo', 'bar', 'baz')),
+            (10, 'app.socket:', ('debug', ))])
+
+
+@pytest.mark.asyncio
+async def test_socket_send_frame():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    websocket = AsyncMock()
+    websocket.extensions = []
+    websocket._fragmented_message_waiter = None
+    await socket._send(websocket, Frame(b'[', b'1', b']'))
+    assert not websocket.send.called
+    assert (
+        [c[0][2] for c in websocket.write_frame.call_args_list]
+        == [b'[', b'1', b']'])
+
+
+@pytest.mark.asyncio
+async def test_socket_send_log():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    websocket = AsyncMock()
+    websocket.remote_address = ("IP", "PORT", 0, 0)
+    # short messages go through ``send`` also with compression negotiated
+    extension = MagicMock()
+    extension.name = "permessage-deflate"
+    websocket.extensions = [extension]
+    with patch('pluggable.socket.socket.Py__SocketWrapper.log') as log_m:
+        await socket._send(websocket, "MSG")
+        assert not log_m.called
+        app.logger.level = 10
+        await socket._send(websocket, "MSG")
+        assert (
+            [c[0] for c in log_m.call_args_list]
+            == [(['send:', 'IP', 'PORT', 'MSG'], 10)])
+    assert (
+        [c[0] for c in websocket.send.call_args_list]
+        == [("MSG", ), ("MSG", )])
+    assert app.metrics.messages_out == 2
+    assert app.metrics.bytes_out == 6
+    assert app.metrics.writes.count == 2
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper.log')
+def test_socket__log(log_m, listen_m):
+    app = MockApp()
+    app.signals = MagicMock()
+    socket = SocketWrapper(app)
+    connection = MagicMock(ip="IP", port="PORT")
+    socket._log(connection, "connect")
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(['connect:', 'IP', 'PORT'], INFO)])
+    assert (
+        [c[0] for c in app.signals.emit.call_args_list]
+        == [('socket.connect', 'IP:PORT')])
+    assert (
+        [c[0] for c in app.logger.event.call_args_list]
+        == [('connect (%s): IP PORT' % hash(socket), )])
 
 
 def test_socket_listen(mocker):
@@ -87,6 +218,11 @@ def test_socket_listen(mocker):
     assert (
         app.signals.listen.call_args_list[1][0]
         == ('auth.session.destroy', socket.on_session_destroy))
+    assert (
+        app.bus.handlers
+        == {'send': socket.on_bus_send,
+            'signal': socket.on_bus_signal,
+            'topic': socket.on_bus_topic})
 
 
 @pytest.mark.asyncio
@@ -94,14 +230,24 @@ async def test_socket_on_session_create():
     app = MockApp()
     with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
         socket = SocketWrapper(app)
-    socket.connections = {"CONNECTION": {}}
+    connection = MockConnection(socket)
+    connection.resolved = True
+    connection.connection.request_headers = {
+        'Sec-Websocket-Protocol': 'KEY1'}
+    socket.connections = {"CONNECTION": connection}
+    socket.sessions.cache.set('KEY1', None)
+    socket.sessions.cache.set('KEY2', 23)
     await socket.on_session_create(
         'on.session.create',
         session="SESSION",
         connection="CONNECTION")
-    assert (
-        socket.connections
-        == {'CONNECTION': {'session': "SESSION"}})
+    assert socket.connections == {'CONNECTION': connection}
+    assert connection.session == "SESSION"
+    assert connection.signalled
+    assert not connection.resolved
+    # the session looked up before login is no longer cached
+    assert 'KEY1' not in socket.sessions.cache
+    assert 'KEY2' in socket.sessions.cache
 
 
 @pytest.mark.asyncio
@@ -109,22 +255,37 @@ async def test_socket_on_session_destroy():
     app = MockApp()
     with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
         socket = SocketWrapper(app)
+    connection1 = MockConnection(socket)
+    connection1.resolved = True
+    connection1.connection.request_headers = {
+        'Sec-Websocket-Protocol': 'KEY1'}
+    connection2 = MockConnection(socket)
+    connection2.resolved = True
+    connection1.session, connection2.session = 7, 23
+    connection1.signalled = connection2.signalled = True
     socket.connections = {
-        "CONNECTION1": {"session": 7},
-        "CONNECTION2": {"session": 23}}
+        "CONNECTION1": connection1,
+        "CONNECTION2": connection2}
+    socket.sessions.cache.set('KEY1', 7)
+    socket.sessions.cache.set('KEY2', 23)
     await socket.on_session_destroy(
         'auth.session.destroy',
         connection="CONNECTION1")
-    assert (
-        socket.connections
-        == {'CONNECTION1': {},
-            "CONNECTION2": {"session": 23}})
+    assert connection1.session is None
+    assert not connection1.signalled
+    assert connection2.session == 23
+    assert connection2.signalled
+    assert not connection1.resolved
+    assert connection2.resolved
+    assert 'KEY1' not in socket.sessions.cache
+    assert 'KEY2' in socket.sessions.cache
 
 
+@patch('pluggable.socket.deflate.DeflateExtensionFactory')
 @patch('pluggable.socket.socket.Py__SocketWrapper.listen')
 @patch('pluggable.socket.socket.Py__SocketWrapper._log')
 @patch('pluggable.socket.socket.websockets.serve')
-def test_socket_serve(ws_m, log_m, listen_m):
+def test_socket_serve(ws_m, log_m, listen_m, factory_m):
     app = MockApp()
     socket = SocketWrapper(app)
     socket.serve()
@@ -134,6 +295,145 @@ def test_socket_serve(ws_m, log_m, listen_m):
     assert (
         [c[0] for c in ws_m.call_args_list]
         == [(socket.pipe, socket.app.config["ip"], socket.app.config["port"])])
+    transport = dict(
+        backlog=1024,
+        max_size=2 ** 20,
+        max_queue=32,
+        read_limit=2 ** 16,
+        write_limit=2 ** 16,
+        compression='deflate',
+        extensions=[factory_m.return_value],
+        ping_interval=20)
+    assert ws_m.call_args[1] == dict(reuse_port=False, **transport)
+    app.config["processes"] = 3
+    app.config["compression"] = None
+    socket = SocketWrapper(app)
+    socket.serve()
+    assert (
+        ws_m.call_args[1]
+        == dict(transport,
+                reuse_port=True,
+                compression=None,
+                extensions=None))
+
+
+@patch('pluggable.socket.socket.inherited')
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper._log')
+@patch('pluggable.socket.socket.websockets.serve')
+def test_socket_serve_inherited(ws_m, log_m, listen_m, inherited_m):
+    app = MockApp()
+    app.config["compression"] = None
+    socket = SocketWrapper(app)
+    assert socket.serve() is ws_m.return_value
+    # the listening socket of the previous process is served instead
+    assert (
+        [c[0] for c in ws_m.call_args_list]
+        == [(socket.pipe, )])
+    assert ws_m.call_args[1]["sock"] is inherited_m.return_value
+    assert "reuse_port" not in ws_m.call_args[1]
+    assert ws_m.call_args[1]["backlog"] == 1024
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+def test_socket_deflate(listen_m):
+    app = MockApp()
+    app.config["compression_threshold"] = 23
+    app.config["compression_level"] = 1
+    app.config["compression_shared"] = False
+    socket = SocketWrapper(app)
+    assert socket.deflate.threshold == 23
+    assert socket.deflate.level == 1
+    assert not socket.deflate.shared
+    app.config["compression"] = None
+    assert SocketWrapper(app).deflate is None
+
+
+def MockDeflateWebsocket(takeover=False):
+    websocket = MagicMock()
+    extension = MagicMock(
+        local_no_context_takeover=not takeover,
+        local_max_window_bits=None)
+    extension.name = "permessage-deflate"
+    websocket.extensions = [extension]
+    websocket._fragmented_message_waiter = None
+    websocket.ensure_open = AsyncMock()
+    websocket.drain = AsyncMock()
+    websocket.send = AsyncMock()
+    return websocket
+
+
+@pytest.mark.asyncio
+async def test_socket_send_deflate():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    websocket = MockDeflateWebsocket()
+    # messages to a single connection go through ``send``, whatever
+    # their size
+    await socket._send(websocket, "MSG")
+    message = "x" * 2048
+    await socket._send(websocket, message)
+    assert (
+        [c[0] for c in websocket.send.call_args_list]
+        == [("MSG", ), (message, )])
+    assert not websocket.transport.write.called
+    # shared compressed frames are written as they are
+    frame = socket.deflate.compress(message)
+    await socket._send(websocket, frame)
+    assert (
+        [c[0] for c in websocket.transport.write.call_args_list]
+        == [(frame.header, ), (frame.data, )])
+    assert app.metrics.bytes_out == 3 + 2048 + len(frame.data)
+    # connections that keep their context are sent the message
+    websocket = MockDeflateWebsocket(takeover=True)
+    await socket._send(websocket, frame)
+    assert websocket.send.call_args[0] == (message, )
+    # and messages sent uncompressed go through ``send``, with the
+    # extension's compression turned off
+    extension = websocket.extensions[0]
+    extension.plain = False
+
+    async def send(msg):
+        assert extension.plain
+    websocket.send.side_effect = send
+    await socket._send(websocket, socket.deflate.plain(message))
+    assert websocket.send.call_args[0] == (message, )
+    assert not extension.plain
+    assert not websocket.transport.write.called
+    socket.deflate = None
+    websocket = AsyncMock()
+    await socket._send(websocket, frame)
+    assert websocket.send.call_args[0] == (message, )
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+def test_socket_tune(listen_m):
+    app = MockApp()
+    socket = SocketWrapper(app)
+    websocket = MagicMock()
+    sock = websocket.transport.get_extra_info.return_value
+    socket.tune(websocket)
+    assert (
+        [c[0] for c in websocket.transport.get_extra_info.call_args_list]
+        == [("socket", )])
+    assert (
+        [c[0] for c in sock.setsockopt.call_args_list]
+        == [(IPPROTO_TCP, TCP_NODELAY, 1)])
+    # the low water mark is left to websockets
+    assert not websocket.transport.set_write_buffer_limits.called
+    app.config["tcp_nodelay"] = None
+    app.config["write_low_water"] = 1024
+    socket.tune(websocket)
+    assert len(sock.setsockopt.call_args_list) == 1
+    assert (
+        [c[0]
+         for c
+         in websocket.transport.set_write_buffer_limits.call_args_list]
+        == [(2 ** 16, 1024)])
+    websocket.transport.get_extra_info.return_value = None
+    app.config["tcp_nodelay"] = False
+    socket.tune(websocket)
 
 
 @patch('pluggable.socket.socket.Py__SocketWrapper.listen')
@@ -142,14 +442,68 @@ def test_socket_connect(log_m, listen_m):
     app = MockApp()
     socket = SocketWrapper(app)
     connection = socket.connect('WS', 'PATH')
+    assert connection.codec is socket.codec
+    assert connection.id == (7 << 40) + 1
     assert (
         [c[0] for c in log_m.call_args_list]
         == [(connection, 'connect')])
+    connection = socket.connect('WS', '/?codec=msgpack')
+    assert connection.codec.name == 'msgpack'
+    assert connection.id == (7 << 40) + 2
+    assert socket.connections[connection.id] is connection
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+def test_socket_next_id(listen_m):
+    app = MockApp()
+    socket = SocketWrapper(app)
+    assert socket.node_prefix == 7 << 40
+    assert [socket.next_id() for _ in range(3)] == [
+        (7 << 40) + 1, (7 << 40) + 2, (7 << 40) + 3]
+    app.config["node_id"] = 0x7fffff + 2
+    assert SocketWrapper(app).node_prefix == 1 << 40
+    # worker processes each take their own id from the configured one
+    app.config = dict(app.config, node_id=7, processes=4)
+    with patch.dict('pluggable.socket.socket.environ', {WORKER_ENV: "3"}):
+        assert SocketWrapper(app).node_prefix == 31 << 40
+    with patch.dict('pluggable.socket.socket.environ', {WORKER_ENV: "0"}):
+        assert SocketWrapper(app).node_prefix == 28 << 40
+    app.config["node_id"] = None
+    with patch('pluggable.socket.socket.urandom', return_value=b"\0\0\x17"):
+        socket = SocketWrapper(app)
+    assert socket.node_prefix == 23 << 40
+    # ids fit a signed 64-bit int
+    socket.node_prefix = 0x7fffff << 40
+    socket.last_id = (1 << 40) - 2
+    assert socket.next_id() == (1 << 63) - 1
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper._log')
+def test_socket_connect_queue(log_m, listen_m):
+    app = MockApp()
+    app.loop = MagicMock()
+    socket = SocketWrapper(app)
+    socket.queue_size = 23
+    connection = socket.connect('WS', 'PATH')
+    queue = connection.queue
+    assert isinstance(queue, SendQueue)
+    assert queue.websocket == 'WS'
+    assert queue.send == socket._send
+    assert queue.maxsize == 23
+    assert queue.policy == 'drop-oldest'
+    assert queue.codec is connection.codec
+    assert queue.window == 0
+    assert queue.task is app.loop.create_task.return_value
     assert (
-        socket.connections
-        == {hash(connection):
-            {'connection': connection,
-             'socket': connection.connection}})
+        [c[0][0].cr_code.co_name
+         for c in app.loop.create_task.call_args_list]
+        == ["drain"])
+    app.loop.create_task.call_args[0][0].close()
+    socket.disconnect(connection)
+    assert queue.closed
+    assert queue.task is None
+    assert socket.connections == {}
 
 
 @patch('pluggable.socket.socket.Py__SocketWrapper.listen')
@@ -159,17 +513,145 @@ def test_socket_disconnect(log_m, listen_m):
     socket = SocketWrapper(app)
     connection1 = SocketConnection(socket, 'SOCKETX', 'PATH')
     connection2 = SocketConnection(socket, 'SOCKETY', 'PATH')
-    socket.connections[hash(connection1)] = 7
-    socket.connections[hash(connection2)] = 23
+    connection1.id, connection2.id = 1, 2
+    socket.connections[1] = 7
+    socket.connections[2] = 23
+    socket.topics.subscribe(1, "FOO")
+    socket.topics.subscribe(2, "FOO")
     socket.disconnect(connection1)
-    assert (
-        socket.connections
-        == {hash(connection2): 23})
+    assert socket.connections == {2: 23}
+    assert socket.topics.match("FOO") == {2}
     assert (
         [c[0] for c in log_m.call_args_list]
         == [(connection1, 'disconnect')])
 
 
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+def test_socket_wheel(listen_m):
+    app = MockApp()
+    socket = SocketWrapper(app)
+    assert socket.wheel is None
+    app.config["idle_timeout"] = 60
+    app.config["timer_tick"] = 0.5
+    socket = SocketWrapper(app)
+    assert socket.idle_timeout == 60
+    assert socket.heartbeat_interval == 0
+    assert socket.wheel.tick == 0.5
+    assert socket.wheel.size == 8
+    assert socket.wheel.callback == socket.on_idle
+    assert socket.wheel.logger is app.logger
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+def test_socket_idle_check(listen_m):
+    app = MockApp()
+    socket = SocketWrapper(app)
+    socket.heartbeat_interval = 10
+    assert socket.idle_check() == 10
+    assert socket.idle_check(4) == 6
+    # heartbeats are repeated while the connection stays idle
+    assert socket.idle_check(12) == 10
+    socket.idle_timeout = 15
+    assert socket.idle_check() == 10
+    assert socket.idle_check(12) == 3
+    socket.heartbeat_interval = 0
+    assert socket.idle_check() == 15
+    assert socket.idle_check(12) == 3
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper._log')
+def test_socket_connect_wheel(log_m, listen_m):
+    app = MockApp()
+    app.config["heartbeat_interval"] = 10
+    socket = SocketWrapper(app)
+    # the socket reads the same clock as ``time.monotonic``
+    before = monotonic()
+    connection = socket.connect('WS', 'PATH')
+    assert before <= connection.last_seen <= monotonic()
+    assert socket.wheel.timers == {connection.id: 2}
+    socket.disconnect(connection)
+    assert len(socket.wheel) == 0
+
+
+@pytest.mark.asyncio
+async def test_socket_on_idle():
+    app = MockApp()
+    app.loop = MagicMock()
+    app.config["heartbeat_interval"] = 10
+    app.config["idle_timeout"] = 25
+    _patches = nested(
+        patch('pluggable.socket.socket.Py__SocketWrapper.listen'),
+        patch('pluggable.socket.socket.Py__SocketWrapper._log'),
+        patch('pluggable.socket.socket.Py__SocketWrapper.reap'))
+
+    with _patches as (listen_m, log_m, reap_m):
+        socket = SocketWrapper(app)
+        websocket = MagicMock()
+        websocket.send = AsyncMock()
+        connection = socket.connect(websocket, 'PATH')
+        # active since it was scheduled
+        connection.last_seen = monotonic() - 4
+        socket.on_idle(connection.id)
+        assert not app.loop.create_task.called
+        assert socket.wheel.timers == {connection.id: 6}
+        connection.last_seen = monotonic() - 12
+        socket.on_idle(connection.id)
+        assert len(app.loop.create_task.call_args_list) == 1
+        await app.loop.create_task.call_args[0][0]
+        assert len(websocket.send.call_args_list) == 1
+        heartbeat = json.loads(websocket.send.call_args[0][0])
+        assert list(heartbeat) == ["heartbeat"]
+        assert 12 <= heartbeat["heartbeat"] < 13
+        assert socket.wheel.timers == {connection.id: 10 % 8}
+        connection.last_seen = monotonic() - 25
+        socket.on_idle(connection.id)
+        assert (
+            [c[0] for c in reap_m.call_args_list]
+            == [(connection, )])
+        # not rescheduled
+        assert socket.wheel.timers == {connection.id: 10 % 8}
+        assert len(app.loop.create_task.call_args_list) == 1
+        # already disconnected
+        socket.on_idle(23)
+    assert len(reap_m.call_args_list) == 1
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper.log')
+def test_socket_reap(log_m, listen_m):
+    app = MockApp()
+    socket = SocketWrapper(app)
+    connection = SocketConnection(socket, MagicMock(), 'PATH')
+    socket.reap(connection)
+    assert socket.reaped == 1
+    assert connection.connection.transport.abort.called
+    assert (
+        [c[0] for c in log_m.call_args_list]
+        == [(['reap:', connection.ip, connection.port], INFO)])
+
+
+@patch('pluggable.socket.socket.Py__SocketWrapper.listen')
+@patch('pluggable.socket.socket.Py__SocketWrapper._log')
+def test_socket_connect_registry(log_m, listen_m):
+    app = MockApp()
+    app.loop = MagicMock()
+    app.registry = MagicMock(shared=True)
+    socket = SocketWrapper(app)
+    connection = socket.connect('WS', 'PATH')
+    socket.disconnect(connection)
+    assert (
+        [c[0] for c in app.registry.add.call_args_list]
+        == [(connection.id, )])
+    assert (
+        [c[0] for c in app.registry.remove.call_args_list]
+        == [(connection.id, )])
+    assert (
+        [c[0] for c in app.loop.create_task.call_args_list]
+        == [(app.registry.add.return_value, ),
+            (app.registry.remove.return_value, )])
+
+
 @pytest.mark.asyncio
 async def test_socket_pipe(mocker):
     app = MockApp()
@@ -177,21 +659,29 @@ async def test_socket_pipe(mocker):
         socket = SocketWrapper(app)
     _patches = nested(
         patch('pluggable.socket.socket.Py__SocketWrapper.disconnect'),
-        patch('pluggable.socket.socket.Py__SocketWrapper.connect'))
-    with _patches as (disconnect_m, connect_m):
+        patch('pluggable.socket.socket.Py__SocketWrapper.connect'),
+        patch('pluggable.socket.socket.Py__SocketWrapper.tune'))
+    with _patches as (disconnect_m, connect_m, tune_m):
         connection = MockConnection(socket)
         connect_m.return_value = connection
         await socket.pipe('WS', 'PATH')
+        assert (
+            [c[0] for c in tune_m.call_args_list]
+            == [('WS', )])
         assert (
             [c[0] for c in connection.connect.call_args_list]
             == [()])
         assert (
             [c[0] for c in connect_m.call_args_list]
             == [('WS', 'PATH')])
+        assert (
+            [c[0] for c in disconnect_m.call_args_list]
+            == [(connection, )])
 
         class FailingSocketConnection(SocketConnection):
             async def connect(self, *args, **kwargs):
-                raise websockets.exceptions.ConnectionClosed(404, 'had enough')
+                raise websockets.exceptions.ConnectionClosed(
+                    Close(404, 'had enough'), None)
         connect_m.return_value = FailingSocketConnection(
             socket, 'SOCKETX', 'PATH')
         await socket.pipe('WS', 'PATH')
@@ -200,4 +690,424 @@ async def test_socket_pipe(mocker):
             == [('WS', 'PATH'), ('WS', 'PATH')])
         assert (
             [c[0] for c in disconnect_m.call_args_list]
-            == [(connect_m.return_value, )])
+            == [(connection, ), (connect_m.return_value, )])
+
+        class BrokenSocketConnection(SocketConnection):
+            async def connect(self, *args, **kwargs):
+                raise TypeError("bad message")
+        connect_m.return_value = BrokenSocketConnection(
+            socket, 'SOCKETY', 'PATH')
+        with pytest.raises(TypeError):
+            await socket.pipe('WS', 'PATH')
+        assert (
+            disconnect_m.call_args_list[-1][0]
+            == (connect_m.return_value, ))
+        assert len(disconnect_m.call_args_list) == 3
+
+
+@pytest.mark.asyncio
+async def test_socket_send():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    _patches = nested(
+        patch('pluggable.socket.socket.Py__SocketWrapper.log'),
+        patch('pluggable.socket.socket.Py__SocketWrapper.fanout',
+              new_callable=AsyncMock))
+    with _patches as (log_m, fanout_m):
+        assert await socket.send({"foo": 7}) == {}
+        assert (
+            [c[0] for c in log_m.call_args_list]
+            == [(['failed sending, nothing connected!'], INFO)])
+        assert not fanout_m.called
+
+        socket.connections = {1: {}, 2: {}, 3: {}}
+        result = await socket.send({"foo": 7})
+        assert result == fanout_m.return_value
+        result = await socket.send({"foo": 7}, [2, 3])
+        assert (
+            [c[0] for c in fanout_m.call_args_list]
+            == [({"foo": 7}, [1, 2, 3], None),
+                ({"foo": 7}, [2, 3], None)])
+
+
+@pytest.mark.asyncio
+async def test_socket_send_remote():
+    app = MockRemoteApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    _patches = nested(
+        patch('pluggable.socket.socket.Py__SocketWrapper.log'),
+        patch('pluggable.socket.socket.Py__SocketWrapper.fanout',
+              new_callable=AsyncMock))
+    with _patches as (log_m, fanout_m):
+        assert await socket.send({"foo": 7}) == {}
+        socket.connections = {1: {}, 2: {}}
+        await socket.send({"foo": 7})
+        await socket.send({"foo": 7}, [2, 3], "KEY")
+        await socket.send({"foo": 7}, [2])
+    assert (
+        [c[0] for c in app.bus.publish.call_args_list]
+        == [("send", dict(msg={"foo": 7}, connections=None, key=None)),
+            ("send", dict(msg={"foo": 7}, connections=None, key=None)),
+            ("send", dict(msg={"foo": 7}, connections=[3], key="KEY"))])
+    assert (
+        [c[0] for c in fanout_m.call_args_list]
+        == [({"foo": 7}, [1, 2], None),
+            ({"foo": 7}, [2], "KEY"),
+            ({"foo": 7}, [2], None)])
+
+
+@pytest.mark.asyncio
+async def test_socket_send_routed():
+    store = {}
+    app = MockRemoteApp(store)
+    other = ConnectionRegistry("OTHER", store)
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    await app.registry.add(1)
+    await other.add(2)
+    await other.add(3)
+    socket.connections = {1: {}}
+    _patch = patch(
+        'pluggable.socket.socket.Py__SocketWrapper.fanout',
+        new_callable=AsyncMock)
+    with _patch as fanout_m:
+        await socket.send("MSG", [1, 2, 3, 4], "KEY")
+        assert await socket.send("MSG", [2]) == {}
+    assert (
+        [c[0] for c in app.bus.publish.call_args_list]
+        == [("send", dict(msg="MSG", connections=[2, 3], key="KEY"), "OTHER"),
+            ("send", dict(msg="MSG", connections=[2], key=None), "OTHER")])
+    assert (
+        [c[0] for c in fanout_m.call_args_list]
+        == [("MSG", [1, 4], "KEY")])
+
+
+@pytest.mark.asyncio
+async def test_socket_send_sessions():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.connections = {
+        i: SocketConnection(socket, MagicMock(), 'PATH')
+        for i in range(1, 4)}
+    socket.connections[1].session = "A"
+    socket.connections[2].session = "B"
+    _patch = patch(
+        'pluggable.socket.socket.Py__SocketWrapper.send',
+        new_callable=AsyncMock)
+    with _patch as send_m:
+        assert await socket.send_sessions("MSG", ["C"]) == {}
+        await socket.send_sessions("MSG", ["A", "B"], "KEY")
+        app.registry = ConnectionRegistry("NODE", {})
+        await app.registry.bind(7, "A")
+        await socket.send_sessions("MSG", ["A"])
+    assert (
+        [c[0] for c in send_m.call_args_list]
+        == [("MSG", [1, 2], "KEY"),
+            ("MSG", [7], None)])
+
+
+@pytest.mark.asyncio
+async def test_socket_session_signals_routed():
+    store = {}
+    app = MockRemoteApp(store)
+    other = ConnectionRegistry("OTHER", store)
+    await other.add("ELSEWHERE")
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    connection = MockConnection(socket)
+    socket.connections = {"CONNECTION": connection}
+    await socket.on_session_create(
+        'auth.session.create',
+        session="SESSION",
+        connection="ELSEWHERE")
+    await socket.on_session_create(
+        'auth.session.create',
+        session="SESSION",
+        connection="CONNECTION")
+    assert (
+        [c[0] for c in app.bus.publish.call_args_list]
+        == [("signal",
+             dict(signal='auth.session.create',
+                  connection="ELSEWHERE",
+                  session="SESSION"),
+             "OTHER")])
+    assert await app.registry.lookup(["SESSION"]) == ["CONNECTION"]
+    connection.connection.request_headers = {}
+    await socket.on_session_destroy(
+        'auth.session.destroy',
+        connection="CONNECTION")
+    assert await app.registry.lookup(["SESSION"]) == []
+
+
+@pytest.mark.asyncio
+async def test_socket_on_bus_send():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.connections = {1: {}, 2: {}}
+    _patch = patch(
+        'pluggable.socket.socket.Py__SocketWrapper.fanout',
+        new_callable=AsyncMock)
+    with _patch as fanout_m:
+        await socket.on_bus_send(dict(msg="MSG", connections=None))
+        await socket.on_bus_send(
+            dict(msg="MSG", connections=[2, 3], key="KEY"))
+        await socket.on_bus_send(dict(msg="MSG", connections=[3]))
+    assert (
+        [c[0] for c in fanout_m.call_args_list]
+        == [("MSG", [1, 2], None),
+            ("MSG", [2], "KEY")])
+
+
+@pytest.mark.asyncio
+async def test_socket_session_signals_remote():
+    app = MockRemoteApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    connection = MockConnection(socket)
+    connection.resolved = True
+    socket.connections = {"CONNECTION": connection}
+    await socket.on_session_create(
+        'auth.session.create',
+        session="SESSION",
+        connection="ELSEWHERE")
+    await socket.on_session_destroy(
+        'auth.session.destroy',
+        connection="ELSEWHERE")
+    assert (
+        [c[0] for c in app.bus.publish.call_args_list]
+        == [("signal",
+             dict(signal='auth.session.create',
+                  connection="ELSEWHERE",
+                  session="SESSION"),
+             None),
+            ("signal",
+             dict(signal='auth.session.destroy',
+                  connection="ELSEWHERE"),
+             None)])
+    assert connection.session is None
+    assert connection.resolved
+
+    await socket.on_bus_signal(
+        dict(signal='auth.session.create',
+             connection="ELSEWHERE",
+             session="SESSION"))
+    await socket.on_bus_signal(
+        dict(signal='auth.session.create',
+             connection="CONNECTION",
+             session="SESSION"))
+    assert connection.session == "SESSION"
+    assert not connection.resolved
+    await socket.on_bus_signal(
+        dict(signal='auth.session.destroy',
+             connection="CONNECTION"))
+    assert connection.session is None
+    assert len(app.bus.publish.call_args_list) == 2
+
+
+@pytest.mark.asyncio
+async def test_socket_fanout():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    sent = []
+
+    class MockWebsocket(object):
+
+        def __init__(self, name, fails=False):
+            self.name = name
+            self.fails = fails
+            self.remote_address = ("IP", name)
+
+        async def send(self, msg):
+            if self.fails:
+                raise websockets.exceptions.ConnectionClosed(
+                    Close(1006, "gone"), None)
+            sent.append((self.name, msg))
+
+    socket.connections = {}
+    for i in range(10):
+        connection = SocketConnection(
+            socket, MockWebsocket(i, fails=i == 3), 'PATH')
+        socket.connections[i] = connection
+    with patch('pluggable.socket.socket.Py__SocketWrapper.log') as log_m:
+        failures = await socket.fanout("MSG", list(range(12)))
+    assert sorted(sent) == [(i, "MSG") for i in range(10) if i != 3]
+    assert sorted(failures) == [3, 10, 11]
+    assert isinstance(
+        failures[3],
+        websockets.exceptions.ConnectionClosed)
+    assert isinstance(failures[10], KeyError)
+    assert (
+        [c[0][0][:2] for c in log_m.call_args_list
+         if c[0][0][0] == 'failed sending:']
+        == [['failed sending:', 3],
+            ['failed sending:', 10],
+            ['failed sending:', 11]])
+
+
+@pytest.mark.asyncio
+async def test_socket_fanout_queued():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.queue_size = 5
+    socket.connections = {}
+    for i in range(3):
+        connection = SocketConnection(socket, MagicMock(), 'PATH')
+        connection.queue = MagicMock()
+        socket.connections[i] = connection
+    failures = await socket.fanout("MSG", [0, 1, 2], "KEY")
+    assert failures == {}
+    for i in range(3):
+        queue = socket.connections[i].queue
+        assert (
+            [c[0] for c in queue.put.call_args_list]
+            == [("MSG", "KEY")])
+        assert not socket.connections[i].connection.send.called
+        assert socket.connections[i].sent == 1
+
+
+@pytest.mark.asyncio
+async def test_socket_fanout_deflate():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.queue_size = 5
+    socket.connections = {}
+    peers = [
+        MockDeflateWebsocket(),
+        MockDeflateWebsocket(),
+        MockDeflateWebsocket(takeover=True),
+        MagicMock(extensions=[])]
+    for i, websocket in enumerate(peers):
+        connection = SocketConnection(socket, websocket, 'PATH')
+        connection.queue = MagicMock()
+        socket.connections[i] = connection
+    msg = dict(items=["item"] * 1000)
+    await socket.fanout(msg, [0, 1, 2, 3])
+    frames = [
+        socket.connections[i].queue.put.call_args[0][0]
+        for i in range(4)]
+    # compressed once, for the connections that can share it
+    assert socket.deflate.compressed == 1
+    assert isinstance(frames[0], WireFrame)
+    assert frames[0].compressed
+    assert frames[1] is frames[0]
+    assert frames[2] == frames[3] == frames[0].message
+    await socket.fanout(dict(short=True), [0, 1, 2, 3])
+    assert socket.deflate.compressed == 1
+    assert (
+        [socket.connections[i].queue.put.call_args[0][0] for i in range(4)]
+        == ['{"short":true}'] * 4)
+
+
+@pytest.mark.asyncio
+async def test_socket_fanout_codecs():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.queue_size = 5
+    socket.connections = {}
+
+    class MockCodec(JSONCodec):
+
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, msg):
+            self.encoded.append(msg)
+            return "FRAME%s" % id(self)
+
+    codecs = [MockCodec(), MockCodec()]
+    for i in range(4):
+        connection = SocketConnection(socket, MagicMock(), 'PATH')
+        connection.queue = MagicMock()
+        connection.codec = codecs[i % 2]
+        socket.connections[i] = connection
+    await socket.fanout({"foo": 7}, [0, 1, 2, 3])
+    for codec in codecs:
+        assert codec.encoded == [{"foo": 7}]
+    for i in range(4):
+        queue = socket.connections[i].queue
+        assert (
+            [c[0] for c in queue.put.call_args_list]
+            == [("FRAME%s" % id(codecs[i % 2]), None)])
+
+
+@pytest.mark.asyncio
+async def test_socket_subscribe():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    assert (
+        socket.builtins
+        == dict(subscribe=socket.subscribe,
+                unsubscribe=socket.unsubscribe,
+                stats=app.metrics.stats))
+    for topic in ("", "FOO*BAR", "**", 7, None):
+        assert (
+            await socket.subscribe(1, "UUID", topic)
+            == dict(error="invalid_topic"))
+    assert (
+        await socket.subscribe(1, "UUID", "FOO")
+        == dict(subscribed="FOO"))
+    assert (
+        await socket.subscribe(1, "UUID", "BAR.*")
+        == dict(subscribed="BAR.*"))
+    assert (
+        await socket.subscribe(1, "UUID", "FOO")
+        == dict(subscribed="FOO"))
+    assert (
+        await socket.subscribe(1, "UUID", "BAZ")
+        == dict(subscribed="BAZ"))
+    assert (
+        await socket.subscribe(1, "UUID", "OTHER")
+        == dict(error="too_many_subscriptions"))
+    assert socket.topics.match("BAR.7") == {1}
+    assert (
+        await socket.unsubscribe(1, "UUID", "BAR.*")
+        == dict(unsubscribed="BAR.*"))
+    assert (
+        await socket.unsubscribe(1, "UUID", "BAR.*")
+        == dict(unsubscribed="BAR.*"))
+    for topic in (7, None):
+        assert (
+            await socket.unsubscribe(1, "UUID", topic)
+            == dict(error="invalid_topic"))
+    assert socket.topics.match("BAR.7") == set()
+    assert socket.topics.subscriptions == {1: {"FOO", "BAZ"}}
+
+
+@pytest.mark.asyncio
+async def test_socket_publish():
+    app = MockApp()
+    with patch('pluggable.socket.socket.Py__SocketWrapper.listen'):
+        socket = SocketWrapper(app)
+    socket.topics.subscribe(1, "news.sport")
+    socket.topics.subscribe(2, "news.*")
+    socket.topics.subscribe(3, "weather")
+    _patch = patch(
+        'pluggable.socket.socket.Py__SocketWrapper.fanout',
+        new_callable=AsyncMock)
+    with _patch as fanout_m:
+        assert await socket.publish("sport", "MSG") == {}
+        await socket.publish("news.sport", "MSG", "KEY")
+        await socket.publish("news.weather", "MSG")
+        await socket.on_bus_topic(dict(topic="weather", msg="MSG"))
+        await socket.on_bus_topic(dict(topic="sport", msg="MSG"))
+        app.bus = _MockRemoteBus(app, "NODE")
+        await socket.publish("weather", "MSG")
+    assert (
+        [(c[0][0], sorted(c[0][1]), c[0][2])
+         for c in fanout_m.call_args_list]
+        == [("MSG", [1, 2], "KEY"),
+            ("MSG", [2], None),
+            ("MSG", [3], None),
+            ("MSG", [3], None)])
+    assert (
+        [c[0] for c in app.bus.publish.call_args_list]
+        == [("topic", dict(topic="weather", msg="MSG", key=None))])
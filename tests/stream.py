@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from time import monotonic
+from unittest.mock import MagicMock
+
+import pytest
+
+from aioworker.worker import Worker
+
+from pluggable.socket.app import SocketApp
+from pluggable.socket.codec import codecs
+from pluggable.socket.connection import SocketConnection
+from pluggable.socket.queue import SendQueue
+from pluggable.socket.socket import SocketWrapper
+from pluggable.socket.stream import (
+    streamable,
+    Py__ResponseStream as ResponseStream)
+
+from .base import AsyncMock
+
+
+class _MockWorker(Worker):
+    pass
+
+
+def MockWorker():
+    return _MockWorker("BROKER")
+
+
+class _MockApp(SocketApp):
+    pass
+
+
+def MockApp():
+    app = _MockApp(MockWorker(), {})
+    app.logger = MagicMock()
+    app.runner = MagicMock(timeouts=0)
+    return app
+
+
+class _MockSocketWrapper(SocketWrapper):
+
+    def __init__(self, app):
+        pass
+
+
+class _MockConnection(SocketConnection):
+
+    def __init__(self, *args):
+        self.written = []
+
+    async def write(self, frame, key=None):
+        self.written.append(codecs["json"].decode(frame))
+
+
+def MockConnection():
+    return _MockConnection(
+        _MockSocketWrapper(MockApp()), "CONNECTION", "PATH")
+
+
+async def items(count, fail=False, closed=None):
+    try:
+        for i in range(count):
+            yield i
+            await asyncio.sleep(0)
+        if fail:
+            raise ValueError("FAIL")
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def test_stream_signature():
+    with pytest.raises(TypeError):
+        ResponseStream()
+
+
+def test_streamable():
+    assert streamable(items(1))
+    assert not streamable([1, 2])
+    assert not streamable(MagicMock())
+    assert not streamable(None)
+
+
+def test_stream():
+    connection = MockConnection()
+    iterator = items(3)
+    stream = ResponseStream(connection, "UUID", iterator)
+    assert stream.connection is connection
+    assert stream.uuid == "UUID"
+    assert stream.iterator is iterator
+    assert stream.window == 0
+    assert stream.seq == 0
+    assert stream.acked == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_run():
+    connection = MockConnection()
+    closed = []
+    stream = ResponseStream(connection, "UUID", items(3, closed=closed))
+    await stream.run()
+    assert (
+        connection.written
+        == [dict(uuid="UUID", seq=1, chunk=0),
+            dict(uuid="UUID", seq=2, chunk=1),
+            dict(uuid="UUID", seq=3, chunk=2),
+            dict(uuid="UUID", seq=3, done=True)])
+    assert closed == [True]
+    assert connection.streams == {}
+    # clients may use numeric uuids
+    stream = ResponseStream(connection, 7, items(1))
+    await stream.run()
+    assert connection.written[-1] == dict(uuid=7, seq=1, done=True)
+
+
+@pytest.mark.asyncio
+async def test_stream_run_fail():
+    connection = MockConnection()
+    stream = ResponseStream(connection, "UUID", items(1, fail=True))
+    await stream.run()
+    assert (
+        connection.written
+        == [dict(uuid="UUID", seq=1, chunk=0),
+            dict(uuid="UUID", seq=1, error="stream_failed")])
+    assert (
+        connection.app.logger.log.call_args[0][:2]
+        == (40, 'app.stream:'))
+
+
+@pytest.mark.asyncio
+async def test_stream_window():
+    connection = MockConnection()
+    stream = ResponseStream(connection, "UUID", items(5), 2)
+    task = asyncio.ensure_future(stream.run())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert connection.streams == {"UUID": stream}
+    assert [m.get("chunk") for m in connection.written] == [0, 1]
+    stream.ack(1)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert [m.get("chunk") for m in connection.written] == [0, 1, 2]
+    # stale acks are ignored
+    stream.ack(0)
+    assert stream.acked == 1
+    stream.ack(5)
+    await task
+    assert [m.get("chunk") for m in connection.written] == [
+        0, 1, 2, 3, 4, None]
+    assert connection.written[-1] == dict(uuid="UUID", seq=5, done=True)
+
+
+@pytest.mark.asyncio
+async def test_stream_cancel():
+    connection = MockConnection()
+    closed = []
+    stream = ResponseStream(
+        connection, "UUID", items(5, closed=closed), 1)
+    task = asyncio.ensure_future(stream.run())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert [m.get("chunk") for m in connection.written] == [0]
+    assert closed == [True]
+    assert connection.streams == {}
+
+
+@pytest.mark.asyncio
+async def test_stream_deadline():
+    connection = MockConnection()
+    closed = []
+
+    async def forever():
+        try:
+            while True:
+                yield 1
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    stream = ResponseStream(connection, "UUID", forever())
+    assert stream.deadline == 0
+    stream.deadline = monotonic() + 0.05
+    await stream.run()
+    assert connection.written[-1] == dict(
+        uuid="UUID", seq=stream.seq, error="timeout")
+    assert 1 < stream.seq < 10
+    assert closed == [True]
+    assert connection.streams == {}
+    assert connection.app.runner.timeouts == 1
+    # streams that finish in time end as usual
+    stream = ResponseStream(connection, "UUID", items(1))
+    stream.deadline = monotonic() + 10
+    await stream.run()
+    assert connection.written[-1] == dict(uuid="UUID", seq=1, done=True)
+    assert connection.app.runner.timeouts == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_queue_backpressure():
+    connection = MockConnection()
+    send = AsyncMock()
+    connection.queue = SendQueue("WS", send, 4)
+    for i in range(3):
+        connection.queue.put(i)
+    stream = ResponseStream(connection, "UUID", items(1))
+    task = asyncio.ensure_future(stream.run())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    # waits for the queue to drain below half full
+    assert connection.written == []
+    connection.queue.start(asyncio.get_event_loop())
+    await task
+    assert len(connection.written) == 2
+    assert len(send.call_args_list) == 3
+    connection.queue.close()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import signal
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from pluggable.socket.drain import HANDOFF_ENV
+from pluggable.socket.logger import WARNING
+from pluggable.socket.supervisor import (
+    WORKER_ENV,
+    WORKER_READY_ENV,
+    serving,
+    Py__SocketSupervisor as SocketSupervisor)
+
+from .base import AsyncMock, nested
+
+
+def test_supervisor_signature():
+    with pytest.raises(TypeError):
+        SocketSupervisor()
+
+
+def test_supervisor():
+    supervisor = SocketSupervisor("APP", 3)
+    assert supervisor.app == "APP"
+    assert supervisor.processes == 3
+    assert supervisor.restart_delay == 1.0
+    assert supervisor.children == {}
+    assert supervisor.started == {}
+    assert not supervisor.stopping
+
+
+@pytest.mark.asyncio
+async def test_supervisor_run():
+    app = MagicMock()
+    supervisor = SocketSupervisor(app, 3)
+    _patch = patch(
+        'pluggable.socket.supervisor.Py__SocketSupervisor.supervise',
+        new_callable=AsyncMock)
+    with _patch as supervise_m:
+        await supervisor.run()
+    assert (
+        [c[0] for c in supervise_m.call_args_list]
+        == [(0, ), (1, ), (2, )])
+    assert (
+        [c[0] for c in app.loop.add_signal_handler.call_args_list]
+        == [(signal.SIGTERM, supervisor.stop),
+            (signal.SIGINT, supervisor.stop),
+            (signal.SIGUSR2, supervisor.restart)])
+    assert app.loop.stop.called
+
+
+@pytest.mark.asyncio
+async def test_supervisor_spawn():
+    app = MagicMock()
+    supervisor = SocketSupervisor(app, 3)
+    _patches = nested(
+        patch('pluggable.socket.supervisor.asyncio.create_subprocess_exec',
+              new_callable=AsyncMock),
+        patch('pluggable.socket.supervisor.sys'),
+        patch('pluggable.socket.supervisor.os.pipe', return_value=(7, 8)),
+        patch('pluggable.socket.supervisor.os.close'),
+        patch.dict(
+            'pluggable.socket.supervisor.os.environ',
+            {"FOO": "BAR", HANDOFF_ENV: "3,4"}))
+    with _patches as (exec_m, sys_m, pipe_m, close_m, env_m):
+        sys_m.argv = ["SCRIPT", "ARG"]
+        process = await supervisor.spawn(2)
+    assert process is exec_m.return_value
+    assert (
+        [c[0] for c in exec_m.call_args_list]
+        == [(sys_m.executable, "SCRIPT", "ARG")])
+    assert exec_m.call_args[1]["env"]["FOO"] == "BAR"
+    assert exec_m.call_args[1]["env"][WORKER_ENV] == "2"
+    assert exec_m.call_args[1]["env"][WORKER_READY_ENV] == "8"
+    assert exec_m.call_args[1]["pass_fds"] == (8, )
+    assert HANDOFF_ENV not in exec_m.call_args[1]["env"]
+    # the supervisor keeps only the read end
+    assert [c[0] for c in close_m.call_args_list] == [(8, )]
+    assert supervisor.started == {2: app.loop.create_task.return_value}
+    started = app.loop.create_task.call_args[0][0]
+    assert started.cr_code.co_name == "wait_started"
+    started.close()
+
+
+@pytest.mark.asyncio
+async def test_supervisor_wait_started():
+    app = MagicMock()
+    app.loop = asyncio.get_event_loop()
+    supervisor = SocketSupervisor(app, 1)
+    read, write = os.pipe()
+    _patch = patch.dict(
+        'pluggable.socket.supervisor.os.environ',
+        {WORKER_READY_ENV: str(write)})
+    with _patch:
+        serving()
+        assert WORKER_READY_ENV not in os.environ
+        # only once
+        serving()
+    assert await supervisor.wait_started(read)
+    read, write = os.pipe()
+    # the worker exited without serving
+    os.close(write)
+    assert not await supervisor.wait_started(read)
+
+
+@pytest.mark.asyncio
+async def test_supervisor_supervise():
+    app = MagicMock()
+    supervisor = SocketSupervisor(app, 1, 0.0)
+    processes = [AsyncMock(pid=1), AsyncMock(pid=2)]
+    processes[0].wait.return_value = 1
+
+    def _wait():
+        supervisor.stopping = True
+        return 0
+
+    processes[1].wait.side_effect = _wait
+    _patch = patch(
+        'pluggable.socket.supervisor.Py__SocketSupervisor.spawn',
+        new_callable=AsyncMock,
+        side_effect=processes)
+    with _patch as spawn_m:
+        await supervisor.supervise(0)
+    assert (
+        [c[0] for c in spawn_m.call_args_list]
+        == [(0, ), (0, )])
+    assert supervisor.children == {0: processes[1]}
+    assert (
+        [c[0][2] for c in app.logger.log.call_args_list]
+        == [('started', 0, 1),
+            ('exited', 0, 1),
+            ('started', 0, 2)])
+
+
+def test_supervisor_stop():
+    supervisor = SocketSupervisor(MagicMock(), 2)
+    running = MagicMock(returncode=None)
+    exited = MagicMock(returncode=0)
+    supervisor.children = {0: running, 1: exited}
+    supervisor.stop()
+    assert supervisor.stopping
+    assert running.terminate.called
+    assert not exited.terminate.called
+
+
+def test_supervisor_restart():
+    app = MagicMock()
+    supervisor = SocketSupervisor(app, 2)
+    supervisor.restart()
+    assert (
+        [c[0][0].cr_code.co_name
+         for c in app.loop.create_task.call_args_list]
+        == ["roll"])
+    app.loop.create_task.call_args[0][0].close()
+    supervisor.restarting = True
+    supervisor.restart()
+    assert len(app.loop.create_task.call_args_list) == 1
+
+
+@pytest.mark.asyncio
+async def test_supervisor_roll():
+    supervisor = SocketSupervisor(MagicMock(), 2, 0.0)
+    terminated = []
+    started = asyncio.get_event_loop().create_future()
+    started.set_result(True)
+    supervisor.started = {0: started, 1: started}
+
+    def MockProcess(index, returncode=None):
+        process = MagicMock(returncode=returncode)
+
+        async def wait():
+            terminated.append(index)
+            # as ``supervise`` would
+            supervisor.children[index] = MagicMock(returncode=None)
+
+        process.wait = wait
+        return process
+
+    old = {0: MockProcess(0), 1: MockProcess(1, 0)}
+    supervisor.children = dict(old)
+
+    async def replaced():
+        supervisor.children[1] = MagicMock(returncode=None)
+
+    _patch = patch(
+        'pluggable.socket.supervisor.asyncio.sleep',
+        new=lambda delay: replaced())
+    with _patch:
+        await supervisor.roll()
+    assert old[0].terminate.called
+    # exited workers are only waited on to be replaced
+    assert not old[1].terminate.called
+    assert terminated == [0]
+    assert supervisor.children[0] is not old[0]
+    assert supervisor.children[1] is not old[1]
+    assert not supervisor.restarting
+
+
+@pytest.mark.asyncio
+async def test_supervisor_roll_failed():
+    app = MagicMock()
+    supervisor = SocketSupervisor(app, 2, 0.0)
+    old = {
+        0: MagicMock(returncode=None, wait=AsyncMock()),
+        1: MagicMock(returncode=None, wait=AsyncMock())}
+    supervisor.children = dict(old)
+
+    def _wait():
+        supervisor.children[0] = MagicMock(returncode=None)
+
+    old[0].wait.side_effect = _wait
+    failed = asyncio.get_event_loop().create_future()
+    failed.set_result(False)
+    supervisor.started = {0: failed}
+    await supervisor.roll()
+    assert old[0].terminate.called
+    # the others keep serving
+    assert not old[1].terminate.called
+    assert (
+        [c[0] for c in app.logger.log.call_args_list]
+        == [(WARNING, 'app.supervisor:', ('restart failed', 0))])
+    assert not supervisor.restarting
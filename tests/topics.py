@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from pluggable.socket.topics import Py__TopicIndex as TopicIndex
+
+
+def test_topics():
+    topics = TopicIndex()
+    assert topics.topics == {}
+    assert topics.prefixes == {}
+    assert topics.subscriptions == {}
+    assert len(topics) == 0
+
+
+def test_topics_subscribe():
+    topics = TopicIndex()
+    assert topics.subscribe(1, "foo")
+    assert not topics.subscribe(1, "foo")
+    assert topics.subscribe(2, "foo")
+    assert topics.subscribe(2, "foo.*")
+    assert topics.subscribe(3, "*")
+    assert topics.topics == {"foo": {1, 2}}
+    assert topics.prefixes == {"foo.": {2}, "": {3}}
+    assert topics.subscriptions == {1: {"foo"}, 2: {"foo", "foo.*"}, 3: {"*"}}
+    assert len(topics) == 3
+
+
+def test_topics_match():
+    topics = TopicIndex()
+    assert topics.match("foo") == set()
+    topics.subscribe(1, "foo")
+    topics.subscribe(2, "foo.*")
+    topics.subscribe(3, "foo.bar")
+    topics.subscribe(4, "foo.bar*")
+    assert topics.match("foo") == {1}
+    assert topics.match("foo.") == {2}
+    assert topics.match("foo.bar") == {2, 3, 4}
+    assert topics.match("foo.barbaz") == {2, 4}
+    assert topics.match("bar") == set()
+    topics.subscribe(5, "*")
+    assert topics.match("bar") == {5}
+    # matches are copies
+    topics.match("foo").add(7)
+    assert topics.match("foo") == {1, 5}
+
+
+def test_topics_unsubscribe():
+    topics = TopicIndex()
+    topics.subscribe(1, "foo")
+    topics.subscribe(1, "foo.*")
+    topics.subscribe(2, "foo.*")
+    assert not topics.unsubscribe(1, "bar")
+    assert not topics.unsubscribe(3, "foo")
+    assert topics.unsubscribe(1, "foo.*")
+    assert not topics.unsubscribe(1, "foo.*")
+    assert topics.prefixes == {"foo.": {2}}
+    assert topics.unsubscribe(1, "foo")
+    assert topics.topics == {}
+    assert topics.subscriptions == {2: {"foo.*"}}
+    assert topics.unsubscribe(2, "foo.*")
+    assert topics.prefixes == {}
+    assert topics.subscriptions == {}
+
+
+def test_topics_remove():
+    topics = TopicIndex()
+    topics.subscribe(1, "foo")
+    topics.subscribe(1, "bar.*")
+    topics.subscribe(2, "foo")
+    topics.remove(1)
+    topics.remove(3)
+    assert topics.topics == {"foo": {2}}
+    assert topics.prefixes == {}
+    assert topics.subscriptions == {2: {"foo"}}
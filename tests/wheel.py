@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from pluggable.socket.wheel import Py__TimerWheel as TimerWheel
+
+
+def test_wheel_signature():
+    with pytest.raises(TypeError):
+        TimerWheel()
+
+
+def test_wheel():
+    callback = MagicMock()
+    wheel = TimerWheel(1.0, 8, callback)
+    assert wheel.tick == 1.0
+    assert wheel.size == 8
+    assert wheel.callback is callback
+    assert wheel.logger is None
+    assert len(wheel.slots) == 8
+    assert wheel.timers == {}
+    assert wheel.cursor == 0
+    assert wheel.task is None
+    wheel.schedule("FOO", 2)
+    wheel.schedule("BAR", 2.5)
+    wheel.schedule("BAZ", 0)
+    assert len(wheel) == 3
+    assert "FOO" in wheel
+    assert wheel.timers == dict(FOO=2, BAR=3, BAZ=1)
+    assert wheel.advance() == ["BAZ"]
+    assert wheel.advance() == ["FOO"]
+    assert wheel.advance() == ["BAR"]
+    assert wheel.advance() == []
+    assert (
+        [c[0] for c in callback.call_args_list]
+        == [("BAZ", ), ("FOO", ), ("BAR", )])
+    assert len(wheel) == 0
+    assert "FOO" not in wheel
+
+
+def test_wheel_turns():
+    callback = MagicMock()
+    wheel = TimerWheel(1.0, 4, callback)
+    wheel.schedule("FOO", 9)
+    wheel.schedule("BAR", 4)
+    assert wheel.slots[1] == dict(FOO=2)
+    assert wheel.slots[0] == dict(BAR=0)
+    due = [wheel.advance() for _ in range(9)]
+    assert due == [[], [], [], ["BAR"], [], [], [], [], ["FOO"]]
+
+
+def test_wheel_reschedule():
+    callback = MagicMock()
+    wheel = TimerWheel(1.0, 4, callback)
+    wheel.schedule("FOO", 1)
+    wheel.schedule("FOO", 3)
+    assert wheel.timers == dict(FOO=3)
+    assert wheel.slots[1] == {}
+    wheel.cancel("FOO")
+    wheel.cancel("BAR")
+    assert len(wheel) == 0
+    assert [wheel.advance() for _ in range(4)] == [[], [], [], []]
+    assert not callback.called
+
+
+def test_wheel_callback_reschedule():
+    wheel = TimerWheel(1.0, 4, None)
+    fired = []
+
+    def callback(key):
+        fired.append((wheel.cursor, key))
+        wheel.schedule(key, 4)
+
+    wheel.callback = callback
+    wheel.schedule("FOO", 1)
+    for _ in range(9):
+        wheel.advance()
+    assert fired == [(1, "FOO"), (1, "FOO"), (1, "FOO")]
+
+
+def test_wheel_callback_error():
+    logger = MagicMock()
+    wheel = TimerWheel(1.0, 4, None, logger)
+    fired = []
+
+    def callback(key):
+        fired.append(key)
+        if key == "FOO":
+            raise Exception("FAIL")
+
+    wheel.callback = callback
+    wheel.schedule("FOO", 1)
+    wheel.schedule("BAR", 1)
+    # the other timers still fire
+    assert wheel.advance() == ["FOO", "BAR"]
+    assert fired == ["FOO", "BAR"]
+    assert (
+        [c[0] for c in logger.log.call_args_list]
+        == [(40, 'app.wheel:', ("FOO", "Exception('FAIL')"))])
+    # without a logger the error is dropped
+    wheel.logger = None
+    wheel.schedule("FOO", 1)
+    assert wheel.advance() == ["FOO"]
+
+
+def test_wheel_start():
+    wheel = TimerWheel(1.0, 4, MagicMock())
+    loop = MagicMock()
+    wheel.start(loop)
+    assert wheel.task is loop.create_task.return_value
+    assert (
+        [c[0][0].cr_code.co_name for c in loop.create_task.call_args_list]
+        == ["run"])
+    loop.create_task.call_args[0][0].close()
+    task = wheel.task
+    wheel.stop()
+    assert wheel.task is None
+    assert task.cancel.called
+    wheel.stop()
+
+
+@pytest.mark.asyncio
+async def test_wheel_run(mocker):
+    callback = MagicMock()
+    wheel = TimerWheel(0.01, 4, callback)
+    wheel.schedule("FOO", 0.01)
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 2:
+            raise Exception("STOP")
+
+    mocker.patch("pluggable.socket.wheel.asyncio.sleep", new=sleep)
+    with pytest.raises(Exception):
+        await wheel.run()
+    assert sleeps == [0.01, 0.01, 0.01]
+    assert wheel.cursor == 2
+    assert [c[0] for c in callback.call_args_list] == [("FOO", )]